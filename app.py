@@ -13,9 +13,11 @@ import csv
 import threading
 import time
 import secrets
+import random
 
 from tracking_models import VisitorSession, OfflineCampaign, TrafficSpike
 from tracking_routes import tracking_bp
+from batch_routes import batch_bp
 import pytz
 import user_agents 
 
@@ -23,11 +25,30 @@ from psycogreen.gevent import patch_psycopg
 patch_psycopg()
 
 
-from flask import Flask, render_template, request, jsonify, send_file, Response, send_from_directory, session
+from flask import Flask, render_template, request, jsonify, send_file, Response, session
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from rate_limiting import TRACKING_ENDPOINTS, get_rate_limit_key, install_local_precheck, is_rate_limit_exempt
+from static_assets import AssetManifest, serve_static_file, send_manifest_entry
+from page_cache import PageCache
+from credit_cache import CreditReportCache
+from upstream_guard import UpstreamGuard, AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+from rollups import install_rollup_hooks, count_pending, lead_metric, rollup_buffer, read_rollups, backfill_rollups
+from log_config import configure_logging, truncate, redact_xml, redact_headers, redact_secret, sampled, queue_state as log_queue_state
+from instrumentation import (
+    timed_upstream, timed_lender_match, instrument_boto_client, instrument_engine, instrument_sessions,
+    instrument_flask, render_metrics, StageClock
+)
+from tracing import trace_flask, trace_requests, trace_engine, trace_boto_client, current_span, exporter as span_exporter
+from profiler import profile as run_profile, dump_state, register_pool_state, install_signal_handler, ProfileBusy
+from query_audit import audit_engine, audit_flask, audited
+from webhook_dispatcher import dispatcher as webhook_dispatcher, enqueue as enqueue_webhook, outbox_backlog
+from table_maintenance import ensure_partitions as ensure_log_partitions, migrate_log_tables, maintain_log_tables
+from eligibility import EligibilityEngine
+from flg_xml import ClaimFragments, build_lead_xml as build_flg_lead_xml
 
 import requests
+import urllib3
 import boto3
 import botocore
 import hashlib
@@ -35,11 +56,10 @@ import re
 import hmac
 from collections import Counter
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Date, Text, Float, ForeignKey, Index, func, or_, and_, Enum, DECIMAL, text
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Boolean, DateTime, Date, Text, Float, ForeignKey, Index, UniqueConstraint, func, or_, and_, Enum, DECIMAL, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, scoped_session, joinedload
-from sqlalchemy.exc import SQLAlchemyError
-from dateutil import parser as date_parser
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 
 def format_addresses_for_flg(previous_address, previous_previous_address):
     """Stub function - just returns empty string"""
@@ -130,6 +150,8 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", os.urandom(32).hex())
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    PROFILER_KEY = os.getenv("PROFILER_KEY", "")  # /admin/profile and /admin/greenlets are off without it
+    BATCH_ADMIN_KEY = os.getenv("BATCH_ADMIN_KEY", "")  # /batch/jobs*, /batch/claims and /batch/export are off without it
     
     # Google Analytics
     GOOGLE_ANALYTICS_ID = os.getenv("GOOGLE_ANALYTICS_ID", "")
@@ -173,49 +195,103 @@ class Config:
     # Fuzzy matching thresholds
     LENDER_FUZZY_MATCH_THRESHOLD = int(os.getenv("LENDER_FUZZY_MATCH_THRESHOLD", "80"))
 
+    # Rate limiting - shared across all gunicorn workers when Redis is available
+    RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI") or os.getenv("REDIS_URL") or "memory://"
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "moving-window")
+    RATELIMIT_DEFAULT = os.getenv("RATELIMIT_DEFAULT", "500 per hour")
+    RATELIMIT_TRACKING = os.getenv("RATELIMIT_TRACKING", "2000 per hour")  # event beacons, per endpoint
+    RATELIMIT_LOCAL_PRECHECK = os.getenv("RATELIMIT_LOCAL_PRECHECK", "true").lower() == "true"
+
+    # Rendered page cache for index/thankyou
+    PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+
+    # Credit report cache - repeat identities reuse the Equifax report instead of a new paid call
+    CREDIT_CACHE_ENABLED = os.getenv("CREDIT_CACHE_ENABLED", "true").lower() == "true"
+    CREDIT_CACHE_TTL_SECONDS = int(os.getenv("CREDIT_CACHE_TTL_SECONDS", "86400"))
+    CREDIT_CACHE_REDIS_URL = os.getenv("CREDIT_CACHE_REDIS_URL") or os.getenv("REDIS_URL")
+    CREDIT_CACHE_LOCAL_ENTRIES = int(os.getenv("CREDIT_CACHE_LOCAL_ENTRIES", "100"))
+
+    # Upstream protection - adaptive concurrency limit + circuit breaker per upstream (per process)
+    UPSTREAM_GUARD_ENABLED = os.getenv("UPSTREAM_GUARD_ENABLED", "true").lower() == "true"
+    UPSTREAM_QUEUE_WAIT_SECONDS = float(os.getenv("UPSTREAM_QUEUE_WAIT_SECONDS", "10"))
+    UPSTREAM_BREAKER_FAILURE_RATE = float(os.getenv("UPSTREAM_BREAKER_FAILURE_RATE", "0.5"))
+    UPSTREAM_BREAKER_OPEN_SECONDS = float(os.getenv("UPSTREAM_BREAKER_OPEN_SECONDS", "15"))
+    VALIFI_REPORT_CONCURRENCY = int(os.getenv("VALIFI_REPORT_CONCURRENCY", "20"))
+    VALIFI_REPORT_MAX_CONCURRENCY = int(os.getenv("VALIFI_REPORT_MAX_CONCURRENCY", "100"))
+    VALIFI_REPORT_SLOW_SECONDS = float(os.getenv("VALIFI_REPORT_SLOW_SECONDS", "30"))
+    VALIFI_IDENTITY_CONCURRENCY = int(os.getenv("VALIFI_IDENTITY_CONCURRENCY", "20"))
+    VALIFI_IDENTITY_MAX_CONCURRENCY = int(os.getenv("VALIFI_IDENTITY_MAX_CONCURRENCY", "100"))
+    VALIFI_IDENTITY_SLOW_SECONDS = float(os.getenv("VALIFI_IDENTITY_SLOW_SECONDS", "10"))
+    FLG_CONCURRENCY = int(os.getenv("FLG_CONCURRENCY", "20"))
+    FLG_MAX_CONCURRENCY = int(os.getenv("FLG_MAX_CONCURRENCY", "100"))
+    FLG_SLOW_SECONDS = float(os.getenv("FLG_SLOW_SECONDS", "10"))
+
+# Eligibility windows parsed once at startup
+eligibility_engine = EligibilityEngine.from_config(Config)
 
 # === SECTION SEPARATOR ===
-app = Flask(__name__, 
-            static_folder='static',
-            static_url_path='/static')
-
-def get_ipaddr():
-    """Get client IP address from request headers"""
-    # Check X-Forwarded-For header first (for proxies/load balancers)
-    if request.headers.get('X-Forwarded-For'):
-        # Take the first IP if multiple are present
-        ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    elif request.headers.get('X-Real-IP'):
-        ip = request.headers.get('X-Real-IP')
-    else:
-        ip = request.remote_addr
-    return ip or '0.0.0.0'
-
-def get_rate_limit_key():
-    """Custom rate limit key including session ID"""
-    # Use IP + session_id for more granular limiting
-    ip = get_ipaddr()
-    
-    # Safely get session_id only from JSON requests
-    session_id = ''
-    try:
-        if request.is_json and request.json:
-            session_id = request.json.get('session_id', '')
-    except Exception:
-        pass  # Not a JSON request, just use IP
-    
-    return f"{ip}:{session_id}" if session_id else ip
+# No built-in static route - /static is served by serve_static so the built copies are used
+app = Flask(__name__, static_folder=None)
+
+# Rate limiting - shared storage (Redis moving window) when configured, with a
+# local pre-check so obvious offenders never cost a storage round trip
+if Config.RATELIMIT_LOCAL_PRECHECK and not Config.RATELIMIT_STORAGE_URI.startswith("memory://"):
+    install_local_precheck(
+        app, Config.RATELIMIT_DEFAULT, get_rate_limit_key,
+        endpoint_limits={endpoint: Config.RATELIMIT_TRACKING for endpoint in TRACKING_ENDPOINTS}
+    )
 
 limiter = Limiter(
     app=app,
     key_func=get_rate_limit_key,
-    default_limits=["500 per hour"],
-    storage_uri="memory://",
+    default_limits=[Config.RATELIMIT_DEFAULT],
+    storage_uri=Config.RATELIMIT_STORAGE_URI,
+    strategy=Config.RATELIMIT_STRATEGY,
+    in_memory_fallback_enabled=True,  # Keep limiting per-worker if Redis is unreachable
     swallow_errors=True  # Don't crash on limiter errors
 )
+limiter.request_filter(is_rate_limit_exempt)
 
 app.config.from_object(Config)
 app.register_blueprint(tracking_bp, url_prefix='/tracking')
+app.register_blueprint(batch_bp, url_prefix='/batch')
+
+# Tracking beacons fire several times per page view - their own limit replaces the default
+# (the limit is checked by the decorator's wrapper, so it replaces the registered view)
+for endpoint in TRACKING_ENDPOINTS:
+    app.view_functions[endpoint] = limiter.limit(Config.RATELIMIT_TRACKING)(app.view_functions[endpoint])
+
+# Request latency histograms for /metrics/prometheus
+instrument_flask(app)
+
+# Trace id per request (continued from traceparent), carried into Celery and outbound HTTP
+trace_flask(app)
+trace_requests()
+
+# Statement counts per request - N+1 patterns and slow statements are logged with the route
+audit_flask(app)
+
+# Sampling profiler and greenlet/pool dumps - /admin/profile, /admin/greenlets or PROFILER_SIGNAL
+register_pool_state("upstreams", lambda: {guard.name: guard.snapshot() for guard in upstream_guards})
+register_pool_state("log_queue", log_queue_state)
+register_pool_state("span_exporter", span_exporter.state)
+register_pool_state("webhook_dispatcher", webhook_dispatcher.state)
+install_signal_handler()
+
+# Fingerprinted asset URLs for templates (falls back to plain URLs until build_assets.py has run)
+asset_manifest = AssetManifest(auto_reload=Config.DEBUG)
+app.jinja_env.globals['asset_url'] = asset_manifest.url
+
+# Rendered page cache for index/thankyou (disabled in DEBUG so template edits show immediately)
+page_cache = PageCache(enabled=Config.PAGE_CACHE_ENABLED and not Config.DEBUG)
+
+# Credit reports by identity fingerprint (Redis is only contacted on first use)
+credit_report_cache = CreditReportCache(
+    ttl_seconds=Config.CREDIT_CACHE_TTL_SECONDS,
+    redis_url=Config.CREDIT_CACHE_REDIS_URL,
+    enabled=Config.CREDIT_CACHE_ENABLED,
+    max_local_entries=Config.CREDIT_CACHE_LOCAL_ENTRIES
+)
 
 # Security headers - add after app.register_blueprint(tracking_bp)
 # CORS approved origins for cross-domain API access
@@ -277,11 +353,13 @@ if Config.DEBUG:
     app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
 # === SECTION SEPARATOR ===
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Queued (non-blocking) root handler; LOG_LEVELS sets per-subsystem levels, e.g. app.valifi=DEBUG
+configure_logging(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
+valifi_logger = logging.getLogger("app.valifi")
+flg_logger = logging.getLogger("app.flg")
+lender_logger = logging.getLogger("app.lenders")
+flg_webhook_logger = logging.getLogger("app.flg_webhook")
 
 # Celery configuration - detects if Celery should be used
 USE_CELERY = os.getenv("USE_CELERY", "false").lower() == "true"
@@ -289,7 +367,7 @@ USE_CELERY = os.getenv("USE_CELERY", "false").lower() == "true"
 # Import Celery task only if enabled
 if USE_CELERY:
     try:
-        from tasks import process_flg_leads_async
+        from tasks import process_flg_leads_async, drain_webhook_outbox, select_queue, lane_options
         logger.info("✓ Celery enabled - background tasks will use Celery workers")
     except ImportError as e:
         logger.warning(f"⚠ Celery import failed: {e}. Falling back to direct processing.")
@@ -297,6 +375,14 @@ if USE_CELERY:
 else:
     logger.info("✓ Celery disabled - background tasks will process synchronously")
 
+if not USE_CELERY:
+    # Web workers deliver the webhook outbox themselves - start each worker's drain loop with
+    # its first request (gunicorn forks after --preload, so a thread started at import would
+    # only exist in the master). With Celery the webhook-lane workers run it.
+    @app.before_request
+    def start_webhook_dispatcher():
+        webhook_dispatcher.start()
+
 # === SECTION SEPARATOR ===
 Base = declarative_base()
 
@@ -488,6 +574,12 @@ class LeadIDTracking(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+    # Existing databases get these from `python app.py migrate-log-tables` (table_maintenance.py)
+    __table_args__ = (
+        Index('ix_lead_ids_tracking_claim_id', 'claim_id'),
+        Index('ix_lead_ids_tracking_lead_group_status', 'lead_group', 'current_status'),
+    )
+
 class ClaimLenderMatch(Base):
     __tablename__ = 'claim_lender_matches'
     
@@ -544,6 +636,13 @@ class WebhookLog(Base):
     error_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Partitioned by month of created_at once `python app.py migrate-log-tables` has run
+    # (table_maintenance.py) - the partitioned table has no primary key constraint, ids come from the sequence
+    __table_args__ = (
+        Index('ix_webhook_logs_lead_id_created_at', 'lead_id', 'created_at'),
+        Index('ix_webhook_logs_lead_group_status', 'lead_group', 'status_received', 'created_at'),
+    )
+
 class LeadLenderTracking(Base):
     __tablename__ = 'lead_lender_tracking'
     
@@ -559,108 +658,186 @@ class LeadLenderTracking(Base):
     position_in_claim = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-# PRODUCTION DATABASE CONFIG - READY FOR LAUNCH
-try:
-    import os
-    
-    db_url = Config.DATABASE_URL
-    if db_url and db_url.startswith("postgres://"):
-        db_url = db_url.replace("postgres://", "postgresql://", 1)
-    
-    if "?" in db_url:
-        db_url = db_url.split("?")[0]
-    
-    db_url = f"{db_url}?sslmode=disable"
-    
-    # IMPORTANT: Add psycogreen patch at top of file
-    # from psycogreen.gevent import patch_psycopg
-    # patch_psycopg()
-    
-    from sqlalchemy.pool import NullPool
-    
-    engine = create_engine(
-        db_url,
-        poolclass=NullPool,  # Let PostgreSQL handle ALL pooling
-        
-        connect_args={
-            "connect_timeout": 10,
-            "options": "-c statement_timeout=30000"
-        }
-    )
-    
-    # Quick test
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1")).scalar()
-    
-    Base.metadata.create_all(engine)
-    
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db_session = scoped_session(SessionLocal)
-    
-    logger.info("Database ready for production launch - using PostgreSQL native pooling")
-    
-    # Fix any sequence issues on startup
-    try:
-        sequence_result = fix_database_sequences()
-        if sequence_result.get("fixed"):
-            logger.info(f"Startup sequence fix: {sequence_result['fixed']}")
-    except Exception as e:
-        logger.warning(f"Could not fix sequences on startup: {e}")
+class BatchJob(Base):
+    """Server-side batch import (replaces the browser loop in batch.html)"""
+    __tablename__ = 'batch_jobs'
 
+    id = Column(Integer, primary_key=True)
+    filename = Column(String(255))
+    campaign = Column(String(255))
+    status = Column(String(20), default='running', index=True)  # running / paused / completed / cancelled
+    concurrency = Column(Integer, default=4)  # max records (or chunks, when chunked) in flight at once
+    chunk_size = Column(Integer, default=1)  # records per worker message (1 = one task per record)
+    rate_per_minute = Column(Integer, default=60)  # Valifi calls per minute for this batch
+    next_dispatch_at = Column(DateTime)  # rate limit slot for the next record
+    total_records = Column(Integer, default=0)
+    skip_flg = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = Column(DateTime)
 
-except Exception as e:
-    logger.error(f"Database init failed: {e}")
-    raise
+class BatchRecord(Base):
+    """One CSV/XLSX row of a batch import and its processing state"""
+    __tablename__ = 'batch_records'
 
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(Integer, ForeignKey('batch_jobs.id', ondelete='CASCADE'), nullable=False)
+    row_number = Column(Integer, nullable=False)
+    status = Column(String(20), default='pending')  # pending / queued / processing / done / failed / skipped
+    row_data = Column(Text)  # original row as JSON
+    claim_id = Column(Integer)
+    result = Column(Text)  # lead ids, pdf url, valifi reference as JSON
+    error = Column(Text)
+    attempts = Column(Integer, default=0)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_batch_records_batch_status', 'batch_id', 'status'),
+    )
 
+class LeadWorkItem(Base):
+    """
+    One FLG lead send for a claim. Retries of process_flg_leads_background skip items
+    that were already sent (reusing flg_lead_id) and only resend pending/failed ones.
+    'unknown' items (the request may have reached FLG) are never resent automatically -
+    check FLG, then set them to 'sent' (with flg_lead_id) or 'pending'.
+    """
+    __tablename__ = 'lead_work_items'
 
-except Exception as e:
-    logger.error(f"Database initialization failed: {e}")
-    # Try one more time with minimal config
-    try:
-        logger.info("Retrying with minimal configuration...")
-        simple_url = Config.DATABASE_URL.replace("postgres://", "postgresql://")
-        if "?" in simple_url:
-            simple_url = simple_url.split("?")[0]
-        simple_url = f"{simple_url}?sslmode=disable"
-        
-        engine = create_engine(simple_url, pool_pre_ping=True)
-        Base.metadata.create_all(engine)
-        SessionLocal = sessionmaker(bind=engine)
-        db_session = scoped_session(SessionLocal)
-        logger.info("Database connected with fallback configuration")
-    except:
-        raise
+    id = Column(Integer, primary_key=True)
+    claim_id = Column(Integer, ForeignKey('claims_tracking.id'), nullable=False)
+    lead_type = Column(String(10), nullable=False)  # DCA / IRL
+    work_key = Column(String(64), nullable=False)  # hash of lender + account number (+ occurrence)
+    lender_name = Column(String(255))
+    account_number = Column(String(100))
+    payload_hash = Column(String(64))  # sha256 of the XML last sent
+    status = Column(String(20), default='pending')  # pending / sending / sent / failed / unknown
+    flg_lead_id = Column(String(50))
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('claim_id', 'lead_type', 'work_key', name='uq_lead_work_items_claim_type_key'),
+    )
 
+class MetricRollup(Base):
+    """
+    Counter per (granularity, bucket, metric) - minute / day / total buckets of visits,
+    form starts and completions, claims and leads by type. Maintained by rollups.py.
+    """
+    __tablename__ = 'metric_rollups'
 
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(10), nullable=False)  # minute / day / total
+    bucket_start = Column(DateTime, nullable=False)  # UTC; 1970-01-01 for total
+    metric = Column(String(50), nullable=False)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
-# === SECTION SEPARATOR ===
-try:
-    # S3 client - keep in eu-north-1 (where bucket exists)
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
-        region_name="eu-north-1",  # Hardcoded to Stockholm where bucket is
+    __table_args__ = (
+        UniqueConstraint('granularity', 'bucket_start', 'metric', name='uq_metric_rollups_bucket'),
     )
-    logger.info("S3 client initialized successfully (eu-north-1)")
-except Exception as e:
-    logger.error(f"Failed to initialize S3 client: {e}")
-    s3_client = None
-
-# SNS client - use eu-west-2 for UK SMS
-try:
-    sns_client = boto3.client(
-        "sns",
-        aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
-        region_name="eu-west-2",  # London region for SMS
+
+class WebhookOutbox(Base):
+    """
+    One outbound lead-id webhook waiting for (or done with) delivery. Written by
+    send_lead_ids_to_webhook and drained by webhook_dispatcher.py.
+    """
+    __tablename__ = 'webhook_outbox'
+
+    id = Column(Integer, primary_key=True)
+    claim_id = Column(Integer)
+    webhook_url = Column(Text, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON body, {"leads": [...]}
+    status = Column(String(20), nullable=False, default='pending')  # pending / sending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # lease expiry while sending
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_webhook_outbox_status_next_attempt', 'status', 'next_attempt_at'),
     )
-    logger.info("SNS client initialized successfully (eu-west-2)")
-except Exception as e:
-    logger.error(f"Failed to initialize SNS client: {e}")
-    sns_client = None
+
+# PRODUCTION DATABASE CONFIG - READY FOR LAUNCH
+# create_engine() does not connect - the first query does. The connectivity check, schema
+# creation and sequence fixes run in the one-shot bootstrap command (python app.py bootstrap),
+# so importing this module (gunicorn workers, Celery children, blueprints) does no I/O.
+from sqlalchemy.pool import NullPool
+
+def build_database_url(database_url):
+    """
+    SQLAlchemy URL for DATABASE_URL (no query string, sslmode=disable).
+    The driver is pinned to psycopg2 (requirements.txt, psycogreen) - SQLAlchemy 2.1
+    otherwise defaults postgresql:// to psycopg 3.
+    """
+    if not database_url:
+        raise RuntimeError("DATABASE_URL is not configured")
+    for scheme in ("postgres://", "postgresql://"):
+        if database_url.startswith(scheme):
+            database_url = "postgresql+psycopg2://" + database_url[len(scheme):]
+    if "?" in database_url:
+        database_url = database_url.split("?")[0]
+    return f"{database_url}?sslmode=disable"
+
+engine = create_engine(
+    build_database_url(Config.DATABASE_URL),
+    poolclass=NullPool,  # Let PostgreSQL handle ALL pooling
+    
+    connect_args={
+        "connect_timeout": 10,
+        "options": "-c statement_timeout=30000"
+    }
+)
+
+instrument_engine(engine)
+trace_engine(engine)
+audit_engine(engine)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+db_session = scoped_session(SessionLocal)
+instrument_sessions(SessionLocal)
+
+# Committed visits / form events / claims / leads feed the /metrics rollups
+install_rollup_hooks(SessionLocal)
+
+
+# === SECTION SEPARATOR ===
+# AWS clients - created on first use (boto3 client construction loads the service model)
+_aws_clients = {}
+_aws_clients_lock = threading.Lock()
+
+def get_aws_client(service, region_name):
+    """Cached boto3 client, or None when it can't be created"""
+    key = (service, region_name)
+    if key not in _aws_clients:
+        with _aws_clients_lock:
+            if key not in _aws_clients:
+                try:
+                    _aws_clients[key] = trace_boto_client(instrument_boto_client(boto3.client(
+                        service,
+                        aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
+                        region_name=region_name,
+                    )))
+                    logger.info(f"{service.upper()} client initialized successfully ({region_name})")
+                except Exception as e:
+                    logger.error(f"Failed to initialize {service.upper()} client: {e}")
+                    _aws_clients[key] = None
+    return _aws_clients[key]
+
+def get_s3_client():
+    """S3 client - keep in eu-north-1 (where bucket exists)"""
+    return get_aws_client("s3", "eu-north-1")
+
+def get_sns_client():
+    """SNS client - use eu-west-2 (London) for UK SMS"""
+    return get_aws_client("sns", "eu-west-2")
 
 
 # === SECTION SEPARATOR ===
@@ -702,31 +879,7 @@ def get_client_ip():
 # === SECTION SEPARATOR ===
 def check_date_eligibility(date_str):
     """Check if a date falls within the configured eligibility range"""
-    if not date_str:
-        return False, "No date provided"
-    
-    try:
-        # Parse the date string
-        if isinstance(date_str, str):
-            check_date = date_parser.parse(date_str).date()
-        else:
-            check_date = date_str
-        
-        # Parse the configuration dates
-        start_date = date_parser.parse(Config.DATE_START).date()
-        end_date = date_parser.parse(Config.DATE_END).date()
-        
-        # Check if date is within range
-        if check_date < start_date:
-            return False, f"Date {check_date} is before eligible period (starts {start_date})"
-        elif check_date > end_date:
-            return False, f"Date {check_date} is after eligible period (ends {end_date})"
-        else:
-            return True, "Date is within eligible range"
-            
-    except Exception as e:
-        logger.error(f"Error checking date eligibility: {e}")
-        return False, f"Error parsing date: {str(e)}"
+    return eligibility_engine.check(date_str)
 
 # === SECTION SEPARATOR ===
 def format_address_for_valifi(address_data):
@@ -847,7 +1000,8 @@ def format_address_3_onwards_for_data39(summary):
 
 def retry_with_backoff(max_retries=3, initial_delay=0.5, max_delay=5, backoff_factor=2):
     """
-    Decorator for retrying operations with exponential backoff
+    Decorator for retrying operations with exponential backoff (full jitter).
+    Calls rejected by an upstream guard (circuit open / limit full) are never retried.
     """
     def decorator(func):
         @wraps(func)
@@ -858,6 +1012,9 @@ def retry_with_backoff(max_retries=3, initial_delay=0.5, max_delay=5, backoff_fa
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
+                except UpstreamUnavailable as e:
+                    logger.warning(f"{func.__name__} not attempted: {e}")
+                    raise
                 except requests.exceptions.Timeout as e:
                     last_exception = e
                     logger.warning(f"{func.__name__} timeout (attempt {attempt + 1}/{max_retries}): {e}")
@@ -873,8 +1030,9 @@ def retry_with_backoff(max_retries=3, initial_delay=0.5, max_delay=5, backoff_fa
                     logger.warning(f"{func.__name__} failed (attempt {attempt + 1}/{max_retries}): {e}")
                 
                 if attempt < max_retries - 1:
-                    sleep_time = min(delay, max_delay)
-                    logger.info(f"Retrying {func.__name__} in {sleep_time} seconds...")
+                    # Jitter spreads retries out so callers that failed together don't retry together
+                    sleep_time = random.uniform(0, min(delay, max_delay))
+                    logger.info(f"Retrying {func.__name__} in {sleep_time:.2f} seconds...")
                     time.sleep(sleep_time)
                     delay *= backoff_factor
                     
@@ -885,6 +1043,33 @@ def retry_with_backoff(max_retries=3, initial_delay=0.5, max_delay=5, backoff_fa
 
 
 
+def build_upstream_guard(name, initial_limit, max_limit, slow_call_seconds):
+    """UpstreamGuard for one upstream from the shared Config settings"""
+    return UpstreamGuard(
+        name,
+        limiter=AdaptiveLimiter(
+            initial_limit=initial_limit,
+            max_limit=max_limit,
+            slow_call_seconds=slow_call_seconds,
+            max_wait_seconds=Config.UPSTREAM_QUEUE_WAIT_SECONDS
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=Config.UPSTREAM_BREAKER_FAILURE_RATE,
+            open_seconds=Config.UPSTREAM_BREAKER_OPEN_SECONDS
+        ),
+        enabled=Config.UPSTREAM_GUARD_ENABLED
+    )
+
+valifi_report_guard = build_upstream_guard(
+    "valifi_report", Config.VALIFI_REPORT_CONCURRENCY, Config.VALIFI_REPORT_MAX_CONCURRENCY, Config.VALIFI_REPORT_SLOW_SECONDS
+)
+valifi_identity_guard = build_upstream_guard(
+    "valifi_identity", Config.VALIFI_IDENTITY_CONCURRENCY, Config.VALIFI_IDENTITY_MAX_CONCURRENCY, Config.VALIFI_IDENTITY_SLOW_SECONDS
+)
+flg_guard = build_upstream_guard("flg", Config.FLG_CONCURRENCY, Config.FLG_MAX_CONCURRENCY, Config.FLG_SLOW_SECONDS)
+upstream_guards = [valifi_report_guard, valifi_identity_guard, flg_guard]
+
+
 # === SECTION SEPARATOR ===
 class ValifiClient:
     """Valifi API client with robust retry logic"""
@@ -1016,6 +1201,8 @@ class ValifiClient:
             raise
     
     @retry_with_backoff(max_retries=3, initial_delay=1)
+    @timed_upstream("valifi", "validate_identity")
+    @valifi_identity_guard
     def validate_identity(self, data):
         """Validate identity with retry logic"""
         try:
@@ -1048,12 +1235,14 @@ class ValifiClient:
             raise
     
     @retry_with_backoff(max_retries=3, initial_delay=2)
-    def get_credit_report(self, data):
+    @timed_upstream("valifi", "credit_report")
+    @valifi_report_guard
+    def get_credit_report(self, data, http_session=None):
         """Get credit report with enhanced logging and session support"""
-        # Use session to maintain cookies like Postman
-        session = requests.Session()
+        # Use session to maintain cookies like Postman (shared pool when processing a chunk)
+        session = http_session or requests.Session()
         
-        # Add all headers that Postman sends
+        # Add all headers that Postman sends - per request, so a shared session never keeps the bearer token
         headers = self._get_headers()
         headers.update({
             "Accept": "*/*",
@@ -1062,45 +1251,31 @@ class ValifiClient:
             "Cache-Control": "no-cache",
             "Connection": "keep-alive"
         })
-        session.headers.update(headers)
         
         try:
-            logger.info(f"Getting credit report for: {data.get('firstName')} {data.get('lastName')}")
+            valifi_logger.info("Getting credit report for: %s %s", data.get('firstName'), data.get('lastName'))
             
             resp = session.post(
                 f"{self.base_url}/bureau/v1/equifax/cz",
                 json=data,
+                headers=headers,
                 timeout=60
             )
             
-            # DEBUG: Log the raw response before any processing
-            logger.info("="*80)
-            logger.info("VALIFI RAW RESPONSE DEBUG START")
-            logger.info(f"Status Code: {resp.status_code}")
-            logger.info(f"Response Headers: {dict(resp.headers)}")
-            logger.info(f"Response Size: {len(resp.text)} characters")
-            
-            # Log if we see the missing sections in raw text
-            logger.info(f"Contains 'consumerCreditSearchResponse': {'consumerCreditSearchResponse' in resp.text}")
-            logger.info(f"Contains 'pdfReport': {'pdfReport' in resp.text}")
-            logger.info(f"Contains 'summaryReportV2': {'summaryReportV2' in resp.text}")
-            
-            # Log first and last 1000 chars to see structure
-            logger.info(f"First 1000 chars: {resp.text[:1000]}")
-            logger.info(f"Last 1000 chars: {resp.text[-1000:]}")
-            
-            # If response is small enough, log it all
-            if len(resp.text) < 10000:
-                logger.info(f"COMPLETE RAW RESPONSE: {resp.text}")
-            else:
-                logger.info(f"Response too large ({len(resp.text)} chars), check Railway logs for details")
-            
-            logger.info("VALIFI RAW RESPONSE DEBUG END")
-            logger.info("="*80)
+            # Size from the raw bytes - resp.text decodes the whole (multi-MB) body every time it's read
+            valifi_logger.info("Credit report response: status %s, %s bytes", resp.status_code, len(resp.content))
+            if valifi_logger.isEnabledFor(logging.DEBUG):
+                body = resp.content
+                valifi_logger.debug("Credit report headers: %s", redact_headers(resp.headers))
+                valifi_logger.debug(
+                    "Credit report sections: consumerCreditSearchResponse=%s pdfReport=%s summaryReportV2=%s",
+                    b'consumerCreditSearchResponse' in body, b'pdfReport' in body, b'summaryReportV2' in body
+                )
+                valifi_logger.debug("Credit report body: %s", truncate(body))
             
             resp.raise_for_status()
             result = resp.json()
-            logger.info("Credit report retrieved successfully")
+            valifi_logger.info("Credit report retrieved successfully")
             return result
             
         except requests.exceptions.Timeout:
@@ -1112,6 +1287,9 @@ class ValifiClient:
                 self._token = None
                 self._token_expiry = None
             raise
+        finally:
+            if http_session is None:
+                session.close()
     """Encapsulates all Valifi API interactions"""
     
     def __init__(self):
@@ -1125,7 +1303,10 @@ class ValifiClient:
         """Get authentication token with caching"""
         if self._token and self._token_expiry and datetime.now() < self._token_expiry:
             return self._token
-            
+        return self._fetch_token()
+
+    @timed_upstream("valifi", "basic_auth")
+    def _fetch_token(self):
         logger.info("Fetching new Valifi token")
         resp = requests.post(
             f"{self.base_url}/basic-auth",
@@ -1150,6 +1331,7 @@ class ValifiClient:
             "Content-Type": "application/json"
         }
     
+    @timed_upstream("valifi", "postcode_lookup")
     def lookup_address(self, postcode):
         """Lookup addresses by postcode"""
         resp = requests.post(
@@ -1161,6 +1343,7 @@ class ValifiClient:
         resp.raise_for_status()
         return resp.json()
     
+    @timed_upstream("valifi", "otp_request")
     def request_otp(self, mobile):
         """Request OTP for mobile number"""
         resp = requests.post(
@@ -1171,6 +1354,7 @@ class ValifiClient:
         )
         return resp.json(), resp.status_code
     
+    @timed_upstream("valifi", "otp_verify")
     def verify_otp(self, mobile, code):
         """Verify OTP code"""
         resp = requests.post(
@@ -1181,6 +1365,8 @@ class ValifiClient:
         )
         return resp.json(), resp.status_code
     
+    @timed_upstream("valifi", "validate_mobileid")
+    @valifi_identity_guard
     def validate_identity_with_mobileid(self, payload):
         """
         Validate identity using the tu/validate endpoint which includes MobileID
@@ -1193,6 +1379,33 @@ class ValifiClient:
             timeout=30
         )
         return resp.json(), resp.status_code
+def scan_credit_report(valifi_response):
+    """
+    The CPU-only part of store_valifi_json_to_s3: serialise the report, search it for CMC
+    indicators and collect its lender names
+    Returns: (full_json, cmc_sources_found, searchable_lenders)
+    """
+    # Convert response to JSON string
+    if isinstance(valifi_response, str):
+        full_json = valifi_response
+    else:
+        full_json = json.dumps(valifi_response)
+    
+    # Case-insensitive search for CMC indicators
+    json_lower = full_json.lower()
+    cmc_sources_found = [source for source in ("valifi", "valid8", "checkboard") if source in json_lower]
+    
+    # Extract searchable lender names
+    searchable_lenders = []
+    if isinstance(valifi_response, dict):
+        summary_v2 = valifi_response.get("data", {}).get("summaryReportV2", {})
+        for acc in summary_v2.get("accounts", []):
+            lender = acc.get("lenderName", "")
+            if lender and lender not in searchable_lenders:
+                searchable_lenders.append(lender)
+    
+    return full_json, cmc_sources_found, searchable_lenders
+
 def store_valifi_json_to_s3(valifi_response, claim_id, session_db=None):
     """
     Store the full Valifi JSON response in S3 and return a searchable reference string
@@ -1200,43 +1413,20 @@ def store_valifi_json_to_s3(valifi_response, claim_id, session_db=None):
     Returns: (reference_json_string, cmc_detected_bool)
     """
     try:
-        # Convert response to JSON string
-        if isinstance(valifi_response, str):
-            full_json = valifi_response
-        else:
-            full_json = json.dumps(valifi_response)
-        
-        # Case-insensitive search for CMC indicators
-        json_lower = full_json.lower()
-        valifi_found = "valifi" in json_lower  # This still drives CMC workflow
-        valid8_found = "valid8" in json_lower
-        checkboard_found = "checkboard" in json_lower
-        
-        # Build comma-separated list of what was found (for recording only)
-        cmc_sources_found = []
-        if valifi_found:
-            cmc_sources_found.append("valifi")
-        if valid8_found:
-            cmc_sources_found.append("valid8")
-        if checkboard_found:
-            cmc_sources_found.append("checkboard")
+        full_json, cmc_sources_found, searchable_lenders = scan_credit_report(valifi_response)
+        valifi_found = "valifi" in cmc_sources_found  # This still drives CMC workflow
         
+        # Comma-separated list of what was found (for recording only)
         cmc_search_result = ", ".join(cmc_sources_found) if cmc_sources_found else False
         
-        logger.info(f"CMC search in {len(full_json)} chars: valifi={valifi_found}, valid8={valid8_found}, checkboard={checkboard_found}")
-
-
-        # Extract searchable lender names
-        searchable_lenders = []
-        if isinstance(valifi_response, dict):
-            summary_v2 = valifi_response.get("data", {}).get("summaryReportV2", {})
-            for acc in summary_v2.get("accounts", []):
-                lender = acc.get("lenderName", "")
-                if lender and lender not in searchable_lenders:
-                    searchable_lenders.append(lender)
+        logger.info(
+            f"CMC search in {len(full_json)} chars: valifi={valifi_found}, "
+            f"valid8={'valid8' in cmc_sources_found}, checkboard={'checkboard' in cmc_sources_found}"
+        )
         
         # Store in S3
         s3_url = None
+        s3_client = get_s3_client()
         if s3_client:
             try:
                 filename = f"claim_{claim_id}_credit_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -1332,135 +1522,27 @@ class FLGClient:
     """Encapsulates FLG API interactions"""
     
     @staticmethod
-    def build_lead_xml(lead):
-        """Build XML payload for FLG API"""
-        root = ET.Element("data")
-        lead_el = ET.SubElement(root, "lead")
-        
-        # Required fields
-        ET.SubElement(lead_el, "key").text = Config.FLG_API_KEY
-        ET.SubElement(lead_el, "leadgroup").text = str(lead.get("leadgroup", Config.FLG_LEADGROUP_ID))
-        ET.SubElement(lead_el, "site").text = lead.get("site", "0")
-        
-        # Include optional primary fields used by create/update
-        if lead.get("id") is not None:
-            ET.SubElement(lead_el, "id").text = str(lead["id"])
-
-        # Reference field (text)
-        if lead.get("reference") is not None:
-            ET.SubElement(lead_el, "reference").text = str(lead["reference"])
-
-        # DCA: decimal cost (format to 2dp)
-        if lead.get("cost") is not None:
-            ET.SubElement(lead_el, "cost").text = f"{float(lead['cost']):.2f}"
-        
-        # ADD COMPANY FIELD WITH APPLICANT_ID
-        if lead.get("applicant_id") is not None:
-            ET.SubElement(lead_el, "company").text = f"<company>{lead['applicant_id']}</company>"
-        
-        # Standard fields - NOW INCLUDING introducer
-        standard_fields = [
-            "source", "medium", "term", "introducer", "title", "firstname", "lastname",
-            "phone1", "phone2", "email", "address", "address2", "address3",
-            "towncity", "postcode"
-        ]
-        
-        for field in standard_fields:
-            if lead.get(field):
-                ET.SubElement(lead_el, field).text = str(lead[field])
-        
-        # Date of birth parsing - MUST SEND BOTH dob (YYYY-MM-DD) AND separate fields
-        dob_input = lead.get("dateOfBirth", "")
-        logger.info(f"DOB INPUT: '{dob_input}'")  # DEBUG
-        
-        if dob_input:
-            dob_formatted = None
-            day = mon = year = None
-            
-            # Parse based on format
-            if "/" in dob_input:
-                # DD/MM/YYYY format from frontend
-                try:
-                    parts = dob_input.split("/")
-                    if len(parts) == 3:
-                        day, mon, year = parts
-                        # Create YYYY-MM-DD format for dob field
-                        dob_formatted = f"{year}-{mon.zfill(2)}-{day.zfill(2)}"
-                except Exception as e:
-                    logger.error(f"Failed to parse DD/MM/YYYY date: {dob_input} - {e}")
-                    
-            elif "-" in dob_input:
-                # Already in YYYY-MM-DD format
-                try:
-                    parts = dob_input.split("-")
-                    if len(parts) == 3:
-                        year, mon, day = parts
-                        dob_formatted = dob_input
-                except Exception as e:
-                    logger.error(f"Failed to parse YYYY-MM-DD date: {dob_input} - {e}")
-            else:
-                # Unknown format, log it
-                logger.error(f"Unknown date format: {dob_input}")
-            
-            # Add the main dob field in YYYY-MM-DD format (required by FLG)
-            if dob_formatted:
-                logger.info(f"Adding DOB to XML: {dob_formatted}")  # DEBUG
-                ET.SubElement(lead_el, "dob").text = dob_formatted
-                
-            # Also add the separate fields (also required by FLG)
-            if day and mon and year:
-                logger.info(f"Adding DOB components: day={day}, month={mon}, year={year}")  # DEBUG
-                ET.SubElement(lead_el, "dobday").text = day.lstrip('0') or day  # Remove leading zeros
-                ET.SubElement(lead_el, "dobmonth").text = mon.lstrip('0') or mon  # Remove leading zeros
-                ET.SubElement(lead_el, "dobyear").text = year
-        else:
-            logger.warning("No DOB provided in lead data")
-        
-        # Contact preferences - SET TO YES/NO AS REQUESTED
-        ET.SubElement(lead_el, "contactphone").text = "Yes"
-        ET.SubElement(lead_el, "contactsms").text = "Yes"
-        ET.SubElement(lead_el, "contactemail").text = "Yes"
-        ET.SubElement(lead_el, "contactmail").text = "Yes"
-        ET.SubElement(lead_el, "contactfax").text = "No"
-
-        # Extra data fields - Complete list data1 to data55 for future-proofing
-        extra_fields = [
-            "data1", "data2", "data3", "data4", "data5", "data6", "data7", "data8", "data9", "data10",
-            "data11", "data12", "data13", "data14", "data15", "data16", "data17", "data18", "data19", "data20",
-            "data21", "data22", "data23", "data24", "data25", "data26", "data27", "data28", "data29", "data30",
-            "data31", "data32", "data33", "data34", "data35", "data36", "data37", "data38", "data39", "data40",
-            "data41", "data42", "data43", "data44", "data45", "data46", "data47", "data48", "data49", "data50",
-            "data51", "data52", "data53", "data54", "data55"
-        ]
-        
-        for field in extra_fields:
-            if lead.get(field):
-                ET.SubElement(lead_el, field).text = str(lead[field])
-        
-        xml_body = ET.tostring(root, encoding="utf-8", method="xml")
-        return b'<?xml version="1.0" encoding="UTF-8"?>' + xml_body
+    def build_lead_xml(lead, fragments=None):
+        """Build XML payload for FLG API (fragments: the claim's shared ClaimFragments)"""
+        return build_flg_lead_xml(lead, Config.FLG_API_KEY, Config.FLG_LEADGROUP_ID, fragments=fragments)
 
     @staticmethod
-    def send_lead(xml_payload):
-        """Send lead data to FLG"""
-        # DEBUG: Log the full XML being sent
-        logger.info("=" * 80)
-        logger.info("SENDING XML TO FLG:")
-        logger.info(xml_payload.decode('utf-8'))
-        logger.info("=" * 80)
-        
-        response = requests.post(
+    @timed_upstream("flg", "send_lead")
+    @flg_guard
+    def send_lead(xml_payload, http=None):
+        """Send lead data to FLG (optionally over a shared requests.Session)"""
+        # Signature, report PDF URL and Valifi/account JSON fields are logged as their lengths only
+        flg_logger.debug("Sending XML to FLG: %s", redact_xml(xml_payload))
+        
+        response = (http or requests).post(
             Config.FLG_API_URL,
             data=xml_payload,
             headers={"Content-Type": "application/xml"},
             timeout=30
         )
         
-        # DEBUG: Log the response
-        logger.info("FLG RESPONSE:")
-        logger.info(f"Status: {response.status_code}")
-        logger.info(f"Body: {response.text}")
-        logger.info("=" * 80)
+        flg_logger.info("FLG response: status %s, %s bytes", response.status_code, len(response.content))
+        flg_logger.debug("FLG response body: %s", truncate(response.content))
         
         return response
         
@@ -1487,39 +1569,15 @@ class FLGClient:
 
 
 # ======================================================================================== Webhook Client ========================================================================================
-def _send_webhook_async(webhook_url, payload):
-    """Internal function to send webhook in background thread with shorter timeout"""
-    try:
-        logger.info(f"[Async] Sending webhook to {webhook_url}")
-        logger.info(f"[Async] Webhook payload: {json.dumps(payload)}")
-        
-        # Use a shorter timeout to prevent blocking
-        response = requests.post(
-            webhook_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=10  # Reduced from 30 to 10 seconds
-        )
-        
-        logger.info(f"[Async] Webhook response status: {response.status_code}")
-        logger.info(f"[Async] Webhook response body: {response.text}")
-        
-        if response.status_code != 200:
-            logger.error(f"[Async] Webhook failed with status {response.status_code}: {response.text}")
-        else:
-            logger.info(f"[Async] Webhook sent successfully")
-            
-    except requests.exceptions.Timeout:
-        logger.warning("[Async] Webhook request timed out after 10 seconds (continuing in background)")
-    except Exception as e:
-        logger.error(f"[Async] Failed to send webhook: {e}")
-
-
-def send_lead_ids_to_webhook(lead_ids):
-    """Send only lead ID numbers to webhook asynchronously (non-blocking)"""
+def send_lead_ids_to_webhook(lead_ids, claim_id=None):
+    """
+    Queue only lead ID numbers for the webhook (non-blocking): an outbox row that
+    webhook_dispatcher delivers with bounded concurrency and retries
+    """
     try:
+        # The outbox stores the base URL - the dispatcher adds WEBHOOK_SECRET when it sends
         config = Config()
-        webhook_url = config.WEBHOOK_URL
+        webhook_url = config.WEBHOOK_BASE_URL
         
         if not webhook_url:
             logger.warning("No webhook URL configured, skipping webhook send")
@@ -1536,17 +1594,26 @@ def send_lead_ids_to_webhook(lead_ids):
         
         payload = {"leads": lead_ids_only}
         
-        logger.info(f"Sending {len(lead_ids_only)} lead IDs to webhook: {webhook_url}")
+        logger.info(f"Queueing {len(lead_ids_only)} lead IDs for webhook: {webhook_url}")
         
-        # Start webhook send in background thread (non-blocking)
-        webhook_thread = threading.Thread(
-            target=_send_webhook_async,
-            args=(webhook_url, payload),
-            daemon=True  # Daemon thread will not block application shutdown
-        )
-        webhook_thread.start()
+        try:
+            outbox_id = enqueue_webhook(webhook_url, payload, claim_id=claim_id)
+        except Exception as e:
+            logger.error(f"Failed to write webhook outbox row: {e} - sending once without retries")
+            webhook_dispatcher.send_now(webhook_url, payload)
+            return True
+        
+        if USE_CELERY:
+            # Webhook lane - a slow endpoint never holds up a lead worker
+            try:
+                drain_webhook_outbox.apply_async(**lane_options('webhook'))
+                logger.info(f"Webhook outbox row {outbox_id} queued for the webhook lane")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to queue webhook drain in Celery: {e} - draining in this process")
         
-        logger.info("Webhook request initiated in background thread (non-blocking)")
+        webhook_dispatcher.wake()
+        logger.info(f"Webhook outbox row {outbox_id} queued for delivery")
         
         # Return True immediately - we don't wait for the webhook to complete
         return True
@@ -1606,6 +1673,7 @@ def calculate_similarity(str1, str2):
     return (max_len - distance) / max_len
 
 
+@timed_lender_match("fuzzy")
 def find_best_lender_match(search_name, all_lenders, threshold=0.8):
     """
     Find the best matching lender using fuzzy matching algorithm with matching_names support
@@ -1628,7 +1696,7 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
     best_similarity = 0.0
     best_match_name = None
     
-    logger.info(f"Fuzzy matching '{search_name}' against {len(all_lenders)} lenders...")
+    lender_logger.debug("Fuzzy matching '%s' against %s lenders", search_name, len(all_lenders))
     
     for lender in all_lenders:
         # Get all possible names to match against
@@ -1646,10 +1714,6 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
             variants = [v.strip() for v in matching_names.split(',') if v.strip()]
             names_to_check.extend(variants)
         
-        # Log what we're checking (only if multiple variants)
-        if len(names_to_check) > 1:
-            logger.info(f"  Checking lender '{main_name}' with {len(names_to_check)} name variants")
-        
         # Check each name variant
         for check_name in names_to_check:
             check_name_lower = check_name.lower().strip()
@@ -1659,7 +1723,7 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
             
             # 1. EXACT MATCH - highest priority
             if search_lower == check_name_lower:
-                logger.info(f"✅ EXACT MATCH: '{search_name}' → '{main_name}' (matched via '{check_name}', similarity: 1.0)")
+                lender_logger.info("✅ EXACT MATCH: '%s' → '%s' (matched via '%s', similarity: 1.0)", search_name, main_name, check_name)
                 # Return with full tracking info
                 return {
                     **lender, 
@@ -1675,7 +1739,7 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
                     best_similarity = similarity
                     best_match = lender
                     best_match_name = check_name
-                    logger.info(f"  Substring match: '{main_name}' via '{check_name}' (similarity: {similarity:.2f})")
+                    lender_logger.debug("  Substring match: '%s' via '%s' (similarity: %.2f)", main_name, check_name, similarity)
             else:
                 # 3. FUZZY MATCH - fallback
                 similarity = calculate_similarity(search_lower, check_name_lower)
@@ -1683,12 +1747,12 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
                     best_similarity = similarity
                     best_match = lender
                     best_match_name = check_name
-                    logger.info(f"  Fuzzy match: '{main_name}' via '{check_name}' (similarity: {similarity:.2f})")
+                    lender_logger.debug("  Fuzzy match: '%s' via '%s' (similarity: %.2f)", main_name, check_name, similarity)
     
     # Only return match if it meets the threshold (0.8)
     if best_similarity >= threshold:
         match_type = 'fuzzy_match' if best_similarity < 1.0 else 'exact_match'
-        logger.info(f"✅ Best match for '{search_name}': '{best_match.get('name')}' (matched via '{best_match_name}', similarity: {best_similarity:.2f})")
+        lender_logger.info("✅ Best match for '%s': '%s' (matched via '%s', similarity: %.2f)", search_name, best_match.get('name'), best_match_name, best_similarity)
         return {
             **best_match, 
             'score': round(best_similarity, 2), 
@@ -1696,7 +1760,7 @@ def find_best_lender_match(search_name, all_lenders, threshold=0.8):
             'match_type': match_type
         }
     else:
-        logger.info(f"❌ No match found for '{search_name}' (best similarity: {best_similarity:.2f}, threshold: {threshold})")
+        lender_logger.info("❌ No match found for '%s' (best similarity: %.2f, threshold: %s)", search_name, best_similarity, threshold)
         return None
 
 # === SECTION SEPARATOR ===
@@ -1762,6 +1826,7 @@ class LendersService:
         """Get all lenders (returns cached list)"""
         return self._get_all_lenders_cached()
 
+    @timed_lender_match("service")
     def get_by_name(self, name, threshold=0.7):
         """
         Get a lender by name using fuzzy matching
@@ -1837,7 +1902,349 @@ lenders_service = LendersService()
 # Background FLG Lead Processing Function
 # === SECTION SEPARATOR ===
 
-def process_flg_leads_background(claim_id, summary, accounts, found_lenders, additional_lenders):
+# A 'sending' item older than this belongs to a dead worker; FLG may or may not have the lead
+LEAD_SEND_STALE_SECONDS = int(os.getenv("LEAD_SEND_STALE_SECONDS", "300"))
+# Claims that hit an item another worker is sending re-run this long after it goes stale
+LEAD_SEND_RECHECK_MARGIN_SECONDS = 15
+# Gateway errors - the request may have been processed behind the proxy
+AMBIGUOUS_FLG_HTTP_STATUSES = (502, 504)
+
+class LeadSendInProgress(Exception):
+    """Another worker holds the work item - re-run the claim after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Lead is being sent by another worker - retrying in {retry_after}s")
+        self.retry_after = retry_after
+
+def _lead_send_reached_flg(error):
+    """False only when the request certainly never left this process (connect failure, guard rejection)"""
+    if isinstance(error, (UpstreamUnavailable, requests.exceptions.ConnectTimeout)):
+        return False
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return not isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return True
+
+def lead_work_key(lender_name, account_number, occurrence=0):
+    """Stable key for one lead of a claim (occurrence separates duplicate accounts)"""
+    raw = f"{lender_name or ''}|{account_number or ''}|{occurrence}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _claim_lead_work_item(session_db, claim_id, lead_type, work_key, lender_name, account_number, payload_hash):
+    """
+    Take ownership of a work item before sending.
+    Returns (item, stored_lead_id, error) - stored_lead_id when it was already sent,
+    error when it must not be sent (outcome of an earlier send unknown). Raises
+    LeadSendInProgress while another worker is sending it.
+    """
+    item = session_db.query(LeadWorkItem).filter_by(
+        claim_id=claim_id, lead_type=lead_type, work_key=work_key
+    ).with_for_update().first()
+
+    if item is None:
+        item = LeadWorkItem(
+            claim_id=claim_id,
+            lead_type=lead_type,
+            work_key=work_key,
+            lender_name=(lender_name or "")[:255],
+            account_number=(str(account_number) if account_number else None),
+            payload_hash=payload_hash,
+            status='sending',
+            attempts=1
+        )
+        session_db.add(item)
+        try:
+            session_db.commit()
+        except IntegrityError:
+            session_db.rollback()
+            raise LeadSendInProgress(LEAD_SEND_STALE_SECONDS + LEAD_SEND_RECHECK_MARGIN_SECONDS)
+        return item, None, None
+
+    if item.status == 'sent' and item.flg_lead_id:
+        session_db.commit()
+        return item, item.flg_lead_id, None
+
+    if item.status == 'sending':
+        age = (datetime.utcnow() - item.updated_at).total_seconds() if item.updated_at else LEAD_SEND_STALE_SECONDS
+        if age < LEAD_SEND_STALE_SECONDS:
+            session_db.commit()
+            raise LeadSendInProgress(int(LEAD_SEND_STALE_SECONDS - age) + LEAD_SEND_RECHECK_MARGIN_SECONDS)
+        # The worker died mid-send - resending could create a duplicate lead
+        item.status = 'unknown'
+        item.last_error = "Worker lost while sending"
+        session_db.commit()
+        logger.error(f"[BG-{claim_id}] {lead_type} work item {item.id} was left sending - outcome unknown, not resending")
+
+    if item.status == 'unknown':
+        session_db.commit()
+        return None, None, f"Outcome of an earlier send is unknown ({item.last_error}) - check FLG before resending"
+
+    if item.payload_hash != payload_hash:
+        logger.info(f"[BG-{claim_id}] {lead_type} payload changed since last attempt for work item {item.id}")
+
+    item.status = 'sending'
+    item.payload_hash = payload_hash
+    item.attempts = (item.attempts or 0) + 1
+    session_db.commit()
+    return item, None, None
+
+def send_lead_once(session_db, claim_id, lead_type, work_key, lender_name, account_number, xml_payload, http=None):
+    """
+    Send an FLG lead unless this claim already has it.
+    Returns (lead_id, error_msg); lead_id is the stored one when the item was sent before.
+    """
+    payload_hash = hashlib.sha256(xml_payload).hexdigest()
+    item, stored_lead_id, error_msg = _claim_lead_work_item(
+        session_db, claim_id, lead_type, work_key, lender_name, account_number, payload_hash
+    )
+    if stored_lead_id:
+        logger.info(f"[BG-{claim_id}] {lead_type} lead for {lender_name} already sent: {stored_lead_id} (skipped)")
+        return stored_lead_id, None
+    if item is None:
+        return None, error_msg
+
+    lead_id = None
+    status = 'failed'
+    try:
+        response = flg_client.send_lead(xml_payload, http=http)
+        if response.status_code == 200:
+            root = ET.fromstring(response.text)
+            if root.findtext("status") == "0":
+                lead_id = flg_client.parse_lead_id(response.text)
+                if lead_id:
+                    status = 'sent'
+                else:
+                    # Accepted, but there is no id to record - resending would duplicate it
+                    status = 'unknown'
+                    error_msg = "FLG returned status 0 without a lead id"
+            else:
+                error_msg = root.findtext("message", "Unknown error")
+        else:
+            if response.status_code in AMBIGUOUS_FLG_HTTP_STATUSES:
+                status = 'unknown'
+            error_msg = f"HTTP error: {response.status_code}"
+    except Exception as e:
+        # A timeout after the request went out leaves FLG's side unknown
+        status = 'unknown' if _lead_send_reached_flg(e) else 'pending'
+        error_msg = str(e)
+
+    if status == 'unknown':
+        logger.error(f"[BG-{claim_id}] {lead_type} send for {lender_name} has an unknown outcome ({error_msg}) - work item {item.id} will not be resent")
+        error_msg = f"Send outcome unknown: {error_msg}"
+
+    item.status = status
+    item.flg_lead_id = lead_id
+    item.last_error = error_msg[:2000] if error_msg else None
+    session_db.commit()
+    return lead_id, error_msg
+
+class LenderIndex:
+    """All lender rows by id and exact name, detached from any session (read-only use)"""
+
+    def __init__(self, lenders):
+        self.by_id = {}
+        self.by_name = {}
+        for lender in lenders:
+            self.by_id[lender.id] = lender
+            self.by_name.setdefault(lender.name, lender)
+
+    @classmethod
+    def load(cls, session_db):
+        lenders = session_db.query(Lender).all()
+        for lender in lenders:
+            # Detach so commits between claims don't expire (and re-select) them
+            session_db.expunge(lender)
+        logger.info(f"Lender index loaded: {len(lenders)} lenders")
+        return cls(lenders)
+
+    def get(self, lender_id):
+        return self.by_id.get(lender_id)
+
+    def get_by_name(self, lender_name):
+        return self.by_name.get(lender_name)
+
+class WorkerResources:
+    """
+    Per-process resources for Celery workers: an HTTP connection pool, the lender index
+    and the S3 client. Built once per child by the worker_process_init hook in tasks.py
+    (init_worker_resources) and picked up by every LeadProcessingContext in that process,
+    so tasks start warm instead of paying setup per claim.
+    """
+
+    LENDER_INDEX_TTL = 300  # seconds - same freshness as the LendersService cache
+
+    def __init__(self):
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.s3_client = get_s3_client()
+        self._lender_index = None
+        self._lender_index_loaded_at = 0
+
+    def lender_index(self):
+        """Lender index, reloaded after LENDER_INDEX_TTL"""
+        if self._lender_index is None or time.time() - self._lender_index_loaded_at > self.LENDER_INDEX_TTL:
+            try:
+                self._lender_index = LenderIndex.load(db_session())
+                self._lender_index_loaded_at = time.time()
+            finally:
+                db_session.remove()
+        return self._lender_index
+
+    def warm(self):
+        """Load what the first task would otherwise load"""
+        self.lender_index()
+        lenders_service._get_all_lenders_cached()
+        db_session.remove()
+
+    def close(self):
+        self.http.close()
+
+_worker_resources = None
+
+def init_worker_resources():
+    """Build (and warm) this process's WorkerResources - called from the Celery worker_process_init hook"""
+    global _worker_resources
+    if _worker_resources is None:
+        resources = WorkerResources()
+        try:
+            resources.warm()
+        except Exception as e:
+            logger.warning(f"Worker resources warm-up failed (will load on first use): {e}")
+        _worker_resources = resources
+        logger.info(f"Worker resources ready in process {os.getpid()}")
+    return _worker_resources
+
+def close_worker_resources():
+    global _worker_resources
+    if _worker_resources is not None:
+        _worker_resources.close()
+        _worker_resources = None
+
+class LeadProcessingContext:
+    """
+    State shared by process_flg_leads_background across the claims of one run.
+
+    The default (per-claim) context keeps the original behaviour - sessions are closed
+    after use and lead_ids_tracking rows are written per claim - but memoises lender
+    lookups so each lender name is fuzzy-matched once instead of three times.
+
+    A shared context (chunked Celery tasks) keeps one DB session open for the whole chunk,
+    indexes all lenders once, reuses one HTTP connection pool and collects the
+    lead_ids_tracking rows for a single bulk insert in flush().
+
+    In a Celery worker both kinds reuse the process's WorkerResources (HTTP pool and
+    lender index) instead of building their own.
+    """
+
+    # Bulk insert queued lead rows once this many have built up
+    FLUSH_ROWS = 500
+
+    def __init__(self, shared=False, resources=None):
+        self.shared = shared
+        resources = resources or _worker_resources
+        if resources is not None:
+            self.http = resources.http
+            self._owns_http = False
+            self._lender_index = resources.lender_index()
+        else:
+            self.http = requests.Session() if shared else None
+            self._owns_http = shared
+            self._lender_index = None
+        self.pending_lead_rows = []
+        self._matches = {}
+        self._lenders_by_id = {}
+        self._lenders_by_name = {}
+
+    @property
+    def session_db(self):
+        return db_session()
+
+    def release(self, session_db):
+        """Close a session unless the whole chunk shares it"""
+        if not self.shared:
+            session_db.close()
+
+    def _detached(self, lender):
+        """Detach a memoised lender so later commits/closes can't expire it (it is read-only here)"""
+        if lender is not None:
+            self.session_db.expunge(lender)
+        return lender
+
+    def _index(self):
+        """Lender index - the worker's, or one loaded for this shared context"""
+        if self._lender_index is None and self.shared:
+            self._lender_index = LenderIndex.load(self.session_db)
+        return self._lender_index
+
+    def match_lender(self, lender_name):
+        """Fuzzy match a lender name (memoised)"""
+        if lender_name not in self._matches:
+            self._matches[lender_name] = lenders_service.get_by_name(
+                lender_name, threshold=Config.LENDER_FUZZY_MATCH_THRESHOLD / 100.0
+            )
+        return self._matches[lender_name]
+
+    def get_lender(self, lender_id):
+        """Lender row by id"""
+        index = self._index()
+        if index is not None:
+            return index.get(lender_id)
+        if lender_id not in self._lenders_by_id:
+            self._lenders_by_id[lender_id] = self._detached(self.session_db.query(Lender).filter_by(id=lender_id).first())
+        return self._lenders_by_id[lender_id]
+
+    def get_lender_by_name(self, lender_name):
+        """Lender row by exact name"""
+        index = self._index()
+        if index is not None:
+            return index.get_by_name(lender_name)
+        if lender_name not in self._lenders_by_name:
+            self._lenders_by_name[lender_name] = self._detached(self.session_db.query(Lender).filter_by(name=lender_name).first())
+        return self._lenders_by_name[lender_name]
+
+    def record_lead_ids(self, claim, lead_ids_data):
+        """Write lead_ids_tracking rows now, or queue them for the bulk insert"""
+        if not self.shared:
+            populate_lead_ids_tracking(claim.id, lead_ids_data)
+            return
+        for lead_data in lead_ids_data:
+            row = build_lead_tracking_row(claim, lead_data)
+            if row is not None:
+                self.pending_lead_rows.append(row)
+
+    def flush(self):
+        """Bulk insert the queued lead_ids_tracking rows"""
+        if not self.pending_lead_rows:
+            return 0
+        session_db = self.session_db
+        rows = self.pending_lead_rows
+        tracked = tracked_lead_ids(session_db, rows)
+        try:
+            new_rows = [row for row in rows if row['lead_id'] not in tracked]
+            session_db.bulk_insert_mappings(LeadIDTracking, new_rows)
+            # Bulk inserts skip the flush hooks - count the leads explicitly
+            count_pending(session_db, Counter(lead_metric(row.get('lead_type')) for row in new_rows))
+            session_db.commit()
+            logger.info(f"Bulk inserted {len(rows)} lead IDs to tracking table")
+        except Exception:
+            session_db.rollback()
+            raise
+        self.pending_lead_rows = []
+        return len(rows)
+
+    def close(self):
+        """End of chunk - flush pending rows and give everything back"""
+        try:
+            self.flush()
+        finally:
+            if self.http and self._owns_http:
+                self.http.close()
+            db_session.remove()
+
+
+def process_flg_leads_background(claim_id, summary, accounts, found_lenders, additional_lenders, context=None):
     """
     Background function to process FLG lead creation.
     Called by either Celery worker or directly in upload_summary.
@@ -1848,12 +2255,18 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
         accounts (list): List of all accounts (found + manual)
         found_lenders (list): List of Valifi-found lenders
         additional_lenders (list): List of manually-added lenders
+        context (LeadProcessingContext): Shared state when processing a chunk of claims
+            (one session, lender index, HTTP pool, bulk lead inserts). Defaults to a
+            per-claim context.
         
     Returns:
         dict: Results with lead_ids list, successful_leads count, failed_leads count
     """
     logger.info(f"[BG-{claim_id}] Starting background FLG processing")
     session_db = None
+    if context is None:
+        context = LeadProcessingContext()
+    stages = StageClock(claim_id=claim_id)
     
     try:
         # Get Valifi response from summary if available
@@ -1864,7 +2277,7 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             claim = session_db.query(ClaimTracking).get(claim_id)
             if claim and claim.valifi_response:
                 valifi_response = claim.valifi_response
-            session_db.close()
+            context.release(session_db)
             session_db = None
 
         # Check if FLG submission should be skipped (for batch imports)
@@ -1913,7 +2326,7 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
         cmc_detected = False
         full_credit_report = summary.get("valifiResponse", {})
         if full_credit_report:
-            valifi_json, cmc_detected = store_valifi_json_to_s3(full_credit_report, claim_id, None)
+            valifi_json, cmc_detected = store_valifi_json_to_s3(full_credit_report, claim_id, context.session_db if context.shared else None)
         
         # Base lead data
         # Construct combined address for FLG from individual address components
@@ -1946,13 +2359,18 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             "data29": client_ip,
             "data31": pdf_url
         }
+        # Applicant, address, signature and Valifi JSON are serialized once for all of the claim's leads
+        lead_fragments = None if skip_flg else ClaimFragments({**base_lead_data, "data32": valifi_json, "data36": valifi_json})
         
         # Tracking
         all_lead_ids = []
         successful_leads = 0
         failed_leads = 0
+        deferred_leads = 0
+        deferred_retry_after = 0
         eligible_dca_count = 0  # Only FA Eligible - for cost calculation
         total_dca_count = 0  # All DCAs - for Lead ID numbering
+        work_key_occurrences = {}  # (lender, account number) -> times seen, for duplicate accounts
         category_1_accounts = []
         category_2_accounts = []
         category_3_accounts = []
@@ -1969,7 +2387,7 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
         # ===================================================================
         # PRE-SORT ACCOUNTS BY DCA COST PRIORITY
         # ===================================================================
-        session_db = db_session()
+        session_db = context.session_db
         
         logger.info(f"[BG-{claim_id}] Pre-sorting {len(accounts)} accounts by DCA cost priority...")
         
@@ -1978,10 +2396,10 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             lender_name = account.get("displayName") or account.get("lenderName", "Unknown Lender")
             
             # Perform fuzzy match lookup for this lender to get DCA cost order
-            presort_matched_lender = lenders_service.get_by_name(lender_name, threshold=Config.LENDER_FUZZY_MATCH_THRESHOLD / 100.0)
+            presort_matched_lender = context.match_lender(lender_name)
             
             if presort_matched_lender:
-                db_lender = session_db.query(Lender).filter_by(id=presort_matched_lender['id']).first()
+                db_lender = context.get_lender(presort_matched_lender['id'])
                 if db_lender:
                     # Add dca_cost_order to account for sorting (default to 0 if None)
                     account['dca_cost_order'] = db_lender.DCA_cost_order if db_lender.DCA_cost_order is not None else 0
@@ -2001,6 +2419,17 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             lender_name = account.get("displayName") or account.get("lenderName", "Unknown Lender")
             logger.info(f"[BG-{claim_id}]   {idx}. {lender_name} (priority: {account.get('dca_cost_order', 0)})")
         
+        try:
+            claim_record = session_db.query(ClaimTracking).filter_by(id=claim_id).first()
+            claim_existing_rep_consent = claim_record.existing_representation_consent if claim_record else None
+            logger.info(f"[BG-{claim_id}] existing_rep_consent from DB: {claim_existing_rep_consent}")
+        except Exception as e:
+            logger.error(f"[BG-{claim_id}] Failed to read existing_rep_consent from DB: {e}")
+            claim_existing_rep_consent = summary.get("existingRepresentationConsent")
+            logger.info(f"[BG-{claim_id}] Fallback to summary dict: {claim_existing_rep_consent}")
+
+        stages.lap("resolve")
+
         # ===================================================================
         # PROCESS EACH ACCOUNT (NOW IN PRIORITY ORDER)
         # ===================================================================
@@ -2028,7 +2457,7 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             
             if not is_manual:
                 # Perform fuzzy matching with full tracking
-                matched_lender_details = lenders_service.get_by_name(lender_name, threshold=Config.LENDER_FUZZY_MATCH_THRESHOLD / 100.0)
+                matched_lender_details = context.match_lender(lender_name)
                 
                 if matched_lender_details:
                     # Extract all matching details
@@ -2078,19 +2507,19 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                     start_date_formatted = start_date
 
             # Find lender in DB using fuzzy matching with configurable threshold
-            matched_lender = lenders_service.get_by_name(lender_name, threshold=Config.LENDER_FUZZY_MATCH_THRESHOLD / 100.0)
+            matched_lender = context.match_lender(lender_name)
             db_lender = None
             fuzzy_match_score = 0
             match_method = "none"
             
             if matched_lender:
                 fuzzy_match_score = int(matched_lender.get('score', 0) * 100)  # Convert to percentage
-                db_lender = session_db.query(Lender).filter_by(id=matched_lender['id']).first()
+                db_lender = context.get_lender(matched_lender['id'])
                 match_method = "fuzzy"
                 logger.info(f"[BG-{claim_id}] Fuzzy match: '{lender_name}' -> '{db_lender.name}' (score: {fuzzy_match_score}%)")
             else:
                 # Try exact match as fallback
-                db_lender = session_db.query(Lender).filter_by(name=lender_name).first()
+                db_lender = context.get_lender_by_name(lender_name)
                 if db_lender:
                     fuzzy_match_score = 100
                     match_method = "exact"
@@ -2126,6 +2555,8 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                 })
                 # NOTE: No 'continue' statement - we process this lender!
             
+            stages.lap("categorise")
+
             # Category 2: Outside date range (only skip if date is ineligible)
             if not is_manual and not is_date_eligible:
                 logger.info(f"[BG-{claim_id}] Category 2: {lender_name} - {eligibility_reason}")
@@ -2139,36 +2570,19 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             # Category 1: Proceeding (includes matched AND unmatched lenders)
             logger.info(f"[BG-{claim_id}] Category 1: {lender_name} - Proceeding with claims (Match: {match_method}, Score: {fuzzy_match_score}%)")
 
-            # Read from database instead of summary dict to ensure we have latest data
-            try:
-                temp_session = db_session()
-                claim_record = temp_session.query(ClaimTracking).filter_by(id=claim_id).first()
-                existing_rep_consent = claim_record.existing_representation_consent if claim_record else None
-                temp_session.close()
-                logger.info(f"[BG-{claim_id}] existing_rep_consent from DB: {existing_rep_consent}")
-            except Exception as e:
-                logger.error(f"[BG-{claim_id}] Failed to read existing_rep_consent from DB: {e}")
-                existing_rep_consent = summary.get("existingRepresentationConsent")
-                logger.info(f"[BG-{claim_id}] Fallback to summary dict: {existing_rep_consent}")
+            # Read from database (once per claim) instead of summary dict to ensure we have latest data
+            existing_rep_consent = claim_existing_rep_consent
 
             # Check if date is in special range
             special_date_range = False
             if start_date_formatted:
-                try:
-                    if "/" in start_date_formatted:
-                        day, month, year = start_date_formatted.split("/")
-                        start_date_obj = datetime(int(year), int(month), int(day)).date()
-                    else:
-                        start_date_obj = datetime.strptime(start_date_formatted, "%Y-%m-%d").date()
-                    
-                    special_start = datetime.strptime(Config.SPECIAL_DATE_START, "%Y-%m-%d").date()
-                    special_end = datetime.strptime(Config.SPECIAL_DATE_END, "%Y-%m-%d").date()
-                    special_date_range = special_start <= start_date_obj <= special_end
-                    
+                date_class = eligibility_engine.classify(start_date_formatted)
+                if date_class.date is None:
+                    logger.error(f"[BG-{claim_id}] Failed to parse date for special range check: {start_date_formatted} - {date_class.reason}")
+                else:
+                    special_date_range = date_class.special
                     if special_date_range:
                         logger.info(f"[BG-{claim_id}] Lender {lender_name} date {start_date_formatted} in special range")
-                except Exception as e:
-                    logger.error(f"[BG-{claim_id}] Failed to parse date for special range check: {start_date_formatted} - {e}")
             
             # DCA reference logic
             if special_date_range:
@@ -2207,6 +2621,11 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                 # IRL=No -> IRL Suspense (but won't create lead anyway)
                 irl_reference_value = "IRL Suspense"
 
+            # Work item keys - a retry of this claim resends only the leads that did not go through
+            work_key_base = (lender_name, account_number)
+            work_key_occurrences[work_key_base] = work_key_occurrences.get(work_key_base, -1) + 1
+            dca_work_key = irl_work_key = lead_work_key(lender_name, account_number, work_key_occurrences[work_key_base])
+
             # === DCA LEAD CREATION ===
             if (summary.get("motorFinanceConsent") or summary.get("motor_finance_consent")) and not tlw_selected:
                 total_dca_count += 1  # Increment for ALL DCAs (for Lead ID numbering)
@@ -2333,54 +2752,54 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                     }
                     
                     try:
-                        xml_payload = flg_client.build_lead_xml(dca_lead_data)
-                        response = flg_client.send_lead(xml_payload)
+                        xml_payload = flg_client.build_lead_xml(dca_lead_data, fragments=lead_fragments)
+                        stages.lap("build")
+                        lead_id, error_msg = send_lead_once(
+                            context.session_db, claim_id, "DCA", dca_work_key,
+                            flg_sent_name, account_number, xml_payload, http=context.http
+                        )
+                        stages.lap("send")
                         
-                        if response.status_code == 200:
-                            root = ET.fromstring(response.text)
-                            status = root.findtext("status")
-                            if status == "0":
-                                lead_id = flg_client.parse_lead_id(response.text)
-                                if lead_id:
-                                    all_lead_ids.append({
-                                        "lead_id": lead_id,
-                                        "lead_group": Config.FLG_LEADGROUP_ID,
-                                        "lead_type": "DCA",
-                                        "reference": dca_reference_value,
-                                        "cost": str(cost_value),
-                                        "lender_name": flg_sent_name,
-                                        "account_number": account_number,
-                                        "start_date": start_date_formatted,
-                                        "outstanding_balance": outstanding_balance,
-                                        "monthly_payment": monthly_payment,
-                                        "lender_data": account,
-                                        "is_eligible": is_date_eligible,
-                                        "ineligible_reason": eligibility_reason if not is_date_eligible else None,
-                                        "is_manual": is_manual,
-                                        "within_date_range": is_date_eligible if start_date else True,
-                                        "lender_data_json": account_json_data,
-                                        "valifi_original_name": valifi_original_name,
-                                        "match_info": {
-                                            "lender_id": matched_db_lender_id,
-                                            "lender_name": matched_db_lender_name,
-                                            "fortress_name": fortress_name_value,
-                                            "flg_lender_name": flg_sent_name,
-                                            "fuzzy_score": fuzzy_score_value,
-                                            "match_type": match_type_value,
-                                            "matched_via": matched_via_value,
-                                            "matching_column_value": matched_via_value
-                                        }
-                                    })
-                                    successful_leads += 1
-                                    logger.info(f"[BG-{claim_id}] DCA Lead created: {lead_id}")
-                            else:
-                                error_msg = root.findtext("message", "Unknown error")
-                                logger.error(f"[BG-{claim_id}] DCA Lead creation failed: {error_msg}")
-                                failed_leads += 1
+                        if lead_id:
+                            all_lead_ids.append({
+                                "lead_id": lead_id,
+                                "lead_group": Config.FLG_LEADGROUP_ID,
+                                "lead_type": "DCA",
+                                "reference": dca_reference_value,
+                                "cost": str(cost_value),
+                                "lender_name": flg_sent_name,
+                                "account_number": account_number,
+                                "start_date": start_date_formatted,
+                                "outstanding_balance": outstanding_balance,
+                                "monthly_payment": monthly_payment,
+                                "lender_data": account,
+                                "is_eligible": is_date_eligible,
+                                "ineligible_reason": eligibility_reason if not is_date_eligible else None,
+                                "is_manual": is_manual,
+                                "within_date_range": is_date_eligible if start_date else True,
+                                "lender_data_json": account_json_data,
+                                "valifi_original_name": valifi_original_name,
+                                "match_info": {
+                                    "lender_id": matched_db_lender_id,
+                                    "lender_name": matched_db_lender_name,
+                                    "fortress_name": fortress_name_value,
+                                    "flg_lender_name": flg_sent_name,
+                                    "fuzzy_score": fuzzy_score_value,
+                                    "match_type": match_type_value,
+                                    "matched_via": matched_via_value,
+                                    "matching_column_value": matched_via_value
+                                }
+                            })
+                            successful_leads += 1
+                            logger.info(f"[BG-{claim_id}] DCA Lead created: {lead_id}")
                         else:
-                            logger.error(f"[BG-{claim_id}] DCA Lead HTTP error: {response.status_code}")
+                            logger.error(f"[BG-{claim_id}] DCA Lead creation failed: {error_msg}")
                             failed_leads += 1
 
+                    except LeadSendInProgress as e:
+                        logger.warning(f"[BG-{claim_id}] DCA lead for {lender_name} deferred: {e}")
+                        deferred_leads += 1
+                        deferred_retry_after = max(deferred_retry_after, e.retry_after)
                     except Exception as e:
                         logger.error(f"[BG-{claim_id}] Failed to create DCA lead for {lender_name}: {e}")
                         failed_leads += 1
@@ -2461,54 +2880,54 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                         del irl_lead_data["data31"]
                     
                     try:
-                        xml_payload = flg_client.build_lead_xml(irl_lead_data)
-                        response = flg_client.send_lead(xml_payload)
+                        xml_payload = flg_client.build_lead_xml(irl_lead_data, fragments=lead_fragments)
+                        stages.lap("build")
+                        lead_id, error_msg = send_lead_once(
+                            context.session_db, claim_id, "IRL", irl_work_key,
+                            flg_sent_name, account_number, xml_payload, http=context.http
+                        )
+                        stages.lap("send")
                         
-                        if response.status_code == 200:
-                            root = ET.fromstring(response.text)
-                            status = root.findtext("status")
-                            if status == "0":
-                                lead_id = flg_client.parse_lead_id(response.text)
-                                if lead_id:
-                                    all_lead_ids.append({
-                                        "lead_id": lead_id,
-                                        "lead_group": Config.FLG_IRL_LEADGROUP_ID,
-                                        "lead_type": "IRL",
-                                        "reference": irl_reference_value,
-                                        "cost": "",
-                                        "lender_name": flg_sent_name,
-                                        "account_number": account_number,
-                                        "start_date": start_date_formatted,
-                                        "outstanding_balance": outstanding_balance,
-                                        "monthly_payment": monthly_payment,
-                                        "lender_data": account,
-                                        "is_eligible": is_date_eligible,
-                                        "ineligible_reason": eligibility_reason if not is_date_eligible else None,
-                                        "is_manual": is_manual,
-                                        "within_date_range": is_date_eligible if start_date else True,
-                                        "lender_data_json": account_json_data,
-                                        "valifi_original_name": valifi_original_name,
-                                        "match_info": {
-                                            "lender_id": matched_db_lender_id,
-                                            "lender_name": matched_db_lender_name,
-                                            "fortress_name": fortress_name_value,
-                                            "flg_lender_name": flg_sent_name,
-                                            "fuzzy_score": fuzzy_score_value,
-                                            "match_type": match_type_value,
-                                            "matched_via": matched_via_value,
-                                            "matching_column_value": matched_via_value
-                                        }
-                                    })
-                                    successful_leads += 1
-                                    logger.info(f"[BG-{claim_id}] IRL Lead created: {lead_id}")
-                            else:
-                                error_msg = root.findtext("message", "Unknown error")
-                                logger.error(f"[BG-{claim_id}] IRL Lead creation failed: {error_msg}")
-                                failed_leads += 1
+                        if lead_id:
+                            all_lead_ids.append({
+                                "lead_id": lead_id,
+                                "lead_group": Config.FLG_IRL_LEADGROUP_ID,
+                                "lead_type": "IRL",
+                                "reference": irl_reference_value,
+                                "cost": "",
+                                "lender_name": flg_sent_name,
+                                "account_number": account_number,
+                                "start_date": start_date_formatted,
+                                "outstanding_balance": outstanding_balance,
+                                "monthly_payment": monthly_payment,
+                                "lender_data": account,
+                                "is_eligible": is_date_eligible,
+                                "ineligible_reason": eligibility_reason if not is_date_eligible else None,
+                                "is_manual": is_manual,
+                                "within_date_range": is_date_eligible if start_date else True,
+                                "lender_data_json": account_json_data,
+                                "valifi_original_name": valifi_original_name,
+                                "match_info": {
+                                    "lender_id": matched_db_lender_id,
+                                    "lender_name": matched_db_lender_name,
+                                    "fortress_name": fortress_name_value,
+                                    "flg_lender_name": flg_sent_name,
+                                    "fuzzy_score": fuzzy_score_value,
+                                    "match_type": match_type_value,
+                                    "matched_via": matched_via_value,
+                                    "matching_column_value": matched_via_value
+                                }
+                            })
+                            successful_leads += 1
+                            logger.info(f"[BG-{claim_id}] IRL Lead created: {lead_id}")
                         else:
-                            logger.error(f"[BG-{claim_id}] IRL Lead HTTP error: {response.status_code}")
+                            logger.error(f"[BG-{claim_id}] IRL Lead creation failed: {error_msg}")
                             failed_leads += 1
 
+                    except LeadSendInProgress as e:
+                        logger.warning(f"[BG-{claim_id}] IRL lead for {lender_name} deferred: {e}")
+                        deferred_leads += 1
+                        deferred_retry_after = max(deferred_retry_after, e.retry_after)
                     except Exception as e:
                         logger.error(f"[BG-{claim_id}] Failed to create IRL lead for {lender_name}: {e}")
                         failed_leads += 1
@@ -2522,23 +2941,41 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
                 "startDate": start_date_formatted
             })
         
-        session_db.close()
+        context.release(session_db)
         session_db = None
+        stages.lap("build")
 
         # Log summary
         logger.info(f"[BG-{claim_id}] Lead creation complete: {successful_leads} successful, {failed_leads} failed")
         
+        # Another worker is mid-send on some leads - the re-run collects its lead ids (sent
+        # items are skipped) and does the webhook and claim update with the complete set
+        if deferred_leads:
+            logger.warning(f"[BG-{claim_id}] {deferred_leads} leads in flight elsewhere - re-running claim in {deferred_retry_after}s")
+            requeue_lead_processing(claim_id, summary, accounts, found_lenders, additional_lenders, deferred_retry_after)
+            stages.finish("deferred")
+            return {
+                "claim_id": claim_id,
+                "all_lead_ids": all_lead_ids,
+                "successful_leads": successful_leads,
+                "failed_leads": failed_leads,
+                "deferred_leads": deferred_leads,
+                "retry_after": deferred_retry_after,
+                "valifi_json": valifi_json
+            }
+        
         # Send webhook (skip if using fake lead IDs)
         if all_lead_ids and not skip_flg:
             try:
-                send_lead_ids_to_webhook(all_lead_ids)
+                send_lead_ids_to_webhook(all_lead_ids, claim_id=claim_id)
             except Exception as e:
                 logger.warning(f"[BG-{claim_id}] Webhook send failed: {e}")
         elif skip_flg:
             logger.info(f"[BG-{claim_id}] skipFLG=true - Skipping webhook (fake lead IDs)")
+        stages.lap("send")
         
         # Update claim with results
-        session_db = db_session()
+        session_db = context.session_db
         claim = session_db.query(ClaimTracking).get(claim_id)
         if claim:
             claim.lead_ids = json.dumps(all_lead_ids) if all_lead_ids else None
@@ -2546,14 +2983,16 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             claim.lenders_eligible = eligible_dca_count
             claim.lenders_ineligible = len(category_2_accounts) + len(category_3_accounts)
             
-            # Populate lead_ids_tracking
+            # Populate lead_ids_tracking (queued for one bulk insert when the context is shared)
             if all_lead_ids:
-                populate_lead_ids_tracking(claim_id, all_lead_ids)
+                context.record_lead_ids(claim, all_lead_ids)
             
             session_db.commit()
             logger.info(f"[BG-{claim_id}] Claim updated with lead results")
         
-        session_db.close()
+        context.release(session_db)
+        stages.lap("persist")
+        stages.finish()
         
         # Return results
         return {
@@ -2575,9 +3014,10 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
         if session_db:
             try:
                 session_db.rollback()
-                session_db.close()
+                context.release(session_db)
             except:
                 pass
+        stages.finish("error")
         
         # Return error results
         return {
@@ -2588,6 +3028,62 @@ def process_flg_leads_background(claim_id, summary, accounts, found_lenders, add
             "error": str(e),
             "valifi_json": ""
         }
+
+def requeue_lead_processing(claim_id, summary, accounts, found_lenders, additional_lenders, countdown):
+    """Run process_flg_leads_background for the claim again in countdown seconds (Celery, or a timer thread)"""
+    if USE_CELERY:
+        try:
+            process_flg_leads_async.apply_async(
+                kwargs=dict(
+                    claim_id=claim_id,
+                    summary=summary,
+                    accounts=accounts,
+                    found_lenders=found_lenders,
+                    additional_lenders=additional_lenders
+                ),
+                countdown=countdown,
+                **select_queue(summary_lead_source(summary))
+            )
+            return
+        except Exception as e:
+            logger.error(f"[BG-{claim_id}] Failed to re-queue lead processing in Celery: {e} - re-running in-process")
+
+    timer = threading.Timer(
+        countdown, process_flg_leads_background,
+        args=(claim_id, summary, accounts, found_lenders, additional_lenders)
+    )
+    timer.daemon = True
+    timer.start()
+
+@audited("process_flg_leads_chunk")
+def process_flg_leads_chunk(items):
+    """
+    Run process_flg_leads_background for many claims with one shared LeadProcessingContext.
+
+    Args:
+        items (list): dicts with claim_id, summary, accounts, found_lenders, additional_lenders
+
+    Returns:
+        list: per-claim results in input order
+    """
+    context = LeadProcessingContext(shared=True)
+    results = []
+    try:
+        for item in items:
+            results.append(process_flg_leads_background(
+                item["claim_id"],
+                item["summary"],
+                item.get("accounts", []),
+                item.get("found_lenders", []),
+                item.get("additional_lenders", []),
+                context=context
+            ))
+            if len(context.pending_lead_rows) >= LeadProcessingContext.FLUSH_ROWS:
+                context.flush()
+    finally:
+        context.close()
+    logger.info(f"Processed chunk of {len(items)} claims")
+    return results
     
 # === SECTION SEPARATOR ===
 # Database Sequence Health Check
@@ -2667,10 +3163,120 @@ def fix_database_sequences():
         if session:
             session.close()
 
+def bootstrap_database():
+    """
+    One-shot database setup, run per deploy by `python app.py bootstrap` (the Procfile release process):
+    connectivity check, create missing tables, fix out-of-sync id sequences.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1")).scalar()
+    
+    Base.metadata.create_all(engine)
+    logger.info("Database schema ready")
+
+    # Next months' webhook_logs partitions (no-op until migrate-log-tables has partitioned it)
+    try:
+        ensure_log_partitions(engine)
+    except Exception as e:
+        logger.error(f"webhook_logs partition check failed: {e}")
+    
+    sequence_result = fix_database_sequences()
+    if sequence_result.get("fixed"):
+        logger.info(f"Bootstrap sequence fix: {sequence_result['fixed']}")
+
+    # First deploy with metric rollups: seed them from existing rows (one-off full scan)
+    session_db = SessionLocal()
+    try:
+        backfill_rollups(session_db)
+    except Exception as e:
+        session_db.rollback()
+        logger.error(f"Metric rollup backfill failed: {e}")
+    finally:
+        session_db.close()
+    return sequence_result
+
 # ========================================
 # Helper Function: Auto-populate lead_ids_tracking on claim submission
 # ========================================
 
+def build_lead_tracking_row(claim, lead_data):
+    """
+    Column values for one lead_ids_tracking row (applicant details come from the claim).
+    Returns None when the lead has no lead_id.
+    """
+    # Skip if lead_id is missing
+    if not lead_data.get('lead_id'):
+        logger.warning(f"Skipping lead with no lead_id: {lead_data}")
+        return None
+    
+    # Fix cost field - convert empty string to None for database
+    cost_value = lead_data.get('cost')
+    if cost_value == '' or cost_value is None:
+        cost_value = None
+    else:
+        try:
+            cost_value = float(cost_value)
+        except (ValueError, TypeError):
+            cost_value = None
+    
+    # Note: We get lender details directly from lead_data (which comes from all_lead_ids)
+    # We don't need to look them up from claim_lender_matches
+    return dict(
+        claim_id=claim.id,
+        lead_id=str(lead_data.get('lead_id')),
+        lead_group=lead_data.get('lead_group'),
+        lead_type=lead_data.get('lead_type'),
+        lender_name=lead_data.get('lender_name'),
+        reference=lead_data.get('reference'),
+        cost=cost_value,
+        
+        # Applicant info from claim
+        applicant_id=claim.id,
+        first_name=claim.first_name,
+        last_name=claim.last_name,
+        email=claim.email,
+        mobile=claim.mobile,
+        date_of_birth=claim.date_of_birth,
+        post_code=getattr(claim, 'post_code', None),
+        
+        # Lender details - can be added from lead_data if available
+        account_number=lead_data.get('account_number'),
+        start_date=lead_data.get('start_date'),
+        outstanding_balance=lead_data.get('outstanding_balance'),
+        monthly_payment=lead_data.get('monthly_payment'),
+        lender_data_json=lead_data.get('lender_data_json'),
+        
+        # Eligibility
+        is_eligible=lead_data.get('is_eligible', True),
+        ineligible_reason=lead_data.get('ineligible_reason'),
+        is_manual=lead_data.get('is_manual', False),
+        within_date_range=lead_data.get('within_date_range', True),
+        
+        # Consents from claim
+        motor_finance_consent=claim.motor_finance_consent,
+        irresponsible_lending_consent=claim.irresponsible_lending_consent,
+        
+        # Campaign from claim
+        campaign=claim.campaign,
+        client_ip=claim.client_ip,
+        
+        # Status from claim
+        claim_submitted=claim.claim_submitted,
+        submission_datetime=claim.submission_datetime,
+        signature_provided=claim.signature_provided,
+        
+        # Metadata
+        created_at=claim.created_at or datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+
+def tracked_lead_ids(session, lead_ids_data):
+    """Lead ids from lead_ids_data already in lead_ids_tracking (e.g. reused by a retried claim)"""
+    lead_ids = [str(lead_data['lead_id']) for lead_data in lead_ids_data if lead_data.get('lead_id')]
+    if not lead_ids:
+        return set()
+    return {row[0] for row in session.query(LeadIDTracking.lead_id).filter(LeadIDTracking.lead_id.in_(lead_ids))}
+
 def populate_lead_ids_tracking(claim_id, lead_ids_data):
     """
     Populate lead_ids_tracking table when a claim is submitted.
@@ -2691,81 +3297,16 @@ def populate_lead_ids_tracking(claim_id, lead_ids_data):
             logger.error(f"Claim {claim_id} not found for lead_ids_tracking population")
             return False
         
-        # Get post_code if it exists
-        post_code = getattr(claim, 'post_code', None)
+        tracked = tracked_lead_ids(session, lead_ids_data)
         
         # Process each lead ID
         for lead_data in lead_ids_data:
-            # Skip if lead_id is missing
-            if not lead_data.get('lead_id'):
-                logger.warning(f"Skipping lead with no lead_id: {lead_data}")
+            row = build_lead_tracking_row(claim, lead_data)
+            if row is None or row['lead_id'] in tracked:
                 continue
             
-            # Create lead_ids_tracking record
-            # Note: We get lender details directly from lead_data (which comes from all_lead_ids)
-            # We don't need to look them up from claim_lender_matches
-            
-            # Fix cost field - convert empty string to None for database
-            cost_value = lead_data.get('cost')
-            if cost_value == '' or cost_value is None:
-                cost_value = None
-            else:
-                try:
-                    cost_value = float(cost_value)
-                except (ValueError, TypeError):
-                    cost_value = None
-            
-            lead_record = LeadIDTracking(
-                claim_id=claim_id,
-                lead_id=str(lead_data.get('lead_id')),
-                lead_group=lead_data.get('lead_group'),
-                lead_type=lead_data.get('lead_type'),
-                lender_name=lead_data.get('lender_name'),
-                reference=lead_data.get('reference'),
-                cost=cost_value,
-                
-                # Applicant info from claim
-                applicant_id=claim_id,
-                first_name=claim.first_name,
-                last_name=claim.last_name,
-                email=claim.email,
-                mobile=claim.mobile,
-                date_of_birth=claim.date_of_birth,
-                post_code=post_code,
-                
-                # Lender details - can be added from lead_data if available
-                account_number=lead_data.get('account_number'),
-                start_date=lead_data.get('start_date'),
-                outstanding_balance=lead_data.get('outstanding_balance'),
-                monthly_payment=lead_data.get('monthly_payment'),
-                lender_data_json=lead_data.get('lender_data_json'),
-                
-                # Eligibility
-                is_eligible=lead_data.get('is_eligible', True),
-                ineligible_reason=lead_data.get('ineligible_reason'),
-                is_manual=lead_data.get('is_manual', False),
-                within_date_range=lead_data.get('within_date_range', True),
-                
-                # Consents from claim
-                motor_finance_consent=claim.motor_finance_consent,
-                irresponsible_lending_consent=claim.irresponsible_lending_consent,
-                
-                # Campaign from claim
-                campaign=claim.campaign,
-                client_ip=claim.client_ip,
-                
-                # Status from claim
-                claim_submitted=claim.claim_submitted,
-                submission_datetime=claim.submission_datetime,
-                signature_provided=claim.signature_provided,
-                
-                # Metadata
-                created_at=claim.created_at or datetime.utcnow(),
-                updated_at=datetime.utcnow()
-            )
-            
             try:
-                session.add(lead_record)
+                session.add(LeadIDTracking(**row))
             except Exception as e:
                 logger.error(f"Error adding lead_id {lead_data.get('lead_id')} to tracking: {e}")
                 continue
@@ -3025,8 +3566,8 @@ def detect_tv_spikes():
 
 @app.route("/")
 def index():
-    """Render the main form with tracking configuration"""
-    return render_template(
+    """Render the main form with tracking configuration (cached - output only depends on Config)"""
+    return page_cache.render(
         "index.html", 
         google_analytics_id=Config.GOOGLE_ANALYTICS_ID,
         meta_pixel_id=Config.META_PIXEL_ID,  
@@ -3038,8 +3579,8 @@ def index():
 
 @app.route("/thankyou")
 def thankyou():
-    """Render the thank you page after form submission"""
-    return render_template(
+    """Render the thank you page after form submission (cached - output only depends on Config)"""
+    return page_cache.render(
         "thankyou.html",
         google_analytics_id=Config.GOOGLE_ANALYTICS_ID,
         meta_pixel_id=Config.META_PIXEL_ID
@@ -3048,78 +3589,29 @@ def thankyou():
 @app.route('/js/<path:filename>')
 def serve_js(filename):
     """Serve JavaScript files from js directory"""
-    import os
     js_dir = os.path.join(app.root_path, 'js')
-    return send_from_directory(js_dir, filename)
+    return serve_static_file(asset_manifest, js_dir, filename, '/js')
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files with proper MIME types"""
-    import os
-    
     static_dir = os.path.join(app.root_path, 'static')
-    
-    # MIME type mapping
-    mime_types = {
-        '.css': 'text/css',
-        '.js': 'application/javascript',
-        '.json': 'application/json',
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.svg': 'image/svg+xml',
-        '.ico': 'image/x-icon',
-        '.woff': 'font/woff',
-        '.woff2': 'font/woff2'
-    }
-    
-    # Get MIME type from extension
-    mimetype = None
-    if '.' in filename:
-        ext = '.' + filename.rsplit('.', 1)[1].lower()
-        mimetype = mime_types.get(ext)
-    
-    # Serve with explicit MIME type
-    if mimetype:
-        return send_from_directory(static_dir, filename, mimetype=mimetype)
-    else:
-        return send_from_directory(static_dir, filename)
+    return serve_static_file(asset_manifest, static_dir, filename, '/static')
 
 @app.route('/static/favicon/<path:filename>')
 def serve_favicon(filename):
     """Serve favicon files with proper MIME types"""
-    import os
     favicons_dir = os.path.join(app.root_path, 'static', 'favicon')
-    
-    # Define MIME types for different favicon files
-    mime_types = {
-        'site.webmanifest': 'application/manifest+json',
-        'browserconfig.xml': 'application/xml',
-        '.svg': 'image/svg+xml',
-        '.png': 'image/png',
-        '.ico': 'image/x-icon',
-        'favicon.ico': 'image/x-icon'
-    }
-    
-    # Determine the MIME type
-    mimetype = None
-    for ext, mime in mime_types.items():
-        if filename.endswith(ext) or filename == ext:
-            mimetype = mime
-            break
-    
-    # Default MIME type if not found
-    if not mimetype:
-        if '.' in filename:
-            ext = filename.split('.')[-1].lower()
-            if ext == 'xml':
-                mimetype = 'application/xml'
-            elif ext == 'json':
-                mimetype = 'application/json'
-    
-    # Log favicon request for debugging
-    logger.debug(f"Favicon requested: {filename}, MIME type: {mimetype}")
-    
-    return send_from_directory(favicons_dir, filename, mimetype=mimetype)
+    logger.debug(f"Favicon requested: {filename}")
+    return serve_static_file(asset_manifest, favicons_dir, filename, '/static/favicon')
+
+@app.route('/assets/<path:filename>')
+def serve_fingerprinted_asset(filename):
+    """Serve fingerprinted build output (precompressed, cached forever)"""
+    entry = asset_manifest.get_by_file(filename)
+    if not entry:
+        return jsonify({"error": "Not found"}), 404
+    return send_manifest_entry(entry, immutable=True)
 
 
 
@@ -3326,20 +3818,16 @@ def validate_identity():
             "details": str(e)
         }), 500
 
-@app.route("/query", methods=["POST"])
-@handle_errors
-def query_valifi():
-    client_ip = get_client_ip()
-    logger.info(f"✅ Authorized /query from whitelisted IP: {client_ip}")
-    
-    data = request.json or {}
-
-    # Required fields as you already enforce
-    required_fields = ["firstName", "lastName", "dateOfBirth", "street", "post_town", "post_code"]
-    for field in required_fields:
-        if not data.get(field):
-            return jsonify({"error": f"{field} is required"}), 400
+# === SECTION SEPARATOR ===
+QUERY_REQUIRED_FIELDS = ["firstName", "lastName", "dateOfBirth", "street", "post_town", "post_code"]
 
+def run_credit_query(data, http_session=None, bypass_cache=False):
+    """
+    Request the Equifax report from Valifi for one applicant, upload the PDF to S3
+    and tag each account with date eligibility. Shared by /query and batch imports.
+    Returns the raw Valifi response (with pdfUrl / accounts added to data).
+    Repeat identities are served from credit_report_cache unless bypass_cache is set.
+    """
     # CRITICAL: Trim all name fields to remove leading/trailing spaces
     first_name = (data.get("firstName", "") or "").strip()
     middle_name = (data.get("middleName", "") or "").strip()
@@ -3394,34 +3882,33 @@ def query_valifi():
         "previousPreviousAddress": previous_previous_address
     }
 
-    logger.info(f"Requesting Equifax report for {first_name} {last_name}")
+    return credit_report_cache.get_or_fetch(
+        payload,
+        lambda: fetch_credit_report(payload, http_session=http_session),
+        bypass=bypass_cache
+    )
+
+def fetch_credit_report(payload, http_session=None):
+    """Valifi credit report call plus PDF upload and date eligibility (the uncached part of run_credit_query)"""
+    logger.info(f"Requesting Equifax report for {payload.get('forename')} {payload.get('surname')}")
 
-    # DEBUG: Log exactly what we're sending to Valifi
-    import json
-    logger.info(f"Sending to Valifi: {json.dumps(payload, indent=2)[:500]}")
+    valifi_logger.debug("Sending to Valifi: %s", truncate(payload))
     
-    result = valifi_client.get_credit_report(payload)
+    result = valifi_client.get_credit_report(payload, http_session=http_session)
     
     # Store the full credit report in MEMORY (not session - too large for cookies!)
     # We'll pass it through the frontend instead
     
-    # DEBUG: Log what Valifi actually returned
-    logger.info(f"Valifi API response status: {result.get('status')}")
-    logger.info(f"Valifi response has data: {'data' in result}")
-    if 'data' in result:
-        logger.info(f"Data keys: {list(result['data'].keys())}")
-        logger.info(f"Has jsonReport: {'jsonReport' in result.get('data', {})}")
-        logger.info(f"Has summaryReportV2: {'summaryReportV2' in result.get('data', {})}")
-        
-        # If summaryReportV2 is missing, log the first 500 chars to see structure
-        if 'summaryReportV2' not in result.get('data', {}):
-            import json
-            logger.warning(f"summaryReportV2 MISSING! Response structure: {json.dumps(result, indent=2)[:500]}...")
+    valifi_logger.info("Valifi API response status: %s, data keys: %s", result.get('status'), list((result.get('data') or {}).keys()))
+    if 'data' in result and 'summaryReportV2' not in result.get('data', {}):
+        # Structure only - the report itself can be megabytes
+        valifi_logger.warning("summaryReportV2 MISSING! Response structure: %s", truncate(result))
 
 
     # If result["data"]["pdfReport"] exists, upload to S3 and attach pdfUrl
     report_data = result.get("data", {})
     pdf_b64 = report_data.get("pdfReport")
+    s3_client = get_s3_client() if pdf_b64 else None
     if pdf_b64 and s3_client:
         try:
             pdf_bytes = base64.b64decode(pdf_b64)
@@ -3448,12 +3935,12 @@ def query_valifi():
     
     # Check eligibility for each account
     eligible_accounts = []
-    for account in accounts:
+    date_classes = eligibility_engine.classify_many([account.get('startDate') for account in accounts])
+    for account, date_class in zip(accounts, date_classes):
         if account.get('startDate'):
-            is_eligible, reason = check_date_eligibility(account['startDate'])
-            account['dateEligible'] = is_eligible
-            account['eligibilityReason'] = reason
-            if is_eligible:
+            account['dateEligible'] = date_class.eligible
+            account['eligibilityReason'] = date_class.reason
+            if date_class.eligible:
                 eligible_accounts.append(account)
         else:
             # If no start date, assume eligible (will be caught by manual check later)
@@ -3462,6 +3949,24 @@ def query_valifi():
 
     logger.info(f"Found {len(accounts)} accounts ({len(eligible_accounts)} date-eligible)")
 
+    return result
+
+@app.route("/query", methods=["POST"])
+@handle_errors
+def query_valifi():
+    client_ip = get_client_ip()
+    logger.info(f"✅ Authorized /query from whitelisted IP: {client_ip}")
+    
+    data = request.json or {}
+
+    # Required fields as you already enforce
+    for field in QUERY_REQUIRED_FIELDS:
+        if not data.get(field):
+            return jsonify({"error": f"{field} is required"}), 400
+
+    # bypassCache forces a fresh bureau call (and refreshes the cached report)
+    bypass_cache = str(data.get("bypassCache", "")).lower() == "true" or request.args.get("cache") == "false"
+    result = run_credit_query(data, bypass_cache=bypass_cache)
     return jsonify(result), 200
 
 @app.route("/resume/<resume_token>", methods=["GET"])
@@ -3598,24 +4103,156 @@ def get_resume_data(session_id):
         if session_db:
             session_db.close()
 
-@app.route("/upload_summary", methods=["POST"])
-@handle_errors
-def upload_summary():
+# === SECTION SEPARATOR ===
+def parse_summary_dob(dob_raw):
+    """Date of birth from a summary - UI sends yyyy-mm-dd (optionally with a time) or dd/mm/yyyy"""
+    if "T" in dob_raw:
+        return datetime.strptime(dob_raw.split("T")[0], "%Y-%m-%d").date()
+    if "/" in dob_raw:
+        d, m, y = dob_raw.split("/")
+        return datetime.strptime(f"{y}-{m}-{d}", "%Y-%m-%d").date()
+    return datetime.strptime(dob_raw, "%Y-%m-%d").date()
+
+def build_claim_values(summary, client_ip=None, user_agent=""):
     """
-    Handle final summary submission:
-    - Create one ClaimTracking row (plus professional rep junctions)
-    - Create DCA/IRL FLG leads using the ORIGINAL XML flow (flg_client)
-    - Update ClaimTracking with results
+    ClaimTracking column values for a submitted summary (consents, Valifi snapshot flags,
+    addresses, initial counts). Used for both the ORM insert and the bulk INSERT path, so
+    every summary yields the same set of keys.
     """
-    session = None
-    claim_id = None
+    values = {}
 
-    try:
-        summary = request.json or {}
-        logger.info("Received summary submission")
-        logger.info(f"[DEBUG] session_id value: '{summary.get('session_id')}'")
-        logger.info(f"[DEBUG] sessionId value: '{summary.get('sessionId')}'")  
+    # Personal & contact
+    values["first_name"] = summary.get("firstName", "")
+    values["last_name"] = summary.get("lastName", "")
+    values["email"] = summary.get("email", "")
+    values["mobile"] = summary.get("mobile") or summary.get("phone1", "")
+
+    # Postcode (multiple keys)
+    values["post_code"] = summary.get("postcode") or summary.get("post_code") or summary.get("postCode", "")
 
+    # Date of birth - store as date (flex parsing; UI sends yyyy-mm-dd or dd/mm/yyyy)
+    values["date_of_birth"] = None
+    dob_raw = summary.get("dateOfBirth", "")
+    if dob_raw:
+        try:
+            values["date_of_birth"] = parse_summary_dob(dob_raw)
+        except Exception as e:
+            logger.error(f"Failed to parse DOB '{dob_raw}': {e}")
+
+    # Current address as JSON snapshot (match your model)
+    current_address = {
+        "building_number": summary.get("building_number", ""),
+        "building_name": summary.get("building_name", ""),
+        "flat": summary.get("flat", ""),
+        "street": summary.get("street", ""),
+        "post_town": summary.get("towncity") or summary.get("post_town", ""),
+        "post_code": summary.get("postcode") or summary.get("post_code", ""),
+    }
+    values["current_address"] = json.dumps(current_address)
+
+    # Previous addresses array snapshot
+    prev_addresses = []
+    if summary.get("previousAddress"):
+        prev_addresses.append(summary.get("previousAddress"))
+    if summary.get("previousPreviousAddress"):
+        prev_addresses.append(summary.get("previousPreviousAddress"))
+    values["previous_addresses"] = json.dumps(prev_addresses) if prev_addresses else None
+
+    # Identity / Valifi
+    values["identity_score"] = summary.get("identityScore") or 0
+    min_score = int(os.getenv("VALIFI_MIN_ID_SCORE", "40"))
+    values["identity_verified"] = (values["identity_score"] or 0) >= min_score
+
+    valifi_response = summary.get("valifiResponse")
+    values["valifi_response_stored"] = bool(valifi_response)
+    
+    # CMC detection - Valifi in the response = CMC activity
+    values["cmc_in_credit_report"] = "Yes" if valifi_response and "valifi" in str(valifi_response).lower() else "No"
+
+    # Consents (incl. FCA choice)
+    values["belmond_choice_consent"] = summary.get("belmondChoiceConsent", False)
+    
+    # Map choice reason to full text (or keep custom reason)
+    raw_choice_reason = summary.get("choiceReason", "")
+    values["choice_reason"] = CHOICE_REASON_MAP.get(raw_choice_reason, raw_choice_reason)
+    values["other_reason_text"] = summary.get("otherReasonText", "")
+    
+    # Store disengagement reason with full text mapping
+    disengagement_reason_raw = summary.get("disengagementReason", "")
+    disengagement_other = summary.get("disengagementOtherText", "")
+    if disengagement_reason_raw == "other" and disengagement_other:
+        values["disengagement_reason"] = disengagement_other
+    elif disengagement_reason_raw in DISENGAGEMENT_REASON_MAP:
+        values["disengagement_reason"] = DISENGAGEMENT_REASON_MAP[disengagement_reason_raw]
+    else:
+        values["disengagement_reason"] = disengagement_reason_raw
+    values["disengagement_other_text"] = disengagement_other
+    
+    values["existing_representation_consent"] = summary.get("existingRepresentationConsent")
+    selected_reps = summary.get("selectedProfessionalReps", []) or []
+    values["existing_representation_details"] = json.dumps(selected_reps) if selected_reps else None
+    values["mammoth_promotions_consent"] = summary.get("mammothPromotionsConsent", False)
+    values["motor_finance_consent"] = summary.get("motorFinanceConsent", False)
+    values["irresponsible_lending_consent"] = summary.get("irresponsibleLendingConsent", False)
+
+    # Campaign / tracking / UA
+    values["campaign"] = summary.get("campaign", "Unknown")
+    values["client_ip"] = summary.get("clientIp") or client_ip
+    values["user_agent"] = (user_agent or "")[:255]
+
+    # Signature flags
+    signature_base64 = summary.get("signatureBase64")
+    values["signature_provided"] = bool(signature_base64)
+    values["signature_submitted"] = bool(signature_base64)
+
+    # PDF URL (client may send "TEST_MODE_NO_PDF" in test mode)
+    values["pdf_url"] = summary.get('pdfUrl') or None
+
+    # Eligibility window (stored on the record for transparency)
+    values["date_range_start"] = datetime.strptime(os.getenv("DATE_START", "2007-01-01"), "%Y-%m-%d").date()
+    values["date_range_end"] = datetime.strptime(os.getenv("DATE_END", "2021-01-28"), "%Y-%m-%d").date()
+
+    # Initial counts
+    values.update(
+        lenders_found=0,
+        lenders_manual=0,
+        lenders_eligible=0,
+        lenders_ineligible=0,
+        leads_created_count=0,
+        all_within_date_range=False,
+        claim_submitted=False,
+        claim_status="pending",
+        lead_source=summary_lead_source(summary)
+    )
+    return values
+
+def split_summary_accounts(summary):
+    """(accounts, found_lenders, additional_lenders) for lead processing"""
+    found_lenders = summary.get("foundLenders", []) or []
+    additional_lenders = summary.get("additionalLenders", []) or []
+
+    # If neither foundLenders nor additionalLenders exist, fall back to accounts
+    if not found_lenders and not additional_lenders:
+        accounts = summary.get("accounts", []) or []
+        # When only accounts is provided, treat them all as found (Valifi) lenders
+        return accounts, accounts, []
+    # Combine them for processing
+    return found_lenders + additional_lenders, found_lenders, additional_lenders
+
+def summary_lead_source(summary):
+    """claims_tracking.lead_source for a summary - batch imports are tagged so they can be routed to the batch lane"""
+    return "batch_import" if summary.get("source") == "batch_import" else "api"
+
+def save_claim_from_summary(summary, client_ip=None, user_agent="", keep_open=False):
+    """
+    Create the ClaimTracking row (plus professional rep junctions, visitor session link
+    and Valifi S3 snapshot) for a submitted summary. Shared by /upload_summary and batch imports.
+    keep_open leaves the scoped session open for callers that reuse it across many claims.
+    Returns (claim_id, accounts, found_lenders, additional_lenders).
+    """
+    session_db = None
+    claim_id = None
+    try:
         # INITIALIZE THESE AT THE TOP SCOPE OF TRY BLOCK
         valifi_json = ""
         cmc_detected = False
@@ -3625,151 +4262,24 @@ def upload_summary():
         # 1) CREATE SINGLE CLAIMTRACKING ROW (with consents & Valifi snapshot)
         # === SECTION SEPARATOR ===
         session_db = db_session()
-        claim = ClaimTracking()
 
         # Get the full credit report from the summary (frontend sends it as valifiResponse)
         full_credit_report = summary.get("valifiResponse", {})
         if full_credit_report:
-            logger.info(f"Retrieved full credit report from summary (size: {len(json.dumps(full_credit_report))} chars)")
+            logger.info("Retrieved full credit report from summary")
         else:
             logger.warning("No valifiResponse found in summary")
 
-        # Personal & contact
-        claim.first_name = summary.get("firstName", "")
-        claim.last_name = summary.get("lastName", "")
-        claim.email = summary.get("email", "")
-        claim.mobile = summary.get("mobile") or summary.get("phone1", "")
-
-        # Postcode (multiple keys)
-        claim.post_code = summary.get("postcode") or summary.get("post_code") or summary.get("postCode", "")
-
-        # Date of birth - store as date (flex parsing; UI sends yyyy-mm-dd or dd/mm/yyyy)
-        dob_raw = summary.get("dateOfBirth", "")
-        logger.info(f"[DOB DEBUG] Raw DOB from frontend: '{dob_raw}'")
-        if dob_raw:
-            try:
-                if "T" in dob_raw:
-                    claim.date_of_birth = datetime.strptime(dob_raw.split("T")[0], "%Y-%m-%d").date()
-                elif "/" in dob_raw:
-                    d, m, y = dob_raw.split("/")
-                    claim.date_of_birth = datetime.strptime(f"{y}-{m}-{d}", "%Y-%m-%d").date()
-                else:
-                    claim.date_of_birth = datetime.strptime(dob_raw, "%Y-%m-%d").date()
-            except Exception as e:
-                logger.error(f"Failed to parse DOB '{dob_raw}': {e}")
+        logger.info(f"[DOB DEBUG] Raw DOB from frontend: '{summary.get('dateOfBirth', '')}'")
+        claim = ClaimTracking(**build_claim_values(summary, client_ip=client_ip, user_agent=user_agent))
         
         # Log what was saved to database
-        if hasattr(claim, 'date_of_birth') and claim.date_of_birth:
+        if claim.date_of_birth:
             logger.info(f"[DOB DEBUG] Saved to DB: {claim.date_of_birth}")
         else:
             logger.warning("[DOB DEBUG] No DOB saved to database")
-
-        # Current address as JSON snapshot (match your model)
-        current_address = {
-            "building_number": summary.get("building_number", ""),
-            "building_name": summary.get("building_name", ""),
-            "flat": summary.get("flat", ""),
-            "street": summary.get("street", ""),
-            "post_town": summary.get("towncity") or summary.get("post_town", ""),
-            "post_code": summary.get("postcode") or summary.get("post_code", ""),
-        }
-        claim.current_address = json.dumps(current_address)
-
-        # Previous addresses array snapshot
-        prev_addresses = []
-        if summary.get("previousAddress"):
-            prev_addresses.append(summary.get("previousAddress"))
-        if summary.get("previousPreviousAddress"):
-            prev_addresses.append(summary.get("previousPreviousAddress"))
-        if prev_addresses:
-            claim.previous_addresses = json.dumps(prev_addresses)
-
-        # Identity / Valifi
-        claim.identity_score = summary.get("identityScore") or 0
-        min_score = int(os.getenv("VALIFI_MIN_ID_SCORE", "40"))
-        claim.identity_verified = (claim.identity_score or 0) >= min_score
-
-        valifi_response = summary.get("valifiResponse")
-        claim.valifi_response_stored = bool(valifi_response)
-        
-        # Process Valifi response and detect CMC
-        cmc_in_report = "No"
-        if valifi_response:
-            # Check for Valifi in the response (Valifi = CMC activity)
-            response_str = str(valifi_response).lower()
-            if "valifi" in response_str:
-                cmc_in_report = "Yes"
-                logger.info(f"Valifi detected in credit report for claim {claim_id}")
-            else:
-                logger.info(f"No Valifi detected in credit report for claim {claim_id}")
         
-        # Store the CMC detection result
-        claim.cmc_in_credit_report = cmc_in_report
-
-        # Consents (incl. FCA choice)
-        claim.belmond_choice_consent = summary.get("belmondChoiceConsent", False)
-        
-        # Map choice reason to full text
-        raw_choice_reason = summary.get("choiceReason", "")
-        if raw_choice_reason in CHOICE_REASON_MAP:
-            claim.choice_reason = CHOICE_REASON_MAP[raw_choice_reason]
-        else:
-            # Already full text or custom reason
-            claim.choice_reason = raw_choice_reason
-            
-        claim.other_reason_text = summary.get("otherReasonText", "")
-        
-        # Store disengagement reason with full text mapping
-        disengagement_reason_raw = summary.get("disengagementReason", "")
-        disengagement_other = summary.get("disengagementOtherText", "")
-        
-        if disengagement_reason_raw == "other" and disengagement_other:
-            claim.disengagement_reason = disengagement_other
-        elif disengagement_reason_raw in DISENGAGEMENT_REASON_MAP:
-            claim.disengagement_reason = DISENGAGEMENT_REASON_MAP[disengagement_reason_raw]
-        else:
-            claim.disengagement_reason = disengagement_reason_raw
-            
-        claim.disengagement_other_text = disengagement_other
-        
-        claim.existing_representation_consent = summary.get("existingRepresentationConsent")
         selected_reps = summary.get("selectedProfessionalReps", []) or []
-        if selected_reps:
-            claim.existing_representation_details = json.dumps(selected_reps)
-        claim.mammoth_promotions_consent = summary.get("mammothPromotionsConsent", False)
-        claim.motor_finance_consent = summary.get("motorFinanceConsent", False)
-        claim.irresponsible_lending_consent = summary.get("irresponsibleLendingConsent", False)
-
-        # Campaign / tracking / UA
-        claim.campaign = summary.get("campaign", "Unknown")
-        claim.client_ip = summary.get("clientIp") or request.remote_addr
-        claim.user_agent = request.headers.get("User-Agent", "")[:255]
-
-        # Signature flags
-        signature_base64 = summary.get("signatureBase64")
-        claim.signature_provided = bool(signature_base64)
-        claim.signature_submitted = bool(signature_base64)
-
-        # PDF URL (store immediately; client may send "TEST_MODE_NO_PDF" in test mode)
-        claim.pdf_url = summary.get('pdfUrl') or claim.pdf_url
-        pdf_url = claim.pdf_url  # Make pdf_url available for FLG lead creation
-
-
-        # Eligibility window (stored on the record for transparency)
-        claim.date_range_start = datetime.strptime(os.getenv("DATE_START", "2007-01-01"), "%Y-%m-%d").date()
-        claim.date_range_end = datetime.strptime(os.getenv("DATE_END", "2021-01-28"), "%Y-%m-%d").date()
-
-
-        # Initial counts
-        claim.lenders_found = 0
-        claim.lenders_manual = 0
-        claim.lenders_eligible = 0
-        claim.lenders_ineligible = 0
-        claim.leads_created_count = 0
-        claim.all_within_date_range = False
-        claim.claim_submitted = False
-        claim.claim_status = "pending"
-        claim.lead_source = "api"
 
         session_db.add(claim)
         session_db.flush()
@@ -3831,7 +4341,8 @@ def upload_summary():
                 logger.error(f"Failed to update CMC status: {e}")
                 session_db.rollback()
             finally:
-                session_db.close()
+                if not keep_open:
+                    session_db.close()
             
             if cmc_detected:
                 logger.info(f"Valifi detected in credit report for claim {claim_id} (CMC activity present)")
@@ -3853,7 +4364,8 @@ def upload_summary():
                 logger.info(f"Skipping unknown_cmc placeholder for claim {claim_id} - kept in JSON but not linked")
 
         session_db.commit()
-        session_db.close()
+        if not keep_open:
+            session_db.close()
         session_db = None
 
 
@@ -3862,21 +4374,46 @@ def upload_summary():
         # === SECTION SEPARATOR ===
         
         # Extract lenders from summary
-        found_lenders = summary.get("foundLenders", []) or []
-        additional_lenders = summary.get("additionalLenders", []) or []
-
-        # If neither foundLenders nor additionalLenders exist, fall back to accounts
-        if not found_lenders and not additional_lenders:
-            accounts = summary.get("accounts", []) or []
-            # When only accounts is provided, treat them all as found (Valifi) lenders
-            found_lenders = accounts
-            additional_lenders = []
-        else:
-            # Combine them for processing
-            accounts = found_lenders + additional_lenders
+        accounts, found_lenders, additional_lenders = split_summary_accounts(summary)
 
         logger.info(f"Processing {len(accounts)} lenders (Found: {len(found_lenders)}, Manual: {len(additional_lenders)})...")
 
+        return claim_id, accounts, found_lenders, additional_lenders
+
+    except Exception:
+        if session_db:
+            try:
+                session_db.rollback()
+                if not keep_open:
+                    session_db.close()
+            except Exception:
+                pass
+        raise
+
+@app.route("/upload_summary", methods=["POST"])
+@handle_errors
+def upload_summary():
+    """
+    Handle final summary submission:
+    - Create one ClaimTracking row (plus professional rep junctions)
+    - Create DCA/IRL FLG leads using the ORIGINAL XML flow (flg_client)
+    - Update ClaimTracking with results
+    """
+    claim_id = None
+
+    try:
+        summary = request.json or {}
+        logger.info("Received summary submission")
+        logger.info(f"[DEBUG] session_id value: '{summary.get('session_id')}'")
+        logger.info(f"[DEBUG] sessionId value: '{summary.get('sessionId')}'")  
+
+        claim_id, accounts, found_lenders, additional_lenders = save_claim_from_summary(
+            summary,
+            client_ip=request.remote_addr,
+            user_agent=request.headers.get("User-Agent", "")
+        )
+        current_span().set_attribute("claim_id", claim_id)
+
 
         # === SECTION SEPARATOR ===
         # QUEUE BACKGROUND FLG PROCESSING
@@ -3887,14 +4424,18 @@ def upload_summary():
         if USE_CELERY:
             # Queue task in Celery for background processing
             try:
-                task = process_flg_leads_async.delay(
-                    claim_id=claim_id,
-                    summary=summary,
-                    accounts=accounts,
-                    found_lenders=found_lenders,
-                    additional_lenders=additional_lenders
+                routing = select_queue(summary_lead_source(summary))
+                task = process_flg_leads_async.apply_async(
+                    kwargs=dict(
+                        claim_id=claim_id,
+                        summary=summary,
+                        accounts=accounts,
+                        found_lenders=found_lenders,
+                        additional_lenders=additional_lenders
+                    ),
+                    **routing
                 )
-                logger.info(f"✓ Claim {claim_id} - FLG processing queued in Celery (task_id: {task.id})")
+                logger.info(f"✓ Claim {claim_id} - FLG processing queued in Celery on '{routing['queue']}' (task_id: {task.id})")
             except Exception as e:
                 logger.error(f"✗ Failed to queue Celery task for claim {claim_id}: {e}")
                 # Fallback: process directly if Celery fails
@@ -3936,19 +4477,6 @@ def upload_summary():
         logger.error(f"Error in upload_summary: {e}")
         import traceback
         logger.error(traceback.format_exc())
-        # Clean up any open database sessions
-        if 'session_db' in locals() and session_db:
-            try:
-                session_db.rollback()
-                session_db.close()
-            except:
-                pass
-        if 'session_db2' in locals() and session_db2:
-            try:
-                session_db2.rollback()
-                session_db2.close()
-            except:
-                pass
         return jsonify({"error": str(e)}), 500
 
 # New webhook receiver endpoint
@@ -3976,8 +4504,11 @@ def receive_flg_status_update():
     
 
     if not api_key or api_key != Config.WEBHOOK_API_KEY:
-        logger.warning(f"Invalid API key in webhook request from {client_ip}")
-        logger.warning(f"Checked: header={request.headers.get('X-API-Key')}, query={request.args.get('secret')}, form={request.form.get('api_key')}")
+        flg_webhook_logger.warning("Invalid API key in webhook request from %s", client_ip)
+        flg_webhook_logger.warning(
+            "Checked: header=%s, query=%s, form=%s",
+            redact_secret(request.headers.get('X-API-Key')), redact_secret(request.args.get('secret')), redact_secret(request.form.get('api_key'))
+        )
         return jsonify({"error": "Invalid API key"}), 401
     
     # Optional: Verify HMAC signature if implemented
@@ -4029,25 +4560,25 @@ def receive_flg_status_update():
     else:
         data35 = data35_raw
     
-    # DEBUG LOGGING
-    logger.info(f"=== WEBHOOK RECEIVED ===")
-    logger.info(f"Content-Type: {content_type}")
-    logger.info(f"Lead ID: {lead_id}")
-    logger.info(f"Looking for mapping with:")
-    logger.info(f"  lead_group: '{lead_group}'")
-    logger.info(f"  status_received: '{status}'")
-    logger.info(f"  reference (introducer_received): '{reference_text}'")
-    logger.info(f"  data35_received (original): '{data35_raw}'")
-    logger.info(f"  data35_received (processed): '{data35}'")
+    # Every request is stored in webhook_logs - the log line is only a sample
+    flg_webhook_logger.info(
+        "Webhook received: lead %s, lead_group '%s', status '%s', reference '%s', data35 '%s' (received '%s')",
+        lead_id, lead_group, status, reference_text, data35, data35_raw,
+        extra=sampled("flg_webhook_received")
+    )
     
     # Log the webhook request
     session = db_session()
     
-    # Debug: Show all existing mappings
-    all_mappings = session.query(FLGStatusMapping).all()
-    logger.info(f"Total mappings in database: {len(all_mappings)}")
-    for m in all_mappings:
-        logger.info(f"  Mapping {m.id}: lg='{m.lead_group}', st='{m.status_received}', ref='{m.introducer_received}', d35='{m.data35_received}', action='{m.action}'")
+    # Full mapping table only when debugging the webhook (it's a query per request)
+    if flg_webhook_logger.isEnabledFor(logging.DEBUG):
+        all_mappings = session.query(FLGStatusMapping).all()
+        flg_webhook_logger.debug("Total mappings in database: %s", len(all_mappings))
+        for m in all_mappings:
+            flg_webhook_logger.debug(
+                "  Mapping %s: lg='%s', st='%s', ref='%s', d35='%s', action='%s'",
+                m.id, m.lead_group, m.status_received, m.introducer_received, m.data35_received, m.action
+            )
     
     webhook_log = WebhookLog(
         lead_id=lead_id,
@@ -4095,8 +4626,6 @@ def receive_flg_status_update():
             # Other lead groups with no data35: match NULL
             base_query = base_query.filter(FLGStatusMapping.data35_received.is_(None))
         
-        logger.info(f"Searching with SQL query filters applied")
-        
         # Get the best matching mapping
         mapping = base_query.order_by(FLGStatusMapping.priority.desc()).first()
         
@@ -4270,19 +4799,20 @@ def metrics():
     if request.headers.get('X-Metrics-Key') != os.getenv('METRICS_KEY', 'default-metrics-key'):
         return jsonify({"error": "Unauthorized"}), 401
     
+    session = None
     try:
+        # This process's buffered counts first, then O(1) reads of the rollup rows
+        try:
+            rollup_buffer.flush()
+        except Exception as e:
+            logger.warning(f"Rollup flush before metrics failed: {e}")
+
         session = db_session()
+        rollups = read_rollups(session)
         
-        # Get basic stats
-        total_visitors = session.query(VisitorSession).count()
-        today_visitors = session.query(VisitorSession).filter(
-            VisitorSession.first_visit >= datetime.utcnow().date()
-        ).count()
-        
-        # Get conversions
-        total_conversions = session.query(VisitorSession).filter(
-            VisitorSession.form_completed == True
-        ).count()
+        total_visitors = rollups["total"].get("visits", 0)
+        today_visitors = rollups["today"].get("visits", 0)
+        total_conversions = rollups["total"].get("form_completions", 0)
         
         conversion_rate = (total_conversions / total_visitors * 100) if total_visitors > 0 else 0
         
@@ -4291,6 +4821,9 @@ def metrics():
             "today_visitors": today_visitors,
             "total_conversions": total_conversions,
             "conversion_rate": round(conversion_rate, 2),
+            "counters": rollups,
+            "upstreams": {guard.name: guard.snapshot() for guard in upstream_guards},
+            "webhook_outbox": {**outbox_backlog(session), "dispatcher": webhook_dispatcher.state()},
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -4303,6 +4836,60 @@ def metrics():
             session.close()
         return jsonify({"error": "Failed to get metrics"}), 500
 
+@app.route("/metrics/prometheus", methods=["GET"])
+def prometheus_metrics():
+    """Latency histograms and counters in Prometheus text format (all gunicorn workers)"""
+    metrics_key = os.getenv('METRICS_KEY', 'default-metrics-key')
+    bearer = request.headers.get('Authorization', '')
+    if request.headers.get('X-Metrics-Key') != metrics_key and bearer != f"Bearer {metrics_key}":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    body, content_type = render_metrics()
+    return Response(body, mimetype=None, content_type=content_type)
+
+def admin_key_authorised(key):
+    """X-Admin-Key or Authorization: Bearer matching key (never when it's unset)"""
+    if not key:
+        return False
+    supplied = request.headers.get('X-Admin-Key') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return hmac.compare_digest(supplied.encode(), key.encode())
+
+def profiler_authorised():
+    """X-Admin-Key or Authorization: Bearer matching PROFILER_KEY"""
+    return admin_key_authorised(Config.PROFILER_KEY)
+
+@app.route("/admin/profile", methods=["GET"])
+def admin_profile():
+    """
+    Sample the worker that takes this request for ?seconds= (default 10) at ?hz= (default 100)
+    and return collapsed stacks for flamegraph.pl / speedscope. ?threads=all adds non-hub threads.
+    A worker whose hub is pinned can't answer - send it PROFILER_SIGNAL instead.
+    """
+    if not profiler_authorised():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        folded, samples = run_profile(
+            seconds=request.args.get('seconds', 10, type=float),
+            hz=request.args.get('hz', 100, type=float),
+            all_threads=request.args.get('threads') == 'all'
+        )
+    except ProfileBusy as e:
+        return jsonify({"error": str(e)}), 409
+    logger.warning(f"Profiled worker {os.getpid()}: {samples} samples")
+    filename = f"profile-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return Response(folded, mimetype="text/plain", headers={
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Profile-Pid": str(os.getpid()),
+        "X-Profile-Samples": str(samples)
+    })
+
+@app.route("/admin/greenlets", methods=["GET"])
+def admin_greenlets():
+    """Thread and greenlet stacks plus upstream limiter / log / span queue states of this worker"""
+    if not profiler_authorised():
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(dump_state(), mimetype="text/plain", headers={"X-Profile-Pid": str(os.getpid())})
+
 # === SECTION SEPARATOR ===
 @app.errorhandler(404)
 def not_found(error):
@@ -4318,8 +4905,37 @@ def internal_error(error):
 def shutdown_session(exception=None):
     db_session.remove()
 
+# === SECTION SEPARATOR ===
+def create_app():
+    """
+    Application factory - gunicorn runs "app:create_app()".
+    Importing the module only defines things; database, AWS clients and worker resources
+    are created on first use, and schema/sequence work is the separate bootstrap command.
+    DB_BOOTSTRAP_ON_START=true runs the bootstrap here instead (local development).
+    """
+    if os.getenv("DB_BOOTSTRAP_ON_START", "false").lower() == "true":
+        try:
+            bootstrap_database()
+        except Exception as e:
+            logger.error(f"Database bootstrap failed: {e}")
+    return app
+
 # === SECTION SEPARATOR ===
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bootstrap":
+        # python app.py bootstrap - schema + sequence fixes, then exit
+        bootstrap_database()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-log-tables":
+        # python app.py migrate-log-tables - online indexes + webhook_logs partitioning (one-off)
+        logger.info(f"Log table migration: {migrate_log_tables(engine)}")
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "maintain-log-tables":
+        # python app.py maintain-log-tables - daily (cron): upcoming partitions, archive + drop expired logs
+        logger.info(f"Log table maintenance: {maintain_log_tables(engine)}")
+        sys.exit(0)
+    
     port = int(os.environ.get("PORT", 5000))
     logger.info(f"Starting Flask app on port {port}")
     
@@ -4329,8 +4945,8 @@ if __name__ == "__main__":
     
     # FIX: Create instance to access the property
     config = Config()
-    logger.info(f"Webhook URL configured as: {config.WEBHOOK_URL}")
+    logger.info(f"Webhook URL configured as: {config.WEBHOOK_BASE_URL} (secret {'set' if Config.WEBHOOK_SECRET else 'not set'})")
     logger.info(f"Google Analytics ID: {Config.GOOGLE_ANALYTICS_ID if Config.GOOGLE_ANALYTICS_ID else 'Not configured'}")
     logger.info(f"Date eligibility range: {Config.DATE_START} to {Config.DATE_END}")
     logger.info(f"Database URL: {'Configured' if Config.DATABASE_URL else 'Not configured'}")
-    app.run(host="0.0.0.0", port=port, debug=Config.DEBUG)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=port, debug=Config.DEBUG)
\ No newline at end of file
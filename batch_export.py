@@ -0,0 +1,243 @@
+"""
+Batch results export (GET /batch/export)
+Streams claims_tracking joined to lead_ids_tracking - one row per lead id, filtered by batch
+or campaign - as NDJSON, CSV or XLSX. Rows come off a server-side cursor (yield_per) and are
+written out as they arrive, so memory stays flat however many leads the export covers.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "1000"))
+EXPORT_FLUSH_BYTES = 64 * 1024
+XLSX_READ_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# (export column, model attribute) - same column names the browser export used
+CLAIM_COLUMNS = [
+    ("claim_id", "id"),
+    ("first_name", "first_name"),
+    ("last_name", "last_name"),
+    ("email", "email"),
+    ("mobile", "mobile"),
+    ("date_of_birth", "date_of_birth"),
+    ("current_address", "current_address"),
+    ("previous_addresses", "previous_addresses"),
+    ("identity_score", "identity_score"),
+    ("identity_verified", "identity_verified"),
+    ("valifi_response_stored", "valifi_response_stored"),
+    ("lenders_found_count", "lenders_found"),
+    ("lenders_found_list", "lenders_found_list"),
+    ("lenders_manual_count", "lenders_manual"),
+    ("lenders_eligible", "lenders_eligible"),
+    ("lenders_ineligible", "lenders_ineligible"),
+    ("motor_finance_consent", "motor_finance_consent"),
+    ("irresponsible_lending_consent", "irresponsible_lending_consent"),
+    ("belmond_choice_consent", "belmond_choice_consent"),
+    ("choice_reason", "choice_reason"),
+    ("other_reason_text", "other_reason_text"),
+    ("existing_representation_consent", "existing_representation_consent"),
+    ("mammoth_promotions_consent", "mammoth_promotions_consent"),
+    ("disengagement_reason", "disengagement_reason"),
+    ("disengagement_other_text", "disengagement_other_text"),
+    ("campaign", "campaign"),
+    ("client_ip", "client_ip"),
+    ("claim_submitted", "claim_submitted"),
+    ("submission_datetime", "submission_datetime"),
+    ("leads_created_count", "leads_created_count"),
+    ("pdf_url", "pdf_url"),
+    ("credit_report_s3_url", "credit_report_s3_url"),
+    ("cmc_in_credit_report", "cmc_in_credit_report"),
+    ("signature_provided", "signature_provided"),
+    ("created_at", "created_at"),
+    ("claim_status", "claim_status"),
+    ("lead_source", "lead_source"),
+]
+
+LEAD_COLUMNS = [
+    ("lead_id", "lead_id"),
+    ("lead_group", "lead_group"),
+    ("lead_type", "lead_type"),
+    ("lender_name", "lender_name"),
+    ("reference", "reference"),
+    ("cost", "cost"),
+    ("account_number", "account_number"),
+    ("start_date", "start_date"),
+    ("outstanding_balance", "outstanding_balance"),
+    ("monthly_payment", "monthly_payment"),
+    ("lender_data_json", "lender_data_json"),
+    ("is_eligible", "is_eligible"),
+    ("ineligible_reason", "ineligible_reason"),
+    ("is_manual", "is_manual"),
+    ("within_date_range", "within_date_range"),
+    ("current_status", "current_status"),
+    ("current_introducer", "current_introducer"),
+    ("last_status_update", "last_status_update"),
+]
+
+EXPORT_HEADERS = [name for name, _ in CLAIM_COLUMNS + LEAD_COLUMNS]
+
+
+# === SECTION SEPARATOR ===
+# Query
+# === SECTION SEPARATOR ===
+
+def build_export_query(batch_id=None, campaign=None, leads_only=False):
+    """SELECT of the export columns, ordered by claim then lead"""
+    from sqlalchemy import select
+    from app import ClaimTracking, LeadIDTracking, BatchRecord
+
+    columns = [getattr(ClaimTracking, attr).label(name) for name, attr in CLAIM_COLUMNS]
+    columns += [getattr(LeadIDTracking, attr).label(name) for name, attr in LEAD_COLUMNS]
+
+    query = select(*columns).select_from(ClaimTracking)
+    if leads_only:
+        query = query.join(LeadIDTracking, LeadIDTracking.claim_id == ClaimTracking.id)
+    else:
+        query = query.outerjoin(LeadIDTracking, LeadIDTracking.claim_id == ClaimTracking.id)
+
+    if batch_id is not None:
+        batch_claims = select(BatchRecord.claim_id).where(
+            BatchRecord.batch_id == batch_id,
+            BatchRecord.claim_id.isnot(None)
+        )
+        query = query.where(ClaimTracking.id.in_(batch_claims))
+    if campaign:
+        query = query.where(ClaimTracking.campaign == campaign)
+
+    return query.order_by(ClaimTracking.id, LeadIDTracking.id)
+
+
+def iter_export_rows(batch_id=None, campaign=None, leads_only=False):
+    """
+    Export rows as tuples (EXPORT_HEADERS order), fetched EXPORT_FETCH_ROWS at a time from a
+    server-side cursor. Uses its own session so the stream outlives the request's scoped one.
+    """
+    from app import SessionLocal
+
+    session_db = SessionLocal()
+    try:
+        result = session_db.execute(
+            build_export_query(batch_id, campaign, leads_only),
+            execution_options={"yield_per": EXPORT_FETCH_ROWS}
+        )
+        for row in result:
+            yield tuple(row)
+    finally:
+        session_db.close()
+
+
+# === SECTION SEPARATOR ===
+# Formats
+# === SECTION SEPARATOR ===
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _sheet_value(value):
+    """Dates as DD/MM/YYYY like the browser export; everything else as-is"""
+    if isinstance(value, datetime):
+        return value.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def stream_ndjson(rows):
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps({name: _json_value(value) for name, value in zip(EXPORT_HEADERS, row)}) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        writer.writerow(["" if value is None else _sheet_value(value) for value in row])
+        if out.tell() >= EXPORT_FLUSH_BYTES:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def stream_xlsx(rows):
+    """
+    openpyxl write-only workbook: rows go straight to a temp file, never a sheet in memory.
+    The zip's central directory is only known at the end, so the finished file is then sent in chunks.
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Batch Results")
+    sheet.append(EXPORT_HEADERS)
+    for row in rows:
+        sheet.append([_sheet_value(value) for value in row])
+
+    with tempfile.TemporaryFile() as handle:
+        workbook.save(handle)
+        handle.seek(0)
+        while True:
+            chunk = handle.read(XLSX_READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+EXPORT_WRITERS = {
+    "ndjson": stream_ndjson,
+    "csv": stream_csv,
+    "xlsx": stream_xlsx,
+}
+
+
+def export_filename(fmt, batch_id=None, campaign=None):
+    if batch_id is not None:
+        scope = f"batch_{batch_id}"
+    else:
+        scope = "campaign_" + "".join(c if c.isalnum() else "_" for c in campaign)[:60]
+    return f"export_{scope}_{datetime.utcnow().strftime('%Y-%m-%d')}.{fmt}"
+
+
+def stream_export(fmt, batch_id=None, campaign=None, leads_only=False):
+    """Chunks of the export file in the requested format"""
+    rows = iter_export_rows(batch_id, campaign, leads_only)
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    yield from EXPORT_WRITERS[fmt](counted())
+    logger.info(f"[EXPORT] {fmt} export of {count} rows (batch={batch_id}, campaign={campaign})")
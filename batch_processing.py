@@ -0,0 +1,870 @@
+"""
+Server-side batch import engine
+Replaces the one-record-at-a-time browser loop in batch.html: an uploaded CSV/XLSX becomes
+a BatchJob with one BatchRecord per row, and records are fanned out to Celery workers
+(or background threads when Celery is disabled) under a per-batch concurrency cap and
+Valifi rate limit. Each record runs the same /query -> summary -> /upload_summary pipeline.
+
+With chunk_size > 1 a worker message carries a chunk of records instead of one, and the
+chunk shares a LeadProcessingContext (one DB session, lender index and HTTP pool) and
+writes its outcomes with bulk updates/inserts.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from query_audit import audited
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+DEFAULT_RATE_PER_MINUTE = int(os.getenv("BATCH_VALIFI_RATE_PER_MINUTE", "60"))
+MAX_RECORDS_PER_BATCH = int(os.getenv("BATCH_MAX_RECORDS", "20000"))
+DEFAULT_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1"))
+MAX_CHUNK_SIZE = int(os.getenv("BATCH_MAX_CHUNK_SIZE", "200"))
+
+# Chunk outcomes are written (and the pause flag re-read) every this many records
+CHUNK_FLUSH_EVERY = 25
+
+# Records a worker owns (or is about to) - counted against the batch concurrency
+IN_FLIGHT_STATUSES = ('queued', 'processing')
+
+# In-flight records untouched for this long lost their worker (killed, redeployed, message
+# dropped) and go back to pending. Chunks re-stamp each record as they start it, so this only
+# has to exceed one record's run time - kept above the chunk task's hard time limit (3600s).
+STALE_RECORD_SECONDS = int(os.getenv("BATCH_STALE_RECORD_SECONDS", "3900"))
+# Worst case for one record (identity + credit report calls with retries, then lead sends)
+RECORD_MAX_SECONDS = int(os.getenv("BATCH_RECORD_MAX_SECONDS", "120"))
+# Wall time a chunk may spend - below the chunk task's soft time limit (3540s), and also
+# applied to the thread fallback, which has no limit of its own
+CHUNK_TIME_BUDGET_SECONDS = int(os.getenv("BATCH_CHUNK_TIME_BUDGET_SECONDS", "3300"))
+# A record reaped this many times is failed instead - it is probably what kills the worker
+MAX_RECORD_ATTEMPTS = int(os.getenv("BATCH_MAX_RECORD_ATTEMPTS", "3"))
+
+# Fields dropped from stored lead ids - the full account is already in the claim snapshot
+RESULT_LEAD_EXCLUDED_FIELDS = ('lender_data',)
+
+
+# === SECTION SEPARATOR ===
+# Upload parsing
+# === SECTION SEPARATOR ===
+
+def _normalise_row(row):
+    """Strip keys/values and drop empty headers"""
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = str(key).strip().lower()
+        if not key:
+            continue
+        if value is None:
+            value = ""
+        elif isinstance(value, float) and value.is_integer():
+            # Excel stores numbers (dob parts, mobiles) as floats
+            value = str(int(value))
+        cleaned[key] = str(value).strip()
+    return cleaned
+
+
+def parse_upload(filename, data):
+    """Parse an uploaded CSV or XLSX file into a list of row dicts (rows without a name are dropped)"""
+    name = (filename or "").lower()
+    rows = []
+
+    if name.endswith(".xlsx"):
+        import openpyxl
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        sheet = workbook.active
+        iterator = sheet.iter_rows(values_only=True)
+        header = next(iterator, None) or []
+        for values in iterator:
+            rows.append(_normalise_row(dict(zip(header, values))))
+        workbook.close()
+    else:
+        text = data.decode("utf-8-sig", errors="replace")
+        for row in csv.DictReader(io.StringIO(text)):
+            rows.append(_normalise_row(row))
+
+    # Same filter the browser used: first and last name must be present
+    return [row for row in rows if row.get("first_name") and row.get("last_name")]
+
+
+# === SECTION SEPARATOR ===
+# Row -> query payload / summary (ported from the batch.html runBatch loop)
+# === SECTION SEPARATOR ===
+
+def format_dob(row):
+    """dob_year/dob_month/dob_day columns -> YYYY-MM-DD ('' when incomplete)"""
+    year = row.get("dob_year", "")
+    month = row.get("dob_month", "").zfill(2)
+    day = row.get("dob_day", "").zfill(2)
+    if year and month and day and len(year) == 4:
+        return f"{year}-{month}-{day}"
+    return ""
+
+
+def build_previous_address(row, prefix):
+    """prev1_* / prev2_* columns -> address dict (None without a postcode)"""
+    post_code = row.get(f"{prefix}_post_code", "")
+    if not post_code:
+        return None
+    return {
+        "flat": row.get(f"{prefix}_flat", ""),
+        "building_name": row.get(f"{prefix}_building_name", ""),
+        "building_number": row.get(f"{prefix}_building_number", ""),
+        "street": row.get(f"{prefix}_street", ""),
+        "district": row.get(f"{prefix}_district", ""),
+        "county": row.get(f"{prefix}_county", ""),
+        "post_town": row.get(f"{prefix}_post_town", ""),
+        "post_code": post_code
+    }
+
+
+def build_query_payload(row):
+    """The /query request body for one row"""
+    return {
+        "firstName": row.get("first_name", ""),
+        "lastName": row.get("last_name", ""),
+        "middleName": row.get("middle_name", ""),
+        "title": row.get("title", ""),
+        "dateOfBirth": format_dob(row),
+        "flat": row.get("flat", ""),
+        "building_name": row.get("building_name", ""),
+        "building_number": row.get("building_number", ""),
+        "street": row.get("street", ""),
+        "district": row.get("district", ""),
+        "county": row.get("county", ""),
+        "post_town": row.get("post_town", ""),
+        "post_code": row.get("post_code", ""),
+        "previousAddress": build_previous_address(row, "prev1"),
+        "previousPreviousAddress": build_previous_address(row, "prev2")
+    }
+
+
+def extract_accounts(valifi_response):
+    """Accounts from wherever Valifi put them"""
+    data = (valifi_response or {}).get("data") or {}
+    for source in (data.get("summaryReportV2"), data, data.get("summaryReport")):
+        if source and source.get("accounts"):
+            return source["accounts"]
+    return []
+
+
+def build_summary(row, query_payload, valifi_response, accounts, campaign, session_id, skip_flg=True):
+    """The /upload_summary body for one row - standard batch consent defaults"""
+    mobile = row.get("mobile", "")
+    uk_mobile = "0" + mobile[2:] if mobile.startswith("44") else mobile
+
+    return {
+        # Identity
+        "firstName": query_payload["firstName"],
+        "lastName": query_payload["lastName"],
+        "middleName": query_payload["middleName"],
+        "title": query_payload["title"],
+        "dateOfBirth": query_payload["dateOfBirth"],
+
+        # Contact
+        "email": row.get("email", ""),
+        "mobile": uk_mobile,
+        "phone1": uk_mobile,
+
+        # Address (multiple key formats for compatibility)
+        "flat": query_payload["flat"],
+        "building_name": query_payload["building_name"],
+        "building_number": query_payload["building_number"],
+        "street": query_payload["street"],
+        "district": query_payload["district"],
+        "county": query_payload["county"],
+        "post_town": query_payload["post_town"],
+        "towncity": query_payload["post_town"],
+        "post_code": query_payload["post_code"],
+        "postcode": query_payload["post_code"],
+        "postCode": query_payload["post_code"],
+
+        # Previous addresses
+        "previousAddress": query_payload["previousAddress"],
+        "previousPreviousAddress": query_payload["previousPreviousAddress"],
+
+        # Valifi data - the entire response
+        "valifiResponse": valifi_response,
+        "identityScore": 0,
+        "identityVerified": True,
+
+        # Lenders
+        "accounts": accounts,
+        "foundLenders": accounts,
+        "additionalLenders": [],
+
+        # Consents (standard batch defaults)
+        "belmondChoiceConsent": True,
+        "choiceReason": "Comprehensive",
+        "otherReasonText": "",
+        "existingRepresentationConsent": "No",
+        "selectedProfessionalReps": [],
+        "mammothPromotionsConsent": False,
+        "motorFinanceConsent": True,
+        "irresponsibleLendingConsent": True,
+        "disengagementReason": "",
+        "disengagementOtherText": "",
+
+        # Signature & PDF
+        "signatureBase64": "",
+        "pdfUrl": ((valifi_response or {}).get("data") or {}).get("pdfUrl", ""),
+
+        # Batch flags
+        "skipFLG": skip_flg,
+        "skip_flg": skip_flg,
+        "tlwSolicitorsSelected": False,
+
+        # Tracking
+        "campaign": campaign,
+        "clientIp": "127.0.0.1",
+        "session_id": session_id,
+        "source": "batch_import",
+        "medium": "csv"
+    }
+
+
+# === SECTION SEPARATOR ===
+# Job creation / control
+# === SECTION SEPARATOR ===
+
+def max_chunk_size(rate_per_minute):
+    """Largest chunk whose worst case (rate pacing + RECORD_MAX_SECONDS per record) fits the chunk time budget"""
+    per_record = 60.0 / max(rate_per_minute or 1, 1) + RECORD_MAX_SECONDS
+    return max(1, min(MAX_CHUNK_SIZE, int(CHUNK_TIME_BUDGET_SECONDS // per_record)))
+
+
+def create_batch(rows, filename, campaign=None, concurrency=None, rate_per_minute=None, skip_flg=True, chunk_size=None):
+    """Persist a BatchJob plus one pending BatchRecord per row. Returns the job id."""
+    from app import db_session, BatchJob, BatchRecord
+
+    rows = rows[:MAX_RECORDS_PER_BATCH]
+    concurrency = max(1, min(int(concurrency or DEFAULT_CONCURRENCY), MAX_CONCURRENCY))
+    rate_per_minute = max(1, int(rate_per_minute or DEFAULT_RATE_PER_MINUTE))
+    chunk_size = max(1, min(int(chunk_size or DEFAULT_CHUNK_SIZE), max_chunk_size(rate_per_minute)))
+    campaign = campaign or f"batch_import_{datetime.utcnow().strftime('%Y-%m-%d')}"
+
+    session_db = db_session()
+    try:
+        job = BatchJob(
+            filename=(filename or "")[:255],
+            campaign=campaign[:255],
+            status='running',
+            concurrency=concurrency,
+            rate_per_minute=rate_per_minute,
+            chunk_size=chunk_size,
+            total_records=len(rows),
+            skip_flg=skip_flg
+        )
+        session_db.add(job)
+        session_db.flush()
+        batch_id = job.id
+
+        session_db.bulk_insert_mappings(BatchRecord, [
+            {
+                "batch_id": batch_id,
+                "row_number": index,
+                "status": 'pending',
+                "row_data": json.dumps(row),
+                "attempts": 0
+            }
+            for index, row in enumerate(rows, start=1)
+        ])
+        session_db.commit()
+        logger.info(f"[BATCH-{batch_id}] Created batch from {filename}: {len(rows)} records, concurrency={concurrency}, chunk_size={chunk_size}, rate={rate_per_minute}/min")
+        return batch_id
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+
+def set_batch_status(batch_id, status):
+    """Pause / resume a batch. Returns False when the batch does not exist."""
+    from app import db_session, BatchJob
+
+    session_db = db_session()
+    try:
+        job = session_db.query(BatchJob).filter_by(id=batch_id).first()
+        if not job:
+            return False
+        job.status = status
+        if status == 'running':
+            job.completed_at = None
+        session_db.commit()
+        logger.info(f"[BATCH-{batch_id}] Status set to {status}")
+    finally:
+        session_db.close()
+
+    if status == 'running':
+        dispatch_batch(batch_id)
+    return True
+
+
+def retry_failed_records(batch_id):
+    """Put failed records back to pending and restart the batch. Returns the number reset."""
+    from app import db_session, BatchJob, BatchRecord
+
+    session_db = db_session()
+    try:
+        job = session_db.query(BatchJob).filter_by(id=batch_id).first()
+        if not job:
+            return None
+        reset = session_db.query(BatchRecord).filter(
+            BatchRecord.batch_id == batch_id,
+            BatchRecord.status == 'failed'
+        ).update({"status": 'pending', "error": None}, synchronize_session=False)
+        job.status = 'running'
+        job.completed_at = None
+        session_db.commit()
+        logger.info(f"[BATCH-{batch_id}] Retrying {reset} failed records")
+    finally:
+        session_db.close()
+
+    dispatch_batch(batch_id)
+    return reset
+
+
+def get_batch_progress(batch_id):
+    """Job settings plus per-status record counts (None when the batch does not exist)"""
+    from app import db_session, BatchJob, BatchRecord
+    from sqlalchemy import func
+
+    session_db = db_session()
+    try:
+        job = session_db.query(BatchJob).filter_by(id=batch_id).first()
+        if not job:
+            return None
+        counts = dict(
+            session_db.query(BatchRecord.status, func.count(BatchRecord.id))
+            .filter(BatchRecord.batch_id == batch_id)
+            .group_by(BatchRecord.status)
+            .all()
+        )
+        finished = sum(counts.get(status, 0) for status in ('done', 'failed', 'skipped'))
+        total = job.total_records or 0
+        return {
+            "batch_id": job.id,
+            "filename": job.filename,
+            "campaign": job.campaign,
+            "status": job.status,
+            "concurrency": job.concurrency,
+            "rate_per_minute": job.rate_per_minute,
+            "chunk_size": job.chunk_size or 1,
+            "total_records": total,
+            "counts": {status: counts.get(status, 0) for status in ('pending', 'queued', 'processing', 'done', 'failed', 'skipped')},
+            "finished": finished,
+            "percent": round(finished * 100.0 / total, 1) if total else 100.0,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "completed_at": job.completed_at.isoformat() if job.completed_at else None
+        }
+    finally:
+        session_db.close()
+
+
+def get_batch_records(batch_id, after_row=0, limit=500, status=None):
+    """Records (row data + results) ordered by row number, keyset-paged on row_number"""
+    from app import db_session, BatchRecord
+
+    session_db = db_session()
+    try:
+        query = session_db.query(BatchRecord).filter(
+            BatchRecord.batch_id == batch_id,
+            BatchRecord.row_number > after_row
+        )
+        if status:
+            query = query.filter(BatchRecord.status == status)
+        records = query.order_by(BatchRecord.row_number).limit(limit).all()
+        return [
+            {
+                "row_number": record.row_number,
+                "status": record.status,
+                "row": json.loads(record.row_data) if record.row_data else {},
+                "claim_id": record.claim_id,
+                "result": json.loads(record.result) if record.result else None,
+                "error": record.error,
+                "attempts": record.attempts
+            }
+            for record in records
+        ]
+    finally:
+        session_db.close()
+
+
+# === SECTION SEPARATOR ===
+# Dispatch - keeps up to `concurrency` records (or chunks) in flight, spaced by the Valifi rate limit
+# === SECTION SEPARATOR ===
+
+def _reap_stale_records(session_db, batch_id):
+    """
+    Return in-flight records whose lease (started_at - set when queued and again when a
+    worker takes them) is older than STALE_RECORD_SECONDS to pending, or fail them once
+    they've used MAX_RECORD_ATTEMPTS. Returns the number of records touched.
+    """
+    from app import BatchRecord
+
+    stale = (
+        BatchRecord.batch_id == batch_id,
+        BatchRecord.status.in_(IN_FLIGHT_STATUSES),
+        BatchRecord.started_at < datetime.utcnow() - timedelta(seconds=STALE_RECORD_SECONDS)
+    )
+    failed = session_db.query(BatchRecord).filter(*stale, BatchRecord.attempts >= MAX_RECORD_ATTEMPTS).update({
+        "status": 'failed',
+        "error": f"Worker lost {MAX_RECORD_ATTEMPTS} times - giving up",
+        "finished_at": datetime.utcnow()
+    }, synchronize_session=False)
+    requeued = session_db.query(BatchRecord).filter(*stale).update(
+        {"status": 'pending'}, synchronize_session=False
+    )
+    if failed or requeued:
+        logger.warning(f"[BATCH-{batch_id}] Reaped stale in-flight records: {requeued} back to pending, {failed} failed")
+    return failed + requeued
+
+
+def dispatch_batch(batch_id):
+    """
+    Top the batch up to its concurrency limit.
+    Called on start/resume/retry and after every finished record or chunk. The job row is
+    locked while slots are handed out, so concurrent callers never over-dispatch, and each
+    record gets a start time from the job's rate-limit slot (shared across all workers).
+    With chunk_size > 1 the limit is `concurrency` chunks of `chunk_size` records each.
+    In-flight records whose worker vanished are reaped first so they can't hold slots forever.
+    Returns the number of records dispatched.
+    """
+    from app import db_session, BatchJob, BatchRecord
+
+    schedule = []
+    session_db = db_session()
+    try:
+        job = session_db.query(BatchJob).filter_by(id=batch_id).with_for_update().first()
+        if not job or job.status != 'running':
+            session_db.commit()
+            return 0
+
+        _reap_stale_records(session_db, batch_id)
+        in_flight = session_db.query(BatchRecord).filter(
+            BatchRecord.batch_id == batch_id,
+            BatchRecord.status.in_(IN_FLIGHT_STATUSES)
+        ).count()
+        chunk_size = max(min(job.chunk_size or 1, max_chunk_size(job.rate_per_minute)), 1)
+        chunks_in_flight = -(-in_flight // chunk_size)
+        free_slots = max((job.concurrency or 1) - chunks_in_flight, 0) * chunk_size
+
+        pending_ids = []
+        if free_slots:
+            pending_ids = [row[0] for row in session_db.query(BatchRecord.id).filter(
+                BatchRecord.batch_id == batch_id,
+                BatchRecord.status == 'pending'
+            ).order_by(BatchRecord.row_number).limit(free_slots).all()]
+
+        if not pending_ids:
+            if in_flight == 0:
+                job.status = 'completed'
+                job.completed_at = datetime.utcnow()
+                logger.info(f"[BATCH-{batch_id}] All records finished - batch completed")
+            session_db.commit()
+            return 0
+
+        now = datetime.utcnow()
+        interval = timedelta(seconds=60.0 / max(job.rate_per_minute or 1, 1))
+        slot = max(now, job.next_dispatch_at or now)
+        for record_id in pending_ids:
+            schedule.append((record_id, max((slot - now).total_seconds(), 0.0)))
+            slot += interval
+        job.next_dispatch_at = slot
+
+        session_db.query(BatchRecord).filter(BatchRecord.id.in_(pending_ids)).update(
+            {"status": 'queued', "started_at": now}, synchronize_session=False
+        )
+        session_db.commit()
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+    if chunk_size > 1:
+        for start in range(0, len(schedule), chunk_size):
+            _enqueue_chunk(batch_id, schedule[start:start + chunk_size])
+    else:
+        for record_id, countdown in schedule:
+            _enqueue_record(batch_id, record_id, countdown)
+
+    logger.info(f"[BATCH-{batch_id}] Dispatched {len(schedule)} records")
+    return len(schedule)
+
+
+def _enqueue_record(batch_id, record_id, countdown):
+    """Hand one record to a Celery worker, or to a background thread without Celery"""
+    from app import USE_CELERY
+
+    if USE_CELERY:
+        try:
+            from tasks import process_batch_record_async, lane_options
+            process_batch_record_async.apply_async(args=[record_id], countdown=countdown, **lane_options('batch'))
+            return
+        except Exception as e:
+            logger.error(f"[BATCH-{batch_id}] Failed to queue record {record_id} in Celery: {e} - running in-process")
+
+    def run():
+        if countdown:
+            time.sleep(countdown)
+        process_batch_record(record_id)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _enqueue_chunk(batch_id, schedule):
+    """
+    Hand a chunk of records to one Celery worker (or background thread).
+    Each item carries the record's earliest start as an epoch timestamp, so the worker can
+    keep the rate-limit spacing while it works through the chunk sequentially.
+    """
+    from app import USE_CELERY
+
+    now = time.time()
+    items = [[record_id, now + countdown] for record_id, countdown in schedule]
+    countdown = schedule[0][1]
+
+    if USE_CELERY:
+        try:
+            from tasks import process_batch_chunk_async, lane_options
+            process_batch_chunk_async.apply_async(args=[items], countdown=countdown, **lane_options('batch'))
+            return
+        except Exception as e:
+            logger.error(f"[BATCH-{batch_id}] Failed to queue chunk of {len(items)} in Celery: {e} - running in-process")
+
+    threading.Thread(target=process_batch_chunk, args=(items,), daemon=True).start()
+
+
+# === SECTION SEPARATOR ===
+# Record processing
+# === SECTION SEPARATOR ===
+
+def _claim_record(record_id):
+    """
+    Move a queued record to processing. Returns (batch_id, row, campaign, skip_flg, row_number)
+    or None when the record is not ours to run (already taken, or its batch is paused).
+    """
+    from app import db_session, BatchJob, BatchRecord
+
+    session_db = db_session()
+    try:
+        record = session_db.query(BatchRecord).filter_by(id=record_id).with_for_update().first()
+        if not record or record.status != 'queued':
+            session_db.commit()
+            return None
+
+        job = session_db.query(BatchJob).filter_by(id=record.batch_id).first()
+        if not job or job.status != 'running':
+            # Paused while queued - give the slot back
+            record.status = 'pending'
+            session_db.commit()
+            return None
+
+        record.status = 'processing'
+        record.attempts = (record.attempts or 0) + 1
+        record.started_at = datetime.utcnow()
+        session_db.commit()
+        return record.batch_id, json.loads(record.row_data or "{}"), job.campaign, job.skip_flg, record.row_number
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+
+def _finish_record(record_id, status, claim_id=None, result=None, error=None):
+    """Store the outcome of a record"""
+    from app import db_session, BatchRecord
+
+    session_db = db_session()
+    try:
+        session_db.query(BatchRecord).filter_by(id=record_id).update({
+            "status": status,
+            "claim_id": claim_id,
+            "result": json.dumps(result) if result is not None else None,
+            "error": error[:2000] if error else None,
+            "finished_at": datetime.utcnow()
+        }, synchronize_session=False)
+        session_db.commit()
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+
+def _run_record(batch_id, row, campaign, skip_flg, row_number, context=None, http_session=None):
+    """
+    Query -> claim -> lead processing for one row.
+    Returns (status, claim_id, result, error).
+    """
+    from app import run_credit_query, save_claim_from_summary, process_flg_leads_background, QUERY_REQUIRED_FIELDS
+
+    status = 'done'
+    claim_id = None
+    result = None
+    error = None
+    try:
+        query_payload = build_query_payload(row)
+        missing = [field for field in QUERY_REQUIRED_FIELDS if not query_payload.get(field)]
+        if missing:
+            status = 'skipped'
+            error = f"Missing required fields: {', '.join(missing)}"
+        else:
+            valifi_response = run_credit_query(query_payload, http_session=http_session)
+            accounts = extract_accounts(valifi_response)
+            summary = build_summary(
+                row, query_payload, valifi_response, accounts, campaign,
+                session_id=f"batch_{batch_id}_{row_number}",
+                skip_flg=skip_flg
+            )
+
+            claim_id, accounts, found_lenders, additional_lenders = save_claim_from_summary(
+                summary, client_ip=summary["clientIp"], user_agent="batch_import",
+                keep_open=bool(context and context.shared)
+            )
+            flg_result = process_flg_leads_background(
+                claim_id, summary, accounts, found_lenders, additional_lenders, context=context
+            ) or {}
+            if flg_result.get("error"):
+                raise RuntimeError(f"Lead processing failed for claim {claim_id}: {flg_result['error']}")
+
+            result = {
+                "claim_id": claim_id,
+                "lead_ids": [
+                    {key: value for key, value in lead.items() if key not in RESULT_LEAD_EXCLUDED_FIELDS}
+                    for lead in flg_result.get("all_lead_ids", [])
+                ],
+                "successful_leads": flg_result.get("successful_leads", 0),
+                "failed_leads": flg_result.get("failed_leads", 0),
+                "valifi_json_reference": flg_result.get("valifi_json", ""),
+                "pdf_url": summary["pdfUrl"],
+                "lenders_found_count": len(accounts),
+                "lenders_found_list": ", ".join(
+                    account.get("displayName") or account.get("lenderName") or "Unknown" for account in accounts
+                )
+            }
+            logger.info(f"[BATCH-{batch_id}] Row {row_number}: claim {claim_id}, {len(result['lead_ids'])} leads")
+    except Exception as e:
+        status = 'failed'
+        error = str(e)
+        logger.error(f"[BATCH-{batch_id}] Row {row_number} failed: {e}")
+
+    return status, claim_id, result, error
+
+
+@audited("process_batch_record")
+def process_batch_record(record_id):
+    """Run one batch record through query -> claim -> lead processing, then top the batch up"""
+    claimed = _claim_record(record_id)
+    if not claimed:
+        logger.info(f"[BATCH] Record {record_id} not runnable (already taken or batch paused)")
+        return None
+    batch_id, row, campaign, skip_flg, row_number = claimed
+
+    status, claim_id, result, error = _run_record(batch_id, row, campaign, skip_flg, row_number)
+    _finish_record(record_id, status, claim_id=claim_id, result=result, error=error)
+
+    try:
+        dispatch_batch(batch_id)
+    except Exception as e:
+        logger.error(f"[BATCH-{batch_id}] Dispatch after row {row_number} failed: {e}")
+
+    return status
+
+
+# === SECTION SEPARATOR ===
+# Chunk processing - many records per worker message
+# === SECTION SEPARATOR ===
+
+def _claim_chunk(session_db, record_ids):
+    """
+    Move the queued records of a chunk to processing in one UPDATE.
+    Returns (job, records ordered by row number); records of a paused batch go back to pending.
+    """
+    from app import BatchJob, BatchRecord
+
+    records = session_db.query(BatchRecord).filter(
+        BatchRecord.id.in_(record_ids),
+        BatchRecord.status == 'queued'
+    ).order_by(BatchRecord.row_number).with_for_update().all()
+    if not records:
+        session_db.commit()
+        return None, []
+
+    job = session_db.query(BatchJob).filter_by(id=records[0].batch_id).first()
+    ids = [record.id for record in records]
+    if not job or job.status != 'running':
+        session_db.query(BatchRecord).filter(BatchRecord.id.in_(ids)).update(
+            {"status": 'pending'}, synchronize_session=False
+        )
+        session_db.commit()
+        return job, []
+
+    session_db.query(BatchRecord).filter(BatchRecord.id.in_(ids)).update({
+        "status": 'processing',
+        "attempts": BatchRecord.attempts + 1,
+        "started_at": datetime.utcnow()
+    }, synchronize_session=False)
+    session_db.commit()
+    return job, records
+
+
+def _lease_record(session_db, record_id, attempts):
+    """
+    Re-stamp started_at on a chunk record we still own (processing, same attempt) before
+    running it. False means the reaper handed it to another worker - skip it.
+    """
+    from app import BatchRecord
+
+    leased = session_db.query(BatchRecord).filter(
+        BatchRecord.id == record_id,
+        BatchRecord.status == 'processing',
+        BatchRecord.attempts == attempts
+    ).update({"started_at": datetime.utcnow()}, synchronize_session=False)
+    session_db.commit()
+    return leased == 1
+
+
+def _release_records(session_db, record_ids):
+    """Give chunk records we haven't started back to pending"""
+    from app import BatchRecord
+
+    session_db.query(BatchRecord).filter(
+        BatchRecord.id.in_(record_ids),
+        BatchRecord.status == 'processing'
+    ).update({"status": 'pending'}, synchronize_session=False)
+    session_db.commit()
+
+
+def _flush_chunk_outcomes(session_db, context, outcomes):
+    """
+    Bulk write record outcomes and the queued lead_ids_tracking rows. Each outcome only
+    lands on a record still processing under the attempt this chunk claimed.
+    """
+    from sqlalchemy import and_, bindparam
+    from app import BatchRecord
+
+    if outcomes:
+        table = BatchRecord.__table__
+        session_db.execute(
+            table.update().where(and_(
+                table.c.id == bindparam("b_id"),
+                table.c.status == 'processing',
+                table.c.attempts == bindparam("b_attempts")
+            )).values(
+                status=bindparam("b_status"),
+                claim_id=bindparam("b_claim_id"),
+                result=bindparam("b_result"),
+                error=bindparam("b_error"),
+                finished_at=bindparam("b_finished_at")
+            ),
+            # Bind names can't reuse the column names being SET
+            [{f"b_{key}": value for key, value in outcome.items()} for outcome in outcomes]
+        )
+        session_db.commit()
+    context.flush()
+
+
+@audited("process_batch_chunk")
+def process_batch_chunk(items):
+    """
+    Run a chunk of batch records with one shared LeadProcessingContext.
+    items is a list of [record_id, not_before_epoch]. Records are processed in row order,
+    each no earlier than its rate-limit slot and only while this chunk still holds it;
+    outcomes are bulk-written every CHUNK_FLUSH_EVERY records, when the batch is also
+    re-checked for a pause. Records that can't finish within CHUNK_TIME_BUDGET_SECONDS
+    go back to pending. Returns a dict of status counts.
+    """
+    from app import BatchJob, LeadProcessingContext
+
+    deadline = time.time() + CHUNK_TIME_BUDGET_SECONDS
+    not_before = {int(record_id): float(start) for record_id, start in items}
+    context = LeadProcessingContext(shared=True)
+    session_db = context.session_db
+    counts = {}
+    outcomes = []
+    batch_id = None
+    try:
+        job, records = _claim_chunk(session_db, list(not_before))
+        if not records:
+            logger.info(f"[BATCH] Chunk of {len(items)} not runnable (already taken or batch paused)")
+            return counts
+        batch_id = job.id
+        campaign, skip_flg = job.campaign, job.skip_flg
+        # Plain tuples - the ORM rows expire on every commit in the shared session
+        work = [(record.id, record.row_number, record.row_data, record.attempts) for record in records]
+        logger.info(f"[BATCH-{batch_id}] Processing chunk of {len(work)} records")
+
+        for index, (record_id, row_number, row_data, attempts) in enumerate(work):
+            if index and index % CHUNK_FLUSH_EVERY == 0:
+                _flush_chunk_outcomes(session_db, context, outcomes)
+                outcomes = []
+                job_status = session_db.query(BatchJob.status).filter_by(id=batch_id).scalar()
+                if job_status != 'running':
+                    remaining = [item[0] for item in work[index:]]
+                    _release_records(session_db, remaining)
+                    logger.info(f"[BATCH-{batch_id}] Batch {job_status} - returned {len(remaining)} chunk records to pending")
+                    break
+
+            start = max(not_before.get(record_id, 0), time.time())
+            if start + RECORD_MAX_SECONDS > deadline:
+                remaining = [item[0] for item in work[index:]]
+                _release_records(session_db, remaining)
+                logger.warning(f"[BATCH-{batch_id}] Chunk time budget reached - returned {len(remaining)} records to pending")
+                break
+
+            delay = start - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            if not _lease_record(session_db, record_id, attempts):
+                logger.warning(f"[BATCH-{batch_id}] Row {row_number} was reaped and handed to another worker - skipping")
+                continue
+
+            status, claim_id, result, error = _run_record(
+                batch_id, json.loads(row_data or "{}"), campaign, skip_flg, row_number,
+                context=context, http_session=context.http
+            )
+            outcomes.append({
+                "id": record_id,
+                "attempts": attempts,
+                "status": status,
+                "claim_id": claim_id,
+                "result": json.dumps(result) if result is not None else None,
+                "error": error[:2000] if error else None,
+                "finished_at": datetime.utcnow()
+            })
+            counts[status] = counts.get(status, 0) + 1
+
+        _flush_chunk_outcomes(session_db, context, outcomes)
+    except Exception:
+        session_db.rollback()
+        # Keep what already finished (e.g. on the soft time limit) so it isn't run again
+        try:
+            _flush_chunk_outcomes(session_db, context, outcomes)
+        except Exception as e:
+            session_db.rollback()
+            logger.error(f"[BATCH-{batch_id}] Could not store {len(outcomes)} finished chunk outcomes: {e}")
+        raise
+    finally:
+        context.close()
+
+    logger.info(f"[BATCH-{batch_id}] Chunk finished: {counts}")
+    try:
+        dispatch_batch(batch_id)
+    except Exception as e:
+        logger.error(f"[BATCH-{batch_id}] Dispatch after chunk failed: {e}")
+
+    return counts
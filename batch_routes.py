@@ -0,0 +1,196 @@
+"""
+Batch import routes
+Upload a CSV/XLSX, get a batch id back, then poll progress while the server works through it.
+"""
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
+from functools import wraps
+import json
+import logging
+
+from batch_processing import (
+    parse_upload, create_batch, dispatch_batch, set_batch_status, retry_failed_records,
+    get_batch_progress, get_batch_records, MAX_RECORDS_PER_BATCH
+)
+from bulk_ingest import iter_summaries, ingest_summaries
+from batch_export import EXPORT_FORMATS, stream_export, export_filename
+
+logger = logging.getLogger(__name__)
+
+# Create Blueprint
+batch_bp = Blueprint('batch', __name__)
+
+ALLOWED_UPLOAD_EXTENSIONS = ('.csv', '.xlsx')
+MAX_RECORDS_PAGE = 1000
+
+
+def require_admin_key(view):
+    """401 unless the request carries BATCH_ADMIN_KEY (X-Admin-Key or Bearer); always 401 when it's unset"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from app import Config, admin_key_authorised
+
+        if not admin_key_authorised(Config.BATCH_ADMIN_KEY):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@batch_bp.route("/", methods=["GET"])
+def batch_page():
+    """Batch import UI"""
+    return render_template("batch.html")
+
+
+@batch_bp.route("/jobs", methods=["POST"])
+@require_admin_key
+def create_batch_job():
+    """Upload a CSV/XLSX file and start processing it server-side"""
+    try:
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            return jsonify({"error": "file is required"}), 400
+        if not upload.filename.lower().endswith(ALLOWED_UPLOAD_EXTENSIONS):
+            return jsonify({"error": "Only .csv and .xlsx files are supported"}), 400
+
+        rows = parse_upload(upload.filename, upload.read())
+        if not rows:
+            return jsonify({"error": "No valid records found (first_name and last_name are required)"}), 400
+
+        max_records = request.form.get("max_records", type=int) or 0
+        if max_records > 0:
+            rows = rows[:max_records]
+
+        batch_id = create_batch(
+            rows,
+            filename=upload.filename,
+            campaign=(request.form.get("campaign") or "").strip() or None,
+            concurrency=request.form.get("concurrency", type=int),
+            rate_per_minute=request.form.get("rate_per_minute", type=int),
+            chunk_size=request.form.get("chunk_size", type=int),
+            skip_flg=request.form.get("skip_flg", "true").lower() != "false"
+        )
+        dispatch_batch(batch_id)
+
+        return jsonify({
+            "batch_id": batch_id,
+            "total_records": min(len(rows), MAX_RECORDS_PER_BATCH),
+            "truncated": len(rows) > MAX_RECORDS_PER_BATCH
+        }), 201
+
+    except Exception as e:
+        logger.error(f"Error creating batch: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@batch_bp.route("/jobs/<int:batch_id>", methods=["GET"])
+@require_admin_key
+def batch_job_progress(batch_id):
+    """Progress counts for a batch"""
+    progress = get_batch_progress(batch_id)
+    if not progress:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(progress), 200
+
+
+@batch_bp.route("/jobs/<int:batch_id>/records", methods=["GET"])
+@require_admin_key
+def batch_job_records(batch_id):
+    """Per-record state and results, paged with ?after=<row_number>&limit=N"""
+    after_row = request.args.get("after", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 500, type=int), MAX_RECORDS_PAGE))
+    status = request.args.get("status") or None
+
+    records = get_batch_records(batch_id, after_row=after_row, limit=limit, status=status)
+    return jsonify({
+        "batch_id": batch_id,
+        "records": records,
+        "next_after": records[-1]["row_number"] if len(records) == limit else None
+    }), 200
+
+
+@batch_bp.route("/jobs/<int:batch_id>/pause", methods=["POST"])
+@require_admin_key
+def pause_batch_job(batch_id):
+    """Stop dispatching new records (in-flight ones finish)"""
+    if not set_batch_status(batch_id, 'paused'):
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(get_batch_progress(batch_id)), 200
+
+
+@batch_bp.route("/jobs/<int:batch_id>/resume", methods=["POST"])
+@require_admin_key
+def resume_batch_job(batch_id):
+    """Continue a paused batch"""
+    if not set_batch_status(batch_id, 'running'):
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(get_batch_progress(batch_id)), 200
+
+
+@batch_bp.route("/jobs/<int:batch_id>/retry", methods=["POST"])
+@require_admin_key
+def retry_batch_job(batch_id):
+    """Re-queue the failed records of a batch"""
+    reset = retry_failed_records(batch_id)
+    if reset is None:
+        return jsonify({"error": "Batch not found"}), 404
+    progress = get_batch_progress(batch_id)
+    progress["retried"] = reset
+    return jsonify(progress), 200
+
+
+@batch_bp.route("/claims", methods=["POST"])
+@require_admin_key
+def bulk_ingest_claims():
+    """
+    Bulk claim ingestion - body is NDJSON (one summary per line) or a JSON array of summaries.
+    Streams back NDJSON: {"index", "claim_id"} or {"index", "error"} per record, then {"summary"}.
+    ?process_leads=false only creates the claims.
+    """
+    from app import get_client_ip
+
+    client_ip = get_client_ip()
+    user_agent = (request.headers.get("User-Agent") or "bulk_ingest")[:255]
+    process_leads = request.args.get("process_leads", "true").lower() != "false"
+    stream = request.stream
+
+    def generate():
+        try:
+            for result in ingest_summaries(iter_summaries(stream), client_ip, user_agent, process_leads):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logger.error(f"Bulk ingest failed: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@batch_bp.route("/export", methods=["GET"])
+@require_admin_key
+def export_batch_results():
+    """
+    Stream claim + lead results as ?format=ndjson|csv|xlsx, one row per lead id.
+    Filter with ?batch_id=N and/or ?campaign=...; ?leads_only=true drops claims without leads.
+    """
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    batch_id = request.args.get("batch_id", type=int)
+    campaign = (request.args.get("campaign") or "").strip() or None
+    if batch_id is None and not campaign:
+        return jsonify({"error": "batch_id or campaign is required"}), 400
+    leads_only = request.args.get("leads_only", "false").lower() == "true"
+
+    def generate():
+        try:
+            yield from stream_export(fmt, batch_id=batch_id, campaign=campaign, leads_only=leads_only)
+        except Exception as e:
+            # Headers are already sent - all we can do is log and cut the stream short
+            logger.error(f"Export failed (batch={batch_id}, campaign={campaign}): {e}")
+
+    filename = export_filename(fmt, batch_id=batch_id, campaign=campaign)
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,3 @@
+"""
+Load-test and benchmark suite - see benchmarks/run.py
+"""
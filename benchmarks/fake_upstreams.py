@@ -0,0 +1,234 @@
+"""
+Local stand-ins for Valifi, FLG, S3 and the lead-id webhook
+One gevent WSGI server, path-prefixed per upstream:
+    /valifi/...   basic-auth, postcode lookup, OTP, tu/validate, equifax/cz credit report
+    /flg/...      lead create (XML in, <id> out) and status updates
+    /s3/...       any PUT/GET (point boto3 at it with AWS_ENDPOINT_URL_S3=<url>/s3)
+    /webhook/...  lead-id webhook
+    GET /_stats   request / error counts per upstream
+
+Latency and failures are injected per upstream (valifi_report is the credit report endpoint,
+valifi every other Valifi call):
+
+    python -m benchmarks.fake_upstreams --port 9400 \
+        --latency valifi_report=2.5/1.0 --latency flg=0.3/0.1 --errors valifi_report=0.02
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import base64
+import csv
+import itertools
+import json
+import os
+import random
+import threading
+from datetime import date, timedelta
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+UPSTREAMS = ("valifi", "valifi_report", "flg", "s3", "webhook")
+
+# Roughly what production sees (seconds, uniform jitter either side)
+DEFAULT_LATENCY = {
+    "valifi": (0.25, 0.1),
+    "valifi_report": (2.0, 1.0),
+    "flg": (0.4, 0.2),
+    "s3": (0.05, 0.02),
+    "webhook": (0.15, 0.05),
+}
+
+LENDERS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lenders.csv")
+
+
+def load_lender_names():
+    try:
+        with open(LENDERS_CSV, encoding="utf-8-sig") as handle:
+            return [row[0].strip() for row in csv.reader(handle) if row and row[0].strip()]
+    except OSError:
+        return ["Black Horse", "Close Brothers Motor Finance", "MotoNovo Finance", "Santander Consumer Finance"]
+
+
+class FakeSettings:
+    def __init__(self, latency=None, errors=None, timeouts=None, accounts=4, report_kb=512, pdf_kb=200):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.errors = errors or {}
+        self.timeouts = timeouts or {}
+        self.accounts = accounts
+        self.report_kb = report_kb
+        self.pdf_kb = pdf_kb
+
+
+class FakeUpstreams:
+    """WSGI app behind every fake upstream"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lenders = load_lender_names()
+        self.lead_ids = itertools.count(10_000_000)
+        self.stats = {name: {"requests": 0, "errors": 0, "timeouts": 0} for name in UPSTREAMS}
+        self._lock = threading.Lock()
+        # Built once - a realistic credit report is mostly the base64 PDF and JSON report
+        self._pdf_b64 = base64.b64encode(b"%PDF-1.4\n" + os.urandom(settings.pdf_kb * 1024)).decode()
+        self._padding = "x" * (settings.report_kb * 1024)
+
+    # --- behaviour injection ---
+
+    def _count(self, upstream, key):
+        with self._lock:
+            self.stats[upstream][key] += 1
+
+    def _delay_and_fail(self, upstream):
+        """Sleep the configured latency; returns an error status to send instead, or None"""
+        self._count(upstream, "requests")
+        if random.random() < self.settings.timeouts.get(upstream, 0.0):
+            self._count(upstream, "timeouts")
+            gevent.sleep(120)  # longer than any client timeout in app.py
+        base, jitter = self.settings.latency.get(upstream, (0.0, 0.0))
+        gevent.sleep(max(0.0, base + random.uniform(-jitter, jitter)))
+        if random.random() < self.settings.errors.get(upstream, 0.0):
+            self._count(upstream, "errors")
+            return random.choice(("500 Internal Server Error", "502 Bad Gateway", "503 Service Unavailable"))
+        return None
+
+    # --- responses ---
+
+    def _accounts(self):
+        accounts = []
+        for index in range(self.settings.accounts):
+            started = date(2009, 1, 1) + timedelta(days=random.randint(0, 4000))
+            accounts.append({
+                "lenderName": random.choice(self.lenders),
+                "accountNumber": f"{random.randint(10**9, 10**10 - 1)}",
+                "startDate": f"{started.isoformat()}T00:00:00",
+                "currentBalance": str(random.randint(0, 15000)),
+                "monthlyPayment": str(random.randint(100, 600)),
+                "accountType": "Hire Purchase",
+            })
+        return accounts
+
+    def credit_report(self):
+        return {
+            "status": True,
+            "data": {
+                "pdfReport": self._pdf_b64,
+                "jsonReport": {"data": {"padding": self._padding}},
+                "summaryReportV2": {"accounts": self._accounts()},
+            },
+        }
+
+    def valifi(self, path, body):
+        if path.endswith("/basic-auth"):
+            return {"data": {"token": "bench-token"}}
+        if path.endswith("/postcode-lookup"):
+            postcode = (body or {}).get("postCode", "AB1 2CD")
+            return {"data": {"listAddressByPostcodeResponse": {"matchedStructuredAddress": [
+                {"number": str(n), "street": "High Street", "postTown": "London", "postcode": postcode}
+                for n in range(1, 21)
+            ]}}}
+        if path.endswith("/otp/v1/request"):
+            return {"status": True}
+        if path.endswith("/otp/v1/verify"):
+            return {"status": True, "data": {"verified": True}}
+        if path.endswith("/tu/validate"):
+            return {"data": {"jsonReport": {"data": {"OtherChecks": {"IdentityScore": "85"}}}}}
+        return None
+
+    # --- WSGI ---
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        raw = environ["wsgi.input"].read(length) if length else b""
+
+        if path == "/_stats":
+            return self._json(start_response, "200 OK", self.stats)
+
+        upstream = path.strip("/").split("/", 1)[0]
+        if upstream == "valifi" and path.endswith("/equifax/cz"):
+            upstream = "valifi_report"
+        if upstream not in UPSTREAMS:
+            return self._json(start_response, "404 Not Found", {"error": "unknown upstream"})
+
+        error = self._delay_and_fail(upstream)
+        if error:
+            return self._json(start_response, error, {"error": "injected failure"})
+
+        if upstream == "valifi_report":
+            return self._json(start_response, "200 OK", self.credit_report())
+        if upstream == "valifi":
+            try:
+                body = json.loads(raw or b"{}")
+            except ValueError:
+                body = {}
+            result = self.valifi(path, body)
+            if result is None:
+                return self._json(start_response, "404 Not Found", {"error": "unknown Valifi endpoint"})
+            return self._json(start_response, "200 OK", result)
+        if upstream == "flg":
+            xml = f'<?xml version="1.0"?><response><status>0</status><item><id>{next(self.lead_ids)}</id></item></response>'
+            start_response("200 OK", [("Content-Type", "application/xml")])
+            return [xml.encode()]
+        if upstream == "s3":
+            start_response("200 OK", [("ETag", '"bench"'), ("Content-Length", "0")])
+            return [b""]
+        return self._json(start_response, "200 OK", {"ok": True})
+
+    @staticmethod
+    def _json(start_response, status, body):
+        payload = json.dumps(body).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(payload)))])
+        return [payload]
+
+
+def parse_pairs(values, parse_value=float):
+    """["flg=0.3/0.1", "s3=0.05"] -> {"flg": parse_value("0.3/0.1"), ...}"""
+    pairs = {}
+    for value in values or []:
+        for item in value.split(","):
+            name, _, setting = item.partition("=")
+            if name.strip() not in UPSTREAMS:
+                raise SystemExit(f"Unknown upstream '{name}' - choose from {', '.join(UPSTREAMS)}")
+            pairs[name.strip()] = parse_value(setting.strip())
+    return pairs
+
+
+def parse_latency(value):
+    base, _, jitter = value.partition("/")
+    return float(base), float(jitter or 0)
+
+
+def add_fake_arguments(parser):
+    parser.add_argument("--latency", action="append", help="upstream=seconds[/jitter], e.g. valifi_report=2.5/1")
+    parser.add_argument("--errors", action="append", help="upstream=probability of a 5xx, e.g. flg=0.05")
+    parser.add_argument("--timeouts", action="append", help="upstream=probability of hanging past the client timeout")
+    parser.add_argument("--accounts", type=int, default=4, help="accounts per credit report")
+    parser.add_argument("--report-kb", type=int, default=512, help="JSON report padding per credit report")
+    parser.add_argument("--pdf-kb", type=int, default=200, help="PDF size per credit report")
+
+
+def settings_from_args(args):
+    return FakeSettings(
+        latency=parse_pairs(args.latency, parse_latency),
+        errors=parse_pairs(args.errors),
+        timeouts=parse_pairs(args.timeouts),
+        accounts=args.accounts,
+        report_kb=args.report_kb,
+        pdf_kb=args.pdf_kb,
+    )
+
+
+def serve(port, settings):
+    server = WSGIServer(("127.0.0.1", port), FakeUpstreams(settings), log=None)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Valifi / FLG / S3 / webhook upstreams")
+    parser.add_argument("--port", type=int, default=9400)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    print(f"Fake upstreams on http://127.0.0.1:{args.port} (valifi, flg, s3, webhook)", flush=True)
+    serve(args.port, settings_from_args(args))
@@ -0,0 +1,199 @@
+"""
+Realistic inputs for the micro-benchmarks: a credit report sized like a production Equifax
+response, the lender table as LendersService caches it, a form summary and the FLG lead it
+turns into. Everything is seeded, so runs are comparable.
+"""
+import base64
+import csv
+import json
+import random
+from datetime import date, timedelta
+
+from batch_processing import build_query_payload, build_summary
+
+from benchmarks.fake_upstreams import LENDERS_CSV
+from benchmarks.scenarios import fake_row
+
+SEED = 20240601
+
+# Company suffix variations Valifi lender names come back with
+NAME_VARIANTS = (" Ltd", " Limited", " PLC", " Finance", " Motor Finance", " UK")
+
+
+def lender_table(seed=SEED):
+    """lenders.csv as the list of dicts LendersService._get_all_lenders_cached() returns"""
+    rng = random.Random(seed)
+    with open(LENDERS_CSV, encoding="utf-8-sig") as handle:
+        names = [row[0].strip() for row in csv.reader(handle) if row and row[0].strip()]
+    lenders = []
+    for index, name in enumerate(names, 1):
+        # About a third of the production table carries matching_names aliases
+        variants = [name + suffix for suffix in rng.sample(NAME_VARIANTS, 2)] if rng.random() < 0.35 else []
+        lenders.append({
+            "id": index,
+            "name": name,
+            "display_name": name,
+            "matching_names": ", ".join(variants),
+            "fortress_name": name,
+            "filename": f"{name.lower().replace(' ', '_')}.png",
+            "flg_name": name,
+            "eligible_or_not": "Yes",
+            "irl_or_not": "Yes",
+            "created_at": None,
+        })
+    return lenders
+
+
+def lender_search_names(lenders, seed=SEED):
+    """Names to look up, by how far down find_best_lender_match has to go"""
+    rng = random.Random(seed)
+    picks = rng.sample(lenders, 20)
+
+    def misspell(name):
+        chars = list(name.upper())
+        position = rng.randrange(len(chars))
+        chars[position] = "X" if chars[position] != "X" else "Y"
+        return "".join(chars)
+
+    return {
+        "exact": [lender["name"].upper() for lender in picks],
+        "fuzzy": [misspell(lender["name"]) for lender in picks],
+        "miss": [f"Unknown Lending Company {n}" for n in range(20)],
+    }
+
+
+def _payment_history(rng, months):
+    today = date(2025, 6, 1)
+    return [{
+        "date": (today - timedelta(days=30 * month)).isoformat(),
+        "status": rng.choice("000000000001U"),
+        "balance": rng.randint(0, 20000),
+    } for month in range(months)]
+
+
+def synthetic_credit_report(accounts=12, months=84, searches=40, pdf_kb=700, seed=SEED, lenders=None):
+    """
+    A Valifi equifax/cz response shaped and sized like production (~1 MB of JSON, most of it
+    the base64 PDF and per-account payment history). One search footprint names Valifi, so the
+    CMC scan finds something.
+    """
+    rng = random.Random(seed)
+    lender_names = [lender["name"] for lender in (lenders or lender_table(seed))]
+    summary_accounts = []
+    credit_accounts = []
+    for _ in range(accounts):
+        lender = rng.choice(lender_names)
+        started = date(2008, 1, 1) + timedelta(days=rng.randint(0, 5500))
+        number = f"{rng.randint(10**9, 10**10 - 1)}"
+        summary_accounts.append({
+            "lenderName": lender,
+            "displayName": lender,
+            "accountNumber": number,
+            "startDate": f"{started.isoformat()}T00:00:00",
+            "currentBalance": str(rng.randint(0, 15000)),
+            "monthlyPayment": str(rng.randint(100, 600)),
+            "accountType": rng.choice(["Hire Purchase", "Conditional Sale", "Personal Contract Purchase"]),
+        })
+        credit_accounts.append({
+            "CompanyName": lender,
+            "AccountNumber": number,
+            "StartDate": started.isoformat(),
+            "AccountType": "HP",
+            "PaymentHistory": _payment_history(rng, months),
+        })
+    return {
+        "status": True,
+        "data": {
+            "pdfReport": base64.b64encode(rng.randbytes(pdf_kb * 1024)).decode(),
+            "jsonReport": {"data": {
+                "OtherChecks": {"IdentityScore": "85"},
+                "CreditAccounts": credit_accounts,
+                "Searches": [{
+                    "CompanyName": "Valifi Ltd" if n == 0 else rng.choice(lender_names),
+                    "SearchDate": (date(2025, 6, 1) - timedelta(days=rng.randint(0, 700))).isoformat(),
+                    "SearchPurpose": "Credit Search",
+                } for n in range(searches)],
+                "ElectoralRoll": [{"Name": "JAMES SMITH", "From": "2010", "To": "2025"}],
+            }},
+            "summaryReportV2": {"accounts": summary_accounts},
+        },
+    }
+
+
+def representative_summary(report, seed=SEED):
+    """The /upload_summary body a form visitor with two previous addresses sends"""
+    random.seed(seed)
+    row = fake_row()
+    for prefix, number in (("prev1", "12"), ("prev2", "3A")):
+        row.update({
+            f"{prefix}_building_number": number,
+            f"{prefix}_building_name": "Rose Cottage" if prefix == "prev2" else "",
+            f"{prefix}_flat": "Flat 2" if prefix == "prev1" else "",
+            f"{prefix}_street": "Station Road",
+            f"{prefix}_post_town": "Reading",
+            f"{prefix}_post_code": "RG1 1AA",
+        })
+    query_payload = build_query_payload(row)
+    accounts = report["data"]["summaryReportV2"]["accounts"]
+    summary = build_summary(row, query_payload, report, accounts, campaign="benchmark",
+                            session_id="bench-session-0001", skip_flg=False)
+    summary["signatureBase64"] = "data:image/png;base64," + base64.b64encode(random.randbytes(24 * 1024)).decode()
+    return summary
+
+
+def claim_lead_fields(summary, report):
+    """The per-claim fields process_flg_leads_background shares across a claim's leads"""
+    return {
+        "medium": "benchmark",
+        "title": summary.get("title") or "Mr",
+        "firstname": summary["firstName"],
+        "lastname": summary["lastName"],
+        "dateOfBirth": summary["dateOfBirth"],
+        "phone1": summary["phone1"],
+        "email": summary["email"],
+        "address": summary["street"],
+        "towncity": summary["towncity"],
+        "postcode": summary["postcode"],
+        "introducer": "61445",
+        "applicant_id": "123456",
+        "data25": summary["signatureBase64"],
+        "data28": "2025-06-01 12:00:00",
+        "data29": "127.0.0.1",
+        "data31": "https://bench.s3.eu-north-1.amazonaws.com/credit-reports/claim_123456.pdf",
+        "data32": json.dumps({
+            "type": "credit_report_reference",
+            "lenders_found": [account["lenderName"] for account in report["data"]["summaryReportV2"]["accounts"]]
+        }),
+    }
+
+
+def dca_lead(summary, report, account):
+    """The DCA lead dict process_flg_leads_background hands to FLGClient.build_lead_xml"""
+    return {
+        **claim_lead_fields(summary, report),
+        "leadgroup": "57862",
+        "source": "Belmondclaims.com",
+        "reference": "DCA1",
+        "cost": "150.00",
+        "data2": account["lenderName"],
+        "data5": account["currentBalance"],
+        "data9": account["accountNumber"],
+        "data12": account["startDate"][:10],
+        "data14": "12 Flat 2 Station Road, Reading, RG1 1AA",
+        "data34": json.dumps(account),
+        "data47": "",
+    }
+
+
+def account_dates(report):
+    """Start dates as they reach check_date_eligibility, plus the dd/mm/yyyy form input"""
+    dates = [account["startDate"] for account in report["data"]["summaryReportV2"]["accounts"]]
+    return dates + [f"{d[8:10]}/{d[5:7]}/{d[:4]}" for d in dates]
+
+
+def report_size(report):
+    return len(json.dumps(report))
+
+
+if __name__ == "__main__":
+    print(f"credit report: {report_size(synthetic_credit_report()) / 1024:.0f} KB, lenders: {len(lender_table())}")
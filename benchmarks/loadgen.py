@@ -0,0 +1,201 @@
+"""
+Load generator core: virtual users on gevent, per-step latency recording, percentiles and
+baseline comparison. Scenarios (benchmarks/scenarios.py) drive a VirtualUser; the runners here
+decide how many run at once - a fixed pool of looping users (closed model) or new visitors
+arriving at a fixed rate (open model, for spikes).
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import random
+import time
+from collections import defaultdict
+
+import gevent
+import requests
+from gevent.pool import Pool
+
+
+class StepFailed(Exception):
+    """A scenario step got an unexpected status - the rest of that iteration is skipped"""
+
+
+class Stats:
+    """Latencies (seconds) and outcomes per step name"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.iterations = 0
+        self.failed_iterations = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, step, seconds, status, ok):
+        self.latencies[step].append(seconds)
+        self.statuses[step][status] += 1
+        if not ok:
+            self.errors[step] += 1
+
+    def summary(self):
+        elapsed = max((self.finished or time.monotonic()) - (self.started or time.monotonic()), 1e-9)
+        steps = {}
+        for step, values in self.latencies.items():
+            ordered = sorted(values)
+            steps[step] = {
+                "count": len(ordered),
+                "errors": self.errors[step],
+                "error_rate": round(self.errors[step] / len(ordered), 4),
+                "rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+                "statuses": dict(self.statuses[step]),
+            }
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "iterations": self.iterations,
+            "failed_iterations": self.failed_iterations,
+            "iterations_per_s": round(self.iterations / elapsed, 2),
+            "steps": steps,
+        }
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class VirtualUser:
+    """One simulated visitor: its own cookie jar, client IP and session id"""
+
+    def __init__(self, base_url, stats, timeout=90):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.http = requests.Session()
+        # Spread rate-limit keys like real traffic from many addresses
+        self.ip = f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+        self.http.headers.update({
+            "X-Forwarded-For": self.ip,
+            "Origin": "http://localhost",
+            "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) benchmark",
+        })
+        self.session_id = f"bench-{random.getrandbits(64):016x}"
+
+    def request(self, step, method, path, expect=(200,), **kwargs):
+        """Timed request recorded under step; raises StepFailed on an unexpected status"""
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            status = response.status_code
+            return response
+        except requests.RequestException as e:
+            raise StepFailed(f"{step}: {e}") from e
+        finally:
+            ok = status in expect
+            self.stats.record(step, time.perf_counter() - started, status, ok)
+            if not ok and status != "error":
+                raise StepFailed(f"{step}: HTTP {status}")
+
+    def close(self):
+        self.http.close()
+
+
+def _iteration(scenario, base_url, stats, options):
+    user = VirtualUser(base_url, stats)
+    try:
+        scenario(user, options)
+    except StepFailed:
+        stats.failed_iterations += 1
+    finally:
+        stats.iterations += 1
+        user.close()
+
+
+def run_closed(scenario, base_url, users, duration, ramp_seconds=0.0, options=None):
+    """users looping over the scenario for duration seconds (started evenly over ramp_seconds)"""
+    stats = Stats()
+    stats.started = time.monotonic()
+    deadline = stats.started + duration
+
+    def loop(delay):
+        gevent.sleep(delay)
+        while time.monotonic() < deadline:
+            _iteration(scenario, base_url, stats, options or {})
+
+    workers = [gevent.spawn(loop, ramp_seconds * index / max(users, 1)) for index in range(users)]
+    gevent.joinall(workers)
+    stats.finished = time.monotonic()
+    return stats
+
+
+def run_open(scenario, base_url, rate, duration, max_concurrency=2000, options=None):
+    """A new visitor every 1/rate seconds (Poisson arrivals) for duration seconds"""
+    stats = Stats()
+    pool = Pool(max_concurrency)
+    stats.started = time.monotonic()
+    deadline = stats.started + duration
+    while time.monotonic() < deadline:
+        pool.spawn(_iteration, scenario, base_url, stats, options or {})
+        gevent.sleep(random.expovariate(rate))
+    pool.join()
+    stats.finished = time.monotonic()
+    return stats
+
+
+def run_once(scenario, base_url, options=None):
+    """One iteration (batch import: the scenario itself is the load)"""
+    stats = Stats()
+    stats.started = time.monotonic()
+    _iteration(scenario, base_url, stats, options or {})
+    stats.finished = time.monotonic()
+    return stats
+
+
+# === SECTION SEPARATOR ===
+# Baseline comparison
+# === SECTION SEPARATOR ===
+
+def compare(current, baseline, tolerance=0.15, error_tolerance=0.01):
+    """
+    Regressions of current vs baseline results ({scenario: summary}): a step whose p95 grew,
+    or whose throughput fell, by more than tolerance, or whose error rate rose by more than
+    error_tolerance. Returns a list of human-readable lines (empty = no regressions).
+    """
+    problems = []
+    for scenario, summary in current.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for step, now in summary["steps"].items():
+            before = base["steps"].get(step)
+            if not before:
+                continue
+            if before["p95_ms"] > 0 and now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                problems.append(f"{scenario}/{step}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+            if before["rps"] > 0 and now["rps"] < before["rps"] * (1 - tolerance):
+                problems.append(f"{scenario}/{step}: throughput {before['rps']}/s -> {now['rps']}/s")
+            if now["error_rate"] > before["error_rate"] + error_tolerance:
+                problems.append(f"{scenario}/{step}: error rate {before['error_rate']:.2%} -> {now['error_rate']:.2%}")
+    return problems
+
+
+def format_summary(name, summary):
+    lines = [
+        f"== {name}: {summary['iterations']} iterations in {summary['elapsed_s']}s "
+        f"({summary['iterations_per_s']}/s, {summary['failed_iterations']} failed)",
+        f"   {'step':<28}{'count':>8}{'err%':>8}{'rps':>9}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'maxms':>10}",
+    ]
+    for step, s in summary["steps"].items():
+        lines.append(
+            f"   {step:<28}{s['count']:>8}{s['error_rate'] * 100:>7.1f}%{s['rps']:>9}"
+            f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,213 @@
+"""
+Load-test runner
+Starts the fake upstreams, runs the Procfile release step and then the web process exactly as
+the Procfile runs them (gunicorn, gevent workers, --preload), points the app at the fakes, runs
+the scenarios and reports throughput and p50/p95/p99 per step. Results go to benchmarks/results/<timestamp>.json; pass one back with
+--baseline to fail (exit 1) when a step regressed by more than --tolerance.
+
+    BENCH_DATABASE_URL=postgresql://localhost/valifi_bench python -m benchmarks.run
+    python -m benchmarks.run --scenario tv_spike --rate 300 --duration 60
+    python -m benchmarks.run --scenario form_funnel --users 50 --latency valifi_report=4/2 --errors flg=0.05
+    python -m benchmarks.run --scenario batch_import --records 1000 --with-workers
+    python -m benchmarks.run --baseline benchmarks/results/20260101-120000.json
+
+BENCH_DATABASE_URL must be a scratch database - every scenario writes real rows. Use
+--target http://host:port to benchmark an app that is already running (no processes started).
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+from benchmarks.fake_upstreams import add_fake_arguments
+from benchmarks.loadgen import compare, format_summary, run_closed, run_once, run_open
+from benchmarks.scenarios import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+WEBHOOK_KEY = "bench-key"
+ADMIN_KEY = "bench-admin"
+
+
+def procfile_command(process):
+    """The command line of a Procfile process type"""
+    with open(os.path.join(ROOT, "Procfile")) as handle:
+        for line in handle:
+            name, _, command = line.partition(":")
+            if name.strip() == process:
+                return command.strip()
+    raise SystemExit(f"No '{process}' process in the Procfile")
+
+
+def app_environment(args, fake_url):
+    """Environment for the app under test: every upstream pointed at the fakes"""
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url:
+        raise SystemExit("Set BENCH_DATABASE_URL to a scratch Postgres database")
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(args.port),
+        "DATABASE_URL": database_url,
+        "VALIFI_API_URL": f"{fake_url}/valifi",
+        "VALIFI_API_USER": "bench",
+        "VALIFI_API_PASS": "bench",
+        "FLG_API_URL": f"{fake_url}/flg/api/APIv2.php",
+        "FLG_UPDATE_URL": f"{fake_url}/flg/api/update",
+        "FLG_API_KEY": "bench",
+        "FLG_LEADGROUP_ID": "57862",
+        "FLG_IRL_LEADGROUP_ID": "59549",
+        "webhook_update_form": f"{fake_url}/webhook",
+        "WEBHOOK_SECRET": "bench",
+        "WEBHOOK_API_KEY": WEBHOOK_KEY,
+        "BATCH_ADMIN_KEY": ADMIN_KEY,
+        "FLG_STATUS_UPDATE_ENABLED": "true",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_S3_BUCKET": "bench",
+        "AWS_ENDPOINT_URL_S3": f"{fake_url}/s3",
+        # Every virtual user has its own X-Forwarded-For, but a spike still shouldn't hit the limiter
+        "RATELIMIT_DEFAULT": "1000000 per hour",
+        "RATELIMIT_TRACKING": "1000000 per hour",
+        "USE_CELERY": "true" if args.with_workers else os.getenv("USE_CELERY", "false"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    return env
+
+
+def start(command, env, label):
+    print(f"Starting {label}: {command}", flush=True)
+    return subprocess.Popen(["bash", "-c", command], cwd=ROOT, env=env, start_new_session=True)
+
+
+def stop(process):
+    if process and process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def wait_until_up(url, processes, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for process in processes:
+            if process.poll() is not None:
+                raise SystemExit(f"Process exited with {process.returncode} before {url} came up")
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{url} did not come up within {timeout}s")
+
+
+def run_scenario(name, base_url, args):
+    scenario = SCENARIOS[name]
+    options = {
+        "records": args.records,
+        "concurrency": args.batch_concurrency,
+        "skip_flg": args.skip_flg,
+        "webhook_key": WEBHOOK_KEY,
+        "admin_key": ADMIN_KEY,
+    }
+    if name == "tv_spike":
+        return run_open(scenario, base_url, args.rate, args.duration, options=options)
+    if name == "batch_import":
+        return run_once(scenario, base_url, options=options)
+    if name == "webhook_storm":
+        return run_open(scenario, base_url, args.webhook_rate, args.duration, options=options)
+    return run_closed(scenario, base_url, args.users, args.duration, ramp_seconds=args.ramp, options=options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app against local upstream stand-ins")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per scenario")
+    parser.add_argument("--rate", type=float, default=200, help="tv_spike arrivals per second")
+    parser.add_argument("--webhook-rate", type=float, default=50, help="webhook_storm posts per second")
+    parser.add_argument("--users", type=int, default=25, help="form_funnel concurrent users")
+    parser.add_argument("--ramp", type=float, default=10, help="form_funnel ramp-up seconds")
+    parser.add_argument("--records", type=int, default=200, help="batch_import rows")
+    parser.add_argument("--batch-concurrency", type=int, default=0, help="batch_import job concurrency (0 = app default)")
+    parser.add_argument("--skip-flg", action="store_true", help="don't create FLG leads in form_funnel/batch_import")
+    parser.add_argument("--port", type=int, default=8050, help="port for the app under test")
+    parser.add_argument("--fake-port", type=int, default=9400, help="port for the fake upstreams")
+    parser.add_argument("--target", help="benchmark an already running app at this URL instead")
+    parser.add_argument("--with-workers", action="store_true",
+                        help="also start the Procfile Celery workers (needs the broker configured in the env)")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p95/throughput change vs baseline")
+    parser.add_argument("--output", help="where to write results (default benchmarks/results/<timestamp>.json)")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    processes = []
+    base_url = args.target
+    try:
+        if not base_url:
+            fake_url = f"http://127.0.0.1:{args.fake_port}"
+            fake_args = [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(args.fake_port)]
+            for option in ("latency", "errors", "timeouts"):
+                for value in getattr(args, option) or []:
+                    fake_args += [f"--{option}", value]
+            fake_args += ["--accounts", str(args.accounts), "--report-kb", str(args.report_kb), "--pdf-kb", str(args.pdf_kb)]
+            processes.append(subprocess.Popen(fake_args, cwd=ROOT, start_new_session=True))
+            wait_until_up(f"{fake_url}/_stats", processes, timeout=30)
+
+            env = app_environment(args, fake_url)
+            release = start(procfile_command("release"), env, "release")
+            if release.wait() != 0:
+                raise SystemExit(f"Release step exited with {release.returncode}")
+            processes.append(start(procfile_command("web"), env, "web"))
+            if args.with_workers:
+                for lane in ("worker-live", "worker-batch", "worker-webhook"):
+                    processes.append(start(procfile_command(lane), env, lane))
+            base_url = f"http://127.0.0.1:{args.port}"
+            wait_until_up(f"{base_url}/health", processes)
+
+        results = {}
+        for name in scenarios:
+            print(f"\nRunning {name} against {base_url} ...", flush=True)
+            results[name] = run_scenario(name, base_url, args).summary()
+            print(format_summary(name, results[name]), flush=True)
+
+        if not args.target:
+            upstream_stats = requests.get(f"http://127.0.0.1:{args.fake_port}/_stats", timeout=5).json()
+            print(f"\nUpstream calls: {json.dumps(upstream_stats)}")
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump({"run_at": datetime.now().isoformat(), "argv": sys.argv[1:], "results": results}, handle, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)["results"]
+        problems = compare(results, baseline, tolerance=args.tolerance)
+        if problems:
+            print(f"\n{len(problems)} regression(s) vs {args.baseline}:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
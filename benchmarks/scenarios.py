@@ -0,0 +1,152 @@
+"""
+Benchmark scenarios - each is a function(user, options) that walks one visitor (or one
+operator) through the app with a loadgen.VirtualUser. Step names are what the report groups by.
+"""
+import csv
+import io
+import random
+import time
+
+from batch_processing import build_query_payload, build_summary, extract_accounts
+
+from benchmarks.loadgen import StepFailed
+
+FIRST_NAMES = ["James", "Olivia", "Mohammed", "Amelia", "Jack", "Isla", "Harry", "Ava", "George", "Mia"]
+LAST_NAMES = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Patel", "Evans"]
+POSTCODES = ["SW1A 1AA", "M1 1AE", "B1 1BB", "LS1 4DY", "G1 1XQ", "CF10 1EP", "BS1 4DJ", "NE1 7RU"]
+TOWNS = ["London", "Manchester", "Birmingham", "Leeds", "Glasgow", "Cardiff", "Bristol", "Newcastle"]
+
+# FLG lead groups the webhook handles (DCA, IRL) and statuses FLG posts back
+WEBHOOK_LEAD_GROUPS = ["57862", "59549"]
+WEBHOOK_STATUSES = ["Lead Received", "Validated", "Rejected", "Awaiting Docs", "Submitted"]
+
+
+def fake_row(index=0):
+    """One applicant in the batch CSV column layout"""
+    place = random.randrange(len(POSTCODES))
+    return {
+        "first_name": random.choice(FIRST_NAMES),
+        "last_name": f"{random.choice(LAST_NAMES)}{index or ''}",
+        "dob_year": str(random.randint(1955, 2000)),
+        "dob_month": str(random.randint(1, 12)),
+        "dob_day": str(random.randint(1, 28)),
+        "building_number": str(random.randint(1, 200)),
+        "street": "High Street",
+        "post_town": TOWNS[place],
+        "post_code": POSTCODES[place],
+        "mobile": f"447{random.randint(100000000, 999999999)}",
+        "email": f"bench{random.getrandbits(32):x}@example.com",
+    }
+
+
+def _track_visitor(user, source="tv"):
+    user.request("track-visitor", "POST", "/tracking/track-visitor", json={
+        "session_id": user.session_id,
+        "source": source,
+        "medium": "broadcast" if source == "tv" else "cpc",
+        "landing_page": "/",
+        "screen_resolution": "390x844",
+    })
+
+
+def _track_form_event(user, event_type, stage=""):
+    user.request("track-form-event", "POST", "/tracking/track-form-event", json={
+        "session_id": user.session_id,
+        "event_type": event_type,
+        "form_stage": stage,
+    })
+
+
+def tv_spike(user, options):
+    """A TV-ad visitor: landing page plus the tracking beacons it fires; most bounce"""
+    user.request("landing", "GET", "/")
+    _track_visitor(user)
+    if random.random() < options.get("start_rate", 0.3):
+        _track_form_event(user, "start", "personal_details")
+
+
+def form_funnel(user, options):
+    """One visitor through the whole claim form, ending in a submitted summary"""
+    row = fake_row()
+    mobile = "0" + row["mobile"][2:]
+
+    user.request("landing", "GET", "/")
+    _track_visitor(user, source="google")
+    _track_form_event(user, "start", "personal_details")
+    user.request("lookup-address", "POST", "/lookup-address", json={"postCode": row["post_code"]})
+    user.request("otp-request", "POST", "/otp/request", json={"mobile": mobile})
+    user.request("otp-verify", "POST", "/otp/verify", json={"mobile": mobile, "code": "123456"})
+
+    query_payload = build_query_payload(row)
+    user.request("validate-identity", "POST", "/validate-identity", json=query_payload)
+    valifi_response = user.request("query", "POST", "/query", json=query_payload).json()
+    accounts = extract_accounts(valifi_response)
+
+    summary = build_summary(
+        row, query_payload, valifi_response, accounts,
+        campaign="benchmark", session_id=user.session_id, skip_flg=options.get("skip_flg", False)
+    )
+    summary["signatureBase64"] = "data:image/png;base64,iVBORw0KGgo="
+    user.request("upload-summary", "POST", "/upload_summary", json=summary)
+    _track_form_event(user, "complete", "thankyou")
+    user.request("thankyou", "GET", "/thankyou")
+
+
+def batch_csv(records):
+    """CSV upload of `records` fake applicants"""
+    rows = [fake_row(index) for index in range(1, records + 1)]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def batch_import(user, options):
+    """Upload a batch of options["records"] rows and poll until every row has finished"""
+    records = options.get("records", 100)
+    admin = {"X-Admin-Key": options.get("admin_key", "bench-admin")}
+    response = user.request(
+        "batch-create", "POST", "/batch/jobs", expect=(201,), headers=admin,
+        files={"file": ("benchmark.csv", batch_csv(records), "text/csv")},
+        data={
+            "campaign": "benchmark",
+            "skip_flg": str(options.get("skip_flg", True)).lower(),
+            **{key: str(options[key]) for key in ("concurrency", "rate_per_minute", "chunk_size") if options.get(key)},
+        },
+    )
+    batch_id = response.json()["batch_id"]
+
+    started = time.perf_counter()
+    deadline = started + options.get("batch_timeout", 1800)
+    while time.perf_counter() < deadline:
+        progress = user.request("batch-poll", "GET", f"/batch/jobs/{batch_id}", headers=admin).json()
+        if progress["finished"] >= progress["total_records"]:
+            # The whole import is one sample; failed rows show up as its status
+            failed = progress["counts"]["failed"]
+            user.stats.record("batch-complete", time.perf_counter() - started, f"{failed} failed", failed == 0)
+            return
+        time.sleep(options.get("poll_seconds", 2))
+    raise StepFailed(f"batch {batch_id} did not finish in time")
+
+
+def webhook_storm(user, options):
+    """FLG posting a status change back (form-encoded, key in the query string as FLG does)"""
+    lead_ids = options.get("lead_ids") or [str(random.randint(10_000_000, 10_099_999))]
+    user.request(
+        "flg-webhook", "POST", f"/webhook/flg-status-update?secret={options.get('webhook_key', 'bench-key')}",
+        expect=(200, 404),  # 404 = no mapping for the combination, still a fully handled webhook
+        data={
+            "id": random.choice(lead_ids),
+            "leadgroupid": random.choice(WEBHOOK_LEAD_GROUPS),
+            "status": random.choice(WEBHOOK_STATUSES),
+        },
+    )
+
+
+SCENARIOS = {
+    "tv_spike": tv_spike,
+    "form_funnel": form_funnel,
+    "batch_import": batch_import,
+    "webhook_storm": webhook_storm,
+}
@@ -0,0 +1,158 @@
+"""
+Static asset build step
+Minifies, fingerprints and precompresses the JS/CSS/image assets into static/dist
+and writes static/dist/manifest.json for the templates and the /assets route.
+
+Usage:
+    python build_assets.py            # build (skips unchanged files)
+    python build_assets.py --clean    # wipe static/dist first
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+
+from static_assets import DIST_DIR, MANIFEST_PATH, COMPRESSIBLE_EXTENSIONS, guess_mimetype
+
+# Optional minifiers / brotli - the build still works without them
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("build_assets")
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (source directory, URL prefix) - URL prefix matches the existing routes
+ASSET_SOURCES = [
+    ("js", "/js"),
+    ("static", "/static"),
+]
+
+ASSET_EXTENSIONS = {'.js', '.css', '.png', '.jpg', '.jpeg', '.svg', '.ico', '.webmanifest', '.json', '.woff', '.woff2'}
+
+# Bytes saved below which a compressed variant is not worth keeping
+MIN_COMPRESSION_SAVING = 256
+
+
+def minify(data, ext):
+    """Minify JS/CSS when a minifier is installed, otherwise return as-is"""
+    if ext == '.js' and rjsmin:
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    if ext == '.css' and rcssmin:
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def iter_source_files():
+    """Yield (absolute path, logical URL path) for every buildable asset"""
+    for source_dir, url_prefix in ASSET_SOURCES:
+        base = os.path.join(ROOT_DIR, source_dir)
+        for dirpath, dirnames, filenames in os.walk(base):
+            # Never feed the build output back into itself
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != DIST_DIR]
+            for filename in sorted(filenames):
+                ext = os.path.splitext(filename)[1].lower()
+                if ext not in ASSET_EXTENSIONS:
+                    continue
+                path = os.path.join(dirpath, filename)
+                rel = os.path.relpath(path, base).replace(os.sep, '/')
+                yield path, f"{url_prefix}/{rel}"
+
+
+def write_if_changed(path, data):
+    """Write bytes to path unless an identical file is already there"""
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def build_asset(path, logical):
+    """Build one asset and return its manifest entry"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        original = f.read()
+
+    data = minify(original, ext)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+
+    # /js/app.js -> js/app.<hash>.js
+    rel_dir, filename = os.path.split(logical.lstrip('/'))
+    stem = filename[:-len(ext)] if ext else filename
+    output_rel = f"{rel_dir}/{stem}.{digest}{ext}" if rel_dir else f"{stem}.{digest}{ext}"
+    output_path = os.path.join(DIST_DIR, output_rel)
+
+    write_if_changed(output_path, data)
+
+    encodings = {}
+    if ext in COMPRESSIBLE_EXTENSIONS:
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(data) - len(gz) >= MIN_COMPRESSION_SAVING:
+            write_if_changed(f"{output_path}.gz", gz)
+            encodings['gzip'] = len(gz)
+        if brotli:
+            br = brotli.compress(data, quality=11)
+            if len(data) - len(br) >= MIN_COMPRESSION_SAVING:
+                write_if_changed(f"{output_path}.br", br)
+                encodings['br'] = len(br)
+
+    return {
+        "file": output_rel,
+        "hash": digest,
+        "size": len(data),
+        "original_size": len(original),
+        "content_type": guess_mimetype(logical),
+        "encodings": encodings,
+    }
+
+
+def build(clean=False):
+    """Build every asset and write the manifest"""
+    if clean and os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR, exist_ok=True)
+
+    if not rjsmin or not rcssmin:
+        logger.warning("rjsmin/rcssmin not installed - JS/CSS will be fingerprinted but not minified")
+    if not brotli:
+        logger.warning("brotli not installed - only gzip variants will be generated")
+
+    manifest = {}
+    for path, logical in iter_source_files():
+        manifest[logical] = build_asset(path, logical)
+
+    write_if_changed(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    total_original = sum(e["original_size"] for e in manifest.values())
+    total_gzip = sum(e["encodings"].get("gzip", e["size"]) for e in manifest.values())
+    logger.info(f"Built {len(manifest)} assets into {DIST_DIR} ({total_original} bytes -> {total_gzip} bytes gzipped)")
+    return manifest
+
+
+if __name__ == '__main__':
+    build(clean='--clean' in sys.argv)
@@ -0,0 +1,337 @@
+"""
+Bulk claim ingestion (POST /batch/claims)
+Reads NDJSON or a JSON array of summaries straight off the request stream, validates each
+record as it arrives, inserts ClaimTracking rows with one multi-row INSERT ... RETURNING id
+per block and hands lead processing to the batch lane in chunks. Results stream back as
+NDJSON - one line per record plus a final summary line.
+"""
+import codecs
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+INSERT_BLOCK_SIZE = int(os.getenv("BULK_INSERT_BLOCK_SIZE", "500"))
+LEAD_CHUNK_SIZE = int(os.getenv("BULK_LEAD_CHUNK_SIZE", "25"))
+MAX_RECORDS_PER_REQUEST = int(os.getenv("BULK_MAX_RECORDS", "50000"))
+READ_CHUNK_BYTES = 64 * 1024
+
+REQUIRED_SUMMARY_FIELDS = ("firstName", "lastName")
+
+# Lead chunks run in-process (Celery disabled) on this many threads; the rest wait in the queue
+LOCAL_LEAD_THREADS = int(os.getenv("BULK_LOCAL_LEAD_THREADS", "2"))
+
+_local_executor = None
+_local_executor_pid = None
+_local_executor_lock = threading.Lock()
+
+
+# === SECTION SEPARATOR ===
+# Streaming parsing
+# === SECTION SEPARATOR ===
+
+def _iter_text(stream):
+    """Decoded text chunks from a binary stream"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+
+def _iter_ndjson(chunks):
+    """(index, summary, error) per non-empty line - a bad line is an error for that record only"""
+    buffer = ""
+    index = 0
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            yield _decode_line(index, line)
+            index += 1
+    if buffer.strip():
+        yield _decode_line(index, buffer)
+
+
+def _decode_line(index, line):
+    try:
+        return index, json.loads(line), None
+    except ValueError as e:
+        return index, None, f"Invalid JSON: {e}"
+
+
+def _iter_json_array(chunks):
+    """
+    (index, summary, None) per element of a top-level JSON array, decoded incrementally so
+    the whole body never has to be in memory. Malformed structure raises ValueError -
+    there is no way to resynchronise inside an array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    opened = False
+    index = 0
+
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,") if opened else buffer.lstrip()
+        if not buffer:
+            if eof:
+                if not opened:
+                    raise ValueError("Empty request body")
+                raise ValueError("Unterminated JSON array")
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer += chunk
+            continue
+
+        if not opened:
+            if buffer[0] != "[":
+                raise ValueError("Expected a JSON array or NDJSON")
+            buffer = buffer[1:]
+            opened = True
+            continue
+
+        if buffer[0] == "]":
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except ValueError as e:
+            if eof:
+                raise ValueError(f"Invalid JSON in record {index}: {e}")
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer += chunk
+            continue
+
+        yield index, value, None
+        index += 1
+        buffer = buffer[end:]
+
+
+def iter_summaries(stream):
+    """
+    (index, summary, error) for every record in the body.
+    A body starting with '[' is a JSON array, anything else is NDJSON.
+    """
+    chunks = _iter_text(stream)
+    head = ""
+    for chunk in chunks:
+        head += chunk
+        if head.strip():
+            break
+
+    def replay():
+        yield head
+        yield from chunks
+
+    if head.lstrip().startswith("["):
+        return _iter_json_array(replay())
+    return _iter_ndjson(replay())
+
+
+# === SECTION SEPARATOR ===
+# Validation
+# === SECTION SEPARATOR ===
+
+def validate_summary(summary):
+    """Error message for a summary that can't become a claim, else None"""
+    from app import parse_summary_dob
+
+    if not isinstance(summary, dict):
+        return "Record must be a JSON object"
+    missing = [field for field in REQUIRED_SUMMARY_FIELDS if not summary.get(field)]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    dob = summary.get("dateOfBirth")
+    if dob:
+        try:
+            parse_summary_dob(dob)
+        except (TypeError, ValueError):
+            return f"Invalid dateOfBirth: {dob}"
+    return None
+
+
+# === SECTION SEPARATOR ===
+# Insert + lead processing hand-off
+# === SECTION SEPARATOR ===
+
+def insert_claims(session_db, summaries, client_ip=None, user_agent="bulk_ingest"):
+    """
+    One multi-row INSERT ... RETURNING id for a block of summaries (ids in input order),
+    plus one INSERT for their professional rep junctions. Caller commits.
+    """
+    from sqlalchemy import insert
+    from app import ClaimTracking, ClaimProfessionalRepresentative, build_claim_values
+    from rollups import count_pending, CLAIMS
+
+    rows = [build_claim_values(summary, client_ip=client_ip, user_agent=user_agent) for summary in summaries]
+    statement = insert(ClaimTracking).returning(ClaimTracking.id, sort_by_parameter_order=True)
+    claim_ids = [row[0] for row in session_db.execute(statement, rows)]
+    count_pending(session_db, {CLAIMS: len(claim_ids)})
+
+    junctions = [
+        {"claim_id": claim_id, "representative_id": rep["id"]}
+        for claim_id, summary in zip(claim_ids, summaries)
+        for rep in (summary.get("selectedProfessionalReps") or [])
+        # Skip the unknown_cmc placeholder - it's not a real database ID
+        if rep and rep.get("id") and rep.get("id") != "unknown_cmc"
+    ]
+    if junctions:
+        session_db.execute(insert(ClaimProfessionalRepresentative), junctions)
+    return claim_ids
+
+
+def enqueue_lead_chunk(items):
+    """Lead processing for a chunk of new claims on the batch lane (or a local thread without Celery)"""
+    from app import USE_CELERY
+
+    if USE_CELERY:
+        try:
+            from tasks import process_flg_leads_chunk_async, lane_options
+            process_flg_leads_chunk_async.apply_async(args=[items], **lane_options('batch'))
+            return
+        except Exception as e:
+            logger.error(f"[BULK] Failed to queue lead chunk of {len(items)} in Celery: {e} - running in-process")
+
+    from app import process_flg_leads_chunk
+    future = _local_lead_executor().submit(process_flg_leads_chunk, items)
+    future.add_done_callback(_log_local_chunk_failure)
+
+
+def _local_lead_executor():
+    """This process's lead-chunk executor (created after fork - gunicorn preloads the app)"""
+    global _local_executor, _local_executor_pid
+    if _local_executor_pid != os.getpid():
+        with _local_executor_lock:
+            if _local_executor_pid != os.getpid():
+                _local_executor = ThreadPoolExecutor(max_workers=LOCAL_LEAD_THREADS, thread_name_prefix="bulk-leads")
+                _local_executor_pid = os.getpid()
+    return _local_executor
+
+
+def _log_local_chunk_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"[BULK] In-process lead chunk failed: {error}")
+
+
+def _insert_block(session_db, block, client_ip, user_agent):
+    """
+    Insert a block; if the multi-row INSERT fails, retry row by row so one bad record
+    doesn't fail its neighbours. Returns [(index, summary, claim_id, error)].
+    """
+    summaries = [summary for _, summary in block]
+    try:
+        claim_ids = insert_claims(session_db, summaries, client_ip, user_agent)
+        session_db.commit()
+        return [(index, summary, claim_id, None) for (index, summary), claim_id in zip(block, claim_ids)]
+    except Exception as e:
+        session_db.rollback()
+        if len(block) == 1:
+            return [(block[0][0], block[0][1], None, str(e))]
+        logger.warning(f"[BULK] Block insert of {len(block)} failed ({e}) - retrying row by row")
+
+    results = []
+    for index, summary in block:
+        try:
+            claim_id = insert_claims(session_db, [summary], client_ip, user_agent)[0]
+            session_db.commit()
+            results.append((index, summary, claim_id, None))
+        except Exception as e:
+            session_db.rollback()
+            results.append((index, summary, None, str(e)))
+    return results
+
+
+def ingest_summaries(records, client_ip=None, user_agent="bulk_ingest", process_leads=True):
+    """
+    Generator of result dicts for (index, summary, error) records:
+    {"index", "claim_id"} / {"index", "error"} per record, then {"summary": totals}.
+    """
+    from app import db_session, split_summary_accounts
+
+    totals = {"received": 0, "inserted": 0, "failed": 0, "lead_chunks": 0}
+    block = []
+    lead_items = []
+    session_db = db_session()
+
+    def flush_block():
+        # Lead work for the committed block is handed off before any of its results are
+        # yielded - a client disconnect closes the generator at a yield
+        results = _insert_block(session_db, block, client_ip, user_agent)
+        block.clear()
+        if process_leads:
+            for index, summary, claim_id, error in results:
+                if error:
+                    continue
+                accounts, found_lenders, additional_lenders = split_summary_accounts(summary)
+                lead_items.append({
+                    "claim_id": claim_id,
+                    "summary": summary,
+                    "accounts": accounts,
+                    "found_lenders": found_lenders,
+                    "additional_lenders": additional_lenders
+                })
+            while len(lead_items) >= LEAD_CHUNK_SIZE:
+                enqueue_lead_chunk(lead_items[:LEAD_CHUNK_SIZE])
+                del lead_items[:LEAD_CHUNK_SIZE]
+                totals["lead_chunks"] += 1
+
+        for index, summary, claim_id, error in results:
+            if error:
+                totals["failed"] += 1
+                yield {"index": index, "error": error}
+            else:
+                totals["inserted"] += 1
+                yield {"index": index, "claim_id": claim_id}
+
+    try:
+        try:
+            for index, summary, error in records:
+                if totals["received"] >= MAX_RECORDS_PER_REQUEST:
+                    yield {"error": f"Record limit reached ({MAX_RECORDS_PER_REQUEST}) - remaining records ignored"}
+                    break
+                totals["received"] += 1
+
+                error = error or validate_summary(summary)
+                if error:
+                    totals["failed"] += 1
+                    yield {"index": index, "error": error}
+                    continue
+
+                block.append((index, summary))
+                if len(block) >= INSERT_BLOCK_SIZE:
+                    yield from flush_block()
+        except ValueError as e:
+            # Malformed JSON array - records before the error are still ingested
+            yield {"error": str(e)}
+
+        if block:
+            yield from flush_block()
+    finally:
+        # Also runs when the client goes away mid-stream: committed claims still get their leads
+        try:
+            if lead_items:
+                enqueue_lead_chunk(list(lead_items))
+                totals["lead_chunks"] += 1
+        finally:
+            session_db.close()
+
+    logger.info(f"[BULK] Ingested {totals['inserted']}/{totals['received']} claims ({totals['failed']} failed, {totals['lead_chunks']} lead chunks)")
+    yield {"summary": totals}
@@ -0,0 +1,231 @@
+"""
+Credit report cache for repeated identities
+Equifax reports (via Valifi) are keyed on a normalised identity fingerprint - names, DOB and
+address postcodes - and stored zlib-compressed with a TTL, in-process and in Redis when
+configured. Concurrent requests for the same identity are coalesced: one caller fetches,
+the others wait for its result instead of paying for another bureau call.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "credit_report:"
+REDIS_LOCK_PREFIX = "credit_report_lock:"
+LOCK_POLL_SECONDS = 0.5
+REDIS_RETRY_AFTER_SECONDS = 30
+
+# Only delete the lock if we still own it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _normalise(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def _postcode(address):
+    return "".join(str((address or {}).get("postCode") or "").upper().split())
+
+
+def identity_fingerprint(payload):
+    """sha256 of the normalised names, DOB and postcodes of a Valifi credit report payload"""
+    parts = [
+        _normalise(payload.get("forename")),
+        _normalise(payload.get("middleName")),
+        _normalise(payload.get("surname")),
+        _normalise(payload.get("dateOfBirth")),
+        _postcode(payload.get("currentAddress")),
+        _postcode(payload.get("previousAddress")),
+        _postcode(payload.get("previousPreviousAddress")),
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _encode(result):
+    return zlib.compress(json.dumps(result, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _decode(blob):
+    # Every caller gets its own copy - run_credit_query's callers mutate the report
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _cacheable(result):
+    """Only successful reports - errors and empty responses are always refetched"""
+    return isinstance(result, dict) and bool(result.get("data"))
+
+
+class _Flight:
+    """One in-progress fetch that other callers for the same identity wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.blob = None
+        self.error = None
+
+
+class CreditReportCache:
+    """
+    get_or_fetch(payload, fetch) returns the cached report for the payload's identity, or
+    runs fetch() once for all concurrent callers (in this process, and across processes
+    through a Redis lock) and caches its result for ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds=86400, redis_url=None, enabled=True, max_local_entries=100, lock_seconds=200):
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled and ttl_seconds > 0
+        self.max_local_entries = max_local_entries
+        self.lock_seconds = lock_seconds
+        self._redis_url = redis_url
+        self._redis = None
+        self._redis_retry_at = 0
+        self._local = OrderedDict()  # fingerprint -> (expires_at, blob)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0}
+
+    # --- storage ---
+
+    def _get_redis(self):
+        """Redis client, created on first use; None without a URL or while Redis is failing"""
+        if not self._redis_url or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self._redis_url, socket_timeout=2, socket_connect_timeout=2)
+        return self._redis
+
+    def _redis_call(self, method, *args, **kwargs):
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Credit cache: Redis {method} failed ({e}) - using local cache for {REDIS_RETRY_AFTER_SECONDS}s")
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER_SECONDS
+            return None
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry:
+                if entry[0] > time.monotonic():
+                    self._local.move_to_end(key)
+                    return entry[1]
+                del self._local[key]
+
+        blob = self._redis_call("get", REDIS_KEY_PREFIX + key)
+        if blob:
+            self._put_local(key, blob)
+        return blob
+
+    def _put_local(self, key, blob):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl_seconds, blob)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    def _store(self, key, result):
+        """Compressed result (cached when it's a successful report)"""
+        blob = _encode(result)
+        if _cacheable(result):
+            self._put_local(key, blob)
+            self._redis_call("set", REDIS_KEY_PREFIX + key, blob, ex=self.ttl_seconds)
+        return blob
+
+    def invalidate(self, payload):
+        key = identity_fingerprint(payload)
+        with self._lock:
+            self._local.pop(key, None)
+        self._redis_call("delete", REDIS_KEY_PREFIX + key)
+
+    # --- single flight ---
+
+    def _fetch_once_across_processes(self, key, fetch):
+        """
+        Take the Redis lock for this identity before fetching. While another process holds
+        it, poll for the report it will store; if that takes longer than lock_seconds, fetch anyway.
+        """
+        token = uuid.uuid4().hex
+        locked = False
+        deadline = time.monotonic() + self.lock_seconds
+        while self._get_redis() is not None:
+            locked = self._redis_call("set", REDIS_LOCK_PREFIX + key, token, nx=True, ex=self.lock_seconds)
+            if locked:
+                break
+            blob = self._get(key)
+            if blob:
+                self.stats["coalesced"] += 1
+                return blob
+            if time.monotonic() >= deadline:
+                logger.warning(f"Credit cache: gave up waiting for another worker's report ({key[:12]})")
+                break
+            time.sleep(LOCK_POLL_SECONDS)
+
+        try:
+            if locked:
+                # Another process may have finished between our cache miss and taking the lock
+                blob = self._get(key)
+                if blob:
+                    self.stats["coalesced"] += 1
+                    return blob
+            self.stats["misses"] += 1
+            return self._store(key, fetch())
+        finally:
+            if locked:
+                self._redis_call("eval", _RELEASE_LOCK_SCRIPT, 1, REDIS_LOCK_PREFIX + key, token)
+
+    def get_or_fetch(self, payload, fetch, bypass=False):
+        """Cached report for the payload's identity, else fetch() (coalesced); bypass refetches and refreshes the cache"""
+        if not self.enabled:
+            return fetch()
+
+        key = identity_fingerprint(payload)
+        if bypass:
+            self.stats["bypassed"] += 1
+            return _decode(self._store(key, fetch()))
+
+        blob = self._get(key)
+        if blob:
+            self.stats["hits"] += 1
+            logger.info(f"Credit cache: hit for identity {key[:12]}")
+            return _decode(blob)
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            self.stats["coalesced"] += 1
+            logger.info(f"Credit cache: waiting on in-flight request for identity {key[:12]}")
+            if flight.done.wait(self.lock_seconds) and flight.blob:
+                return _decode(flight.blob)
+            if flight.error:
+                raise flight.error
+            return fetch()
+
+        try:
+            flight.blob = self._fetch_once_across_processes(key, fetch)
+            return _decode(flight.blob)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
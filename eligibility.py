@@ -0,0 +1,121 @@
+"""
+Date eligibility evaluation
+The configured windows are parsed once; account dates go through a fast ISO path
+before falling back to dateutil, and each date is classified against every window in one call.
+"""
+import logging
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from dateutil import parser as date_parser
+
+logger = logging.getLogger(__name__)
+
+# dd/mm/yyyy (UK order) - the only non-ISO format we see from the frontend
+_SLASH_DATE_RE = re.compile(r"^\s*(\d{1,2})/(\d{1,2})/(\d{4})\s*$")
+
+BUCKET_IN_RANGE = "in_range"
+BUCKET_SPECIAL = "special"
+BUCKET_OUTSIDE = "outside"
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_string(value):
+    """Parse a date string - ISO fast path, then dd/mm/yyyy, then dateutil"""
+    # Valifi sends 2019-03-01 or 2019-03-01T00:00:00 - fromisoformat is ~100x cheaper than dateutil
+    head = value[:10]
+    if len(head) == 10 and head[4] == '-' and head[7] == '-':
+        try:
+            return date.fromisoformat(head)
+        except ValueError:
+            pass
+
+    match = _SLASH_DATE_RE.match(value)
+    if match:
+        day, month, year = match.groups()
+        return date(int(year), int(month), int(day))
+
+    return date_parser.parse(value).date()
+
+
+def parse_date(value):
+    """Coerce a date/datetime/string into a date (raises ValueError on bad input)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _parse_date_string(str(value).strip())
+
+
+class DateClassification(NamedTuple):
+    """Result of classifying one date against all configured windows"""
+    date: Optional[date]
+    eligible: bool
+    special: bool
+    bucket: str
+    reason: str
+
+
+class EligibilityEngine:
+    """Precomputed eligibility windows (main range + special tagging range)"""
+
+    def __init__(self, date_start, date_end, special_start=None, special_end=None):
+        self.start = parse_date(date_start)
+        self.end = parse_date(date_end)
+        self.special_start = parse_date(special_start) if special_start else None
+        self.special_end = parse_date(special_end) if special_end else None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the engine from the app Config class"""
+        return cls(config.DATE_START, config.DATE_END, config.SPECIAL_DATE_START, config.SPECIAL_DATE_END)
+
+    def in_special_range(self, check_date):
+        """True when the date falls inside the special tagging range"""
+        if self.special_start is None or self.special_end is None:
+            return False
+        return self.special_start <= check_date <= self.special_end
+
+    def classify(self, value):
+        """Classify a single date into in_range / special / outside with a reason"""
+        if not value:
+            return DateClassification(None, False, False, BUCKET_OUTSIDE, "No date provided")
+
+        try:
+            check_date = parse_date(value)
+        except (ValueError, OverflowError, TypeError) as e:
+            logger.error(f"Error checking date eligibility: {e}")
+            return DateClassification(None, False, False, BUCKET_OUTSIDE, f"Error parsing date: {str(e)}")
+
+        special = self.in_special_range(check_date)
+
+        if check_date < self.start:
+            return DateClassification(check_date, False, special, BUCKET_OUTSIDE,
+                                      f"Date {check_date} is before eligible period (starts {self.start})")
+        if check_date > self.end:
+            return DateClassification(check_date, False, special, BUCKET_OUTSIDE,
+                                      f"Date {check_date} is after eligible period (ends {self.end})")
+
+        if special:
+            return DateClassification(check_date, True, True, BUCKET_SPECIAL, "Date is within eligible range")
+        return DateClassification(check_date, True, False, BUCKET_IN_RANGE, "Date is within eligible range")
+
+    def classify_many(self, values):
+        """Classify a list of dates - repeated values only get parsed once"""
+        results = {}
+        classified = []
+        for value in values:
+            key = value if isinstance(value, (str, date)) or value is None else str(value)
+            result = results.get(key)
+            if result is None:
+                result = self.classify(value)
+                results[key] = result
+            classified.append(result)
+        return classified
+
+    def check(self, value):
+        """(is_eligible, reason) - the shape check_date_eligibility has always returned"""
+        result = self.classify(value)
+        return result.eligible, result.reason
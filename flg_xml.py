@@ -0,0 +1,173 @@
+"""
+FLG lead XML serializer
+Writes the lead XML directly from a precomputed field schema instead of building an
+ElementTree per lead. Output is byte-identical to the previous ElementTree version.
+Fields shared by every lead of a claim are serialized once into ClaimFragments.
+"""
+import logging
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>'
+
+# Standard fields - NOW INCLUDING introducer
+STANDARD_FIELDS = (
+    "source", "medium", "term", "introducer", "title", "firstname", "lastname",
+    "phone1", "phone2", "email", "address", "address2", "address3",
+    "towncity", "postcode"
+)
+
+# Extra data fields - Complete list data1 to data55 for future-proofing
+EXTRA_FIELDS = tuple(f"data{i}" for i in range(1, 56))
+
+# Contact preferences - SET TO YES/NO AS REQUESTED
+CONTACT_PREFERENCES = (
+    b"<contactphone>Yes</contactphone>"
+    b"<contactsms>Yes</contactsms>"
+    b"<contactemail>Yes</contactemail>"
+    b"<contactmail>Yes</contactmail>"
+    b"<contactfax>No</contactfax>"
+)
+
+
+# Low-cardinality, non-personal fields - the only ones cached process-wide. Claimant data
+# (names, address, DOB, signature, Valifi JSON) is only reused within one claim's ClaimFragments.
+CACHED_TAGS = frozenset({
+    "key", "leadgroup", "site", "cost", "source", "medium", "term", "introducer", "title"
+})
+
+# Fields a claim's leads can share
+FRAGMENT_TAGS = frozenset(STANDARD_FIELDS + EXTRA_FIELDS)
+
+
+def _element(tag, text):
+    if not text:
+        return f"<{tag} />".encode("utf-8")
+    return f"<{tag}>{escape(text)}</{tag}>".encode("utf-8")
+
+
+_cached_element = lru_cache(maxsize=512)(_element)
+
+
+def text_element(tag, text):
+    """Serialized <tag>text</tag> fragment (cached only for CACHED_TAGS)"""
+    if tag in CACHED_TAGS:
+        return _cached_element(tag, text)
+    return _element(tag, text)
+
+
+def parse_dob(dob_input):
+    """Split a DOB into (dob YYYY-MM-DD, day, month, year) - any part may be None"""
+    dob_formatted = None
+    day = mon = year = None
+
+    if "/" in dob_input:
+        # DD/MM/YYYY format from frontend
+        parts = dob_input.split("/")
+        if len(parts) == 3:
+            day, mon, year = parts
+            dob_formatted = f"{year}-{mon.zfill(2)}-{day.zfill(2)}"
+    elif "-" in dob_input:
+        # Already in YYYY-MM-DD format
+        parts = dob_input.split("-")
+        if len(parts) == 3:
+            year, mon, day = parts
+            dob_formatted = dob_input
+    else:
+        logger.error(f"Unknown date format: {dob_input}")
+
+    return dob_formatted, day, mon, year
+
+
+def _dob_fragments(dob_input):
+    """dob/dobday/dobmonth/dobyear elements for a DOB string"""
+    dob_formatted, day, mon, year = parse_dob(dob_input)
+    parts = []
+    if dob_formatted:
+        logger.debug(f"Adding DOB to XML: {dob_formatted}")
+        parts.append(text_element("dob", dob_formatted))
+    if day and mon and year:
+        parts.append(text_element("dobday", day.lstrip('0') or day))  # Remove leading zeros
+        parts.append(text_element("dobmonth", mon.lstrip('0') or mon))
+        parts.append(text_element("dobyear", year))
+    return parts
+
+
+class ClaimFragments:
+    """
+    Serialized fields shared by the leads of one claim (applicant, address, DOB, data25
+    signature, data32/data36 Valifi JSON), escaped once and spliced into every lead whose
+    value is the same. Build one per claim and drop it with the claim.
+    """
+
+    def __init__(self, fields):
+        self._elements = {
+            tag: (value, _element(tag, str(value)))
+            for tag, value in fields.items() if value and tag in FRAGMENT_TAGS
+        }
+        dob_input = fields.get("dateOfBirth")
+        self._dob = (dob_input, _dob_fragments(dob_input)) if dob_input else None
+
+    def element(self, tag, text):
+        """The claim's fragment for tag when text matches it, else a freshly serialized one"""
+        shared = self._elements.get(tag)
+        if shared is not None and shared[0] == text:
+            return shared[1]
+        return text_element(tag, text)
+
+    def dob(self, dob_input):
+        if self._dob is not None and self._dob[0] == dob_input:
+            return self._dob[1]
+        return _dob_fragments(dob_input)
+
+
+def build_lead_xml(lead, api_key, default_leadgroup, fragments=None):
+    """Build the XML payload for one FLG lead (reusing the claim's ClaimFragments if given)"""
+    element = fragments.element if fragments is not None else text_element
+    parts = [XML_DECLARATION, b"<data><lead>"]
+    append = parts.append
+
+    # Required fields
+    append(text_element("key", api_key if api_key is None else str(api_key)))
+    append(text_element("leadgroup", str(lead.get("leadgroup", default_leadgroup))))
+    site = lead.get("site", "0")
+    append(text_element("site", site if site is None else str(site)))
+
+    # Include optional primary fields used by create/update
+    if lead.get("id") is not None:
+        append(text_element("id", str(lead["id"])))
+
+    if lead.get("reference") is not None:
+        append(text_element("reference", str(lead["reference"])))
+
+    # DCA: decimal cost (format to 2dp)
+    if lead.get("cost") is not None:
+        append(text_element("cost", f"{float(lead['cost']):.2f}"))
+
+    # Company field carries the applicant id
+    if lead.get("applicant_id") is not None:
+        append(text_element("company", f"<company>{lead['applicant_id']}</company>"))
+
+    for field in STANDARD_FIELDS:
+        value = lead.get(field)
+        if value:
+            append(element(field, str(value)))
+
+    # Date of birth - FLG needs both dob (YYYY-MM-DD) AND the separate fields
+    dob_input = lead.get("dateOfBirth", "")
+    if dob_input:
+        parts.extend(fragments.dob(dob_input) if fragments is not None else _dob_fragments(dob_input))
+    else:
+        logger.warning("No DOB provided in lead data")
+
+    append(CONTACT_PREFERENCES)
+
+    for field in EXTRA_FIELDS:
+        value = lead.get(field)
+        if value:
+            append(element(field, str(value)))
+
+    append(b"</lead></data>")
+    return b"".join(parts)
@@ -0,0 +1,323 @@
+"""
+Prometheus instrumentation
+Latency histograms and counters for upstream calls (Valifi, FLG, the lead-id webhook), AWS
+calls (S3 puts), database connections and transactions, lender matching, HTTP requests, each
+stage of process_flg_leads_background and webhook outbox deliveries. GET /metrics/prometheus
+serves them in the text exposition format; with PROMETHEUS_MULTIPROC_DIR set (see Procfile)
+every gunicorn worker writes its samples there and the scrape aggregates them. Without
+prometheus_client everything is a no-op.
+"""
+import logging
+import os
+import time
+from functools import wraps
+
+import requests
+
+import tracing
+from upstream_guard import UpstreamUnavailable
+
+try:
+    from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+# Seconds - upstreams run from tens of ms to the 30s+ credit report
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 120)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _NoopMetric:
+    """Stands in for a metric when prometheus_client isn't installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name, documentation, labelnames=(), buckets=SLOW_BUCKETS):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def _counter(name, documentation, labelnames=()):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return Counter(name, documentation, labelnames)
+
+
+# Only counters and histograms: both aggregate cleanly across processes (gauges don't)
+UPSTREAM_REQUEST_SECONDS = _histogram(
+    "upstream_request_seconds",
+    "Valifi / FLG / webhook call latency, per attempt, including time queued behind the upstream guard",
+    ("upstream", "endpoint", "outcome")
+)
+AWS_REQUEST_SECONDS = _histogram(
+    "aws_request_seconds",
+    "boto3 call latency (S3 puts, SNS publishes)",
+    ("service", "operation", "outcome")
+)
+DB_CONNECT_SECONDS = _histogram(
+    "db_connect_seconds",
+    "Time to open a PostgreSQL connection (NullPool - one per session transaction)",
+    buckets=FAST_BUCKETS
+)
+DB_CONNECT_ERRORS = _counter("db_connect_errors_total", "Failed PostgreSQL connection attempts")
+DB_SESSION_TRANSACTIONS = _counter(
+    "db_session_transactions_total",
+    "ORM session transactions begun (each one checks out a connection)"
+)
+LENDER_MATCH_SECONDS = _histogram(
+    "lender_match_seconds",
+    "Fuzzy lender name matching time",
+    ("source",),
+    buckets=FAST_BUCKETS
+)
+PIPELINE_STAGE_SECONDS = _histogram(
+    "lead_pipeline_stage_seconds",
+    "Time per claim spent in each stage of process_flg_leads_background",
+    ("stage",)
+)
+PIPELINE_SECONDS = _histogram(
+    "lead_pipeline_seconds",
+    "Total process_flg_leads_background time per claim",
+    ("outcome",)
+)
+HTTP_REQUEST_SECONDS = _histogram(
+    "http_request_seconds",
+    "Flask request handling time up to the response headers",
+    ("endpoint", "method", "status")
+)
+WEBHOOK_DELIVERIES = _counter(
+    "webhook_outbox_deliveries_total",
+    "Outbound lead-id webhook outbox rows by result: sent, retry (rescheduled) or failed (given up)",
+    ("outcome",)
+)
+WEBHOOK_DELIVERY_DELAY_SECONDS = _histogram(
+    "webhook_outbox_delivery_delay_seconds",
+    "Time from queueing an outbound webhook to its successful delivery, retries included"
+)
+
+
+# === SECTION SEPARATOR ===
+# Upstream calls
+# === SECTION SEPARATOR ===
+
+def _status_outcome(status):
+    return f"{status // 100}xx"
+
+
+def call_outcome(result=None, error=None):
+    """Low-cardinality outcome label: 2xx/4xx/5xx, ok, timeout, rejected or error"""
+    if error is not None:
+        if isinstance(error, UpstreamUnavailable):
+            return "rejected"
+        if isinstance(error, requests.exceptions.Timeout):
+            return "timeout"
+        response = getattr(error, "response", None)
+        if response is not None:
+            return _status_outcome(response.status_code)
+        return "error"
+
+    status = getattr(result, "status_code", None)
+    if status is None and isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
+        status = result[1]  # (json, status_code) helpers
+    return _status_outcome(status) if status is not None else "ok"
+
+
+def timed_upstream(upstream, endpoint):
+    """Decorator: observe each call in upstream_request_seconds{upstream, endpoint, outcome}"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = call_outcome(result=result)
+                return result
+            except Exception as e:
+                outcome = call_outcome(error=e)
+                raise
+            finally:
+                UPSTREAM_REQUEST_SECONDS.labels(upstream, endpoint, outcome).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def instrument_boto_client(client):
+    """Time every call made through a boto3 client (botocore before-call / after-call events)"""
+    if client is None or not PROMETHEUS_AVAILABLE:
+        return client
+
+    service = client.meta.service_model.service_name
+
+    def before_call(context=None, **kwargs):
+        if context is not None:
+            context["metrics_started"] = time.perf_counter()
+
+    def after_call(http_response=None, model=None, context=None, **kwargs):
+        started = (context or {}).pop("metrics_started", None)
+        if started is None:
+            return
+        status = getattr(http_response, "status_code", None)
+        outcome = _status_outcome(status) if status else "error"
+        AWS_REQUEST_SECONDS.labels(service, model.name if model else "unknown", outcome).observe(time.perf_counter() - started)
+
+    def after_call_error(model=None, context=None, **kwargs):
+        started = (context or {}).pop("metrics_started", None)
+        if started is not None:
+            AWS_REQUEST_SECONDS.labels(service, model.name if model else "unknown", "error").observe(time.perf_counter() - started)
+
+    client.meta.events.register("before-call.*.*", before_call)
+    client.meta.events.register("after-call.*.*", after_call)
+    client.meta.events.register("after-call-error.*.*", after_call_error)
+    return client
+
+
+# === SECTION SEPARATOR ===
+# Database
+# === SECTION SEPARATOR ===
+
+def instrument_engine(engine):
+    """Observe connection setup time (with NullPool every checkout is a new connection)"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "do_connect")
+    def _start_connect(dialect, conn_rec, cargs, cparams):
+        conn_rec.info["metrics_connect_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def _connected(dbapi_connection, conn_rec):
+        started = conn_rec.info.pop("metrics_connect_started", None)
+        if started is not None:
+            DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _connect_failed(context):
+        # No Connection yet means the error came from connecting
+        if context.connection is None:
+            DB_CONNECT_ERRORS.inc()
+
+
+def instrument_sessions(session_factory):
+    """Count transactions begun by sessions from session_factory"""
+    from sqlalchemy import event
+
+    @event.listens_for(session_factory, "after_begin")
+    def _began(session_db, transaction, connection):
+        DB_SESSION_TRANSACTIONS.inc()
+
+
+# === SECTION SEPARATOR ===
+# Lead pipeline
+# === SECTION SEPARATOR ===
+
+def timed_lender_match(source):
+    """Decorator: observe lender_match_seconds{source}"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                LENDER_MATCH_SECONDS.labels(source).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class StageClock:
+    """
+    Lap timer for one run of the lead pipeline: lap(stage) adds the time since the previous
+    lap to that stage, so interleaved stages (build/send per account) are summed per claim.
+    finish() observes one sample per stage that ran plus the total. Each lap is also a
+    lead_pipeline.<stage> span under a lead_pipeline span carrying the given attributes.
+    """
+
+    def __init__(self, **attributes):
+        self.started = self._last = time.perf_counter()
+        self._last_ns = time.time_ns()
+        self.totals = {}
+        self._finished = False
+        self.span = tracing.begin("lead_pipeline", attributes=attributes)
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + (now - self._last)
+        self._last = now
+        now_ns = time.time_ns()
+        tracing.record_span(f"lead_pipeline.{stage}", self._last_ns, now_ns)
+        self._last_ns = now_ns
+
+    def finish(self, outcome="ok"):
+        if self._finished:
+            return
+        self._finished = True
+        for stage, seconds in self.totals.items():
+            PIPELINE_STAGE_SECONDS.labels(stage).observe(seconds)
+        PIPELINE_SECONDS.labels(outcome).observe(time.perf_counter() - self.started)
+        if outcome != "ok":
+            self.span.set_error(outcome)
+        self.span.end()
+
+
+# === SECTION SEPARATOR ===
+# HTTP + exposition
+# === SECTION SEPARATOR ===
+
+def instrument_flask(flask_app):
+    """Observe http_request_seconds per route pattern (not raw path - keeps cardinality bounded)"""
+    from flask import g, request
+
+    @flask_app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @flask_app.after_request
+    def _observe_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.labels(endpoint, request.method, _status_outcome(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+
+def _registry():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    """(body, content_type) for a scrape; aggregated across processes in multi-process mode"""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client not installed\n", CONTENT_TYPE_LATEST
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    """Expose this process group's metrics on their own port (Celery workers have no Flask app)"""
+    if not PROMETHEUS_AVAILABLE:
+        logger.warning("prometheus_client not installed - worker metrics server not started")
+        return
+    from prometheus_client import start_http_server
+    start_http_server(port, registry=_registry())
+    logger.info(f"Metrics server listening on :{port}")
@@ -0,0 +1,269 @@
+"""
+Logging setup and hot-path helpers
+configure_logging() installs one root handler - text or JSON lines - behind a bounded queue, so
+request greenlets and Celery tasks never wait on log I/O (records are dropped and counted when
+the queue is full), and applies per-subsystem levels from LOG_LEVELS
+("app.valifi=DEBUG,app.flg=WARNING"). truncate()/redact_*() wrap payloads lazily - nothing is
+decoded or built unless the record is actually emitted - and sampled() rate-limits
+high-frequency messages.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "500"))
+LOG_SAMPLE_SECONDS = float(os.getenv("LOG_SAMPLE_SECONDS", "60"))
+
+# FLG fields carrying the base64 signature (data25), the report PDF URL (data31), Valifi JSON
+# (data32/data36) and per-account JSON (data34/data48)
+FLG_BULKY_FIELDS = ("data25", "data31", "data32", "data34", "data36", "data48")
+SENSITIVE_HEADERS = ("authorization", "cookie", "set-cookie", "x-api-key", "x-metrics-key")
+
+# Attributes every LogRecord has - anything else came in through extra= and goes into JSON output
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+# === SECTION SEPARATOR ===
+# Lazy payload helpers
+# === SECTION SEPARATOR ===
+
+class _Lazy:
+    """Calls func(*args) only when the log record is formatted"""
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        try:
+            return self.func(*self.args)
+        except Exception as e:
+            return f"<unloggable: {e}>"
+
+    __repr__ = __str__
+
+
+def _truncate(value, limit):
+    if isinstance(value, (bytes, bytearray)):
+        size = len(value)
+        text = bytes(value[:limit]).decode("utf-8", errors="replace")
+    else:
+        text = value if isinstance(value, str) else str(value)
+        size = len(text)
+        text = text[:limit]
+    if size > limit:
+        return f"{text}... [truncated, {size} total]"
+    return text
+
+
+def truncate(value, limit=None):
+    """First limit chars (LOG_PAYLOAD_CHARS) of a str/bytes/object, plus its full size"""
+    return _Lazy(_truncate, value, LOG_PAYLOAD_CHARS if limit is None else limit)
+
+
+def _redact_xml(xml, fields, limit):
+    text = xml.decode("utf-8", errors="replace") if isinstance(xml, (bytes, bytearray)) else str(xml)
+    for field in fields:
+        text = re.sub(
+            rf"<{field}>(.*?)</{field}>",
+            lambda m: f"<{field}>[{len(m.group(1))} chars]</{field}>",
+            text,
+            flags=re.DOTALL
+        )
+    return _truncate(text, limit)
+
+
+def redact_xml(xml, fields=FLG_BULKY_FIELDS, limit=None):
+    """XML with the named elements' contents replaced by their length, then truncated"""
+    return _Lazy(_redact_xml, xml, fields, LOG_PAYLOAD_CHARS * 4 if limit is None else limit)
+
+
+def _redact_headers(headers):
+    return str({
+        name: "[redacted]" if name.lower() in SENSITIVE_HEADERS else value
+        for name, value in dict(headers or {}).items()
+    })
+
+
+def redact_headers(headers):
+    """Header dict with credentials and cookies masked"""
+    return _Lazy(_redact_headers, headers)
+
+
+def redact_secret(value, keep=4):
+    """First few characters of a key/token - enough to tell which one was used"""
+    if not value:
+        return value
+    return f"{str(value)[:keep]}...({len(str(value))} chars)"
+
+
+# === SECTION SEPARATOR ===
+# Sampling
+# === SECTION SEPARATOR ===
+
+def sampled(key, seconds=None):
+    """extra= for a high-frequency message: at most one record per key every LOG_SAMPLE_SECONDS"""
+    return {"sample_key": key, "sample_seconds": LOG_SAMPLE_SECONDS if seconds is None else seconds}
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through the first record per sample_key per window; the next one carries the suppressed count"""
+
+    def __init__(self):
+        super().__init__()
+        self._windows = {}  # key -> (window_start, suppressed)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample_key", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window_start, suppressed = self._windows.get(key, (None, 0))
+            if window_start is not None and now - window_start < record.sample_seconds:
+                self._windows[key] = (window_start, suppressed + 1)
+                return False
+            self._windows[key] = (now, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} [+{suppressed} similar suppressed]"
+            record.args = None
+            record.suppressed = suppressed
+        return True
+
+
+# === SECTION SEPARATOR ===
+# Formatting + async handler
+# === SECTION SEPARATOR ===
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, any extra= fields, exc"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("sample_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {"handler": None, "listener": None, "target": None, "queue_size": 0}
+
+
+def _start_listener():
+    handler = _state["handler"]
+    handler.queue = queue.Queue(_state["queue_size"])
+    listener = logging.handlers.QueueListener(handler.queue, _state["target"], respect_handler_level=True)
+    listener.start()
+    _state["listener"] = listener
+
+
+def _stop_listener():
+    listener = _state["listener"]
+    if listener is not None:
+        _state["listener"] = None
+        listener.stop()
+        dropped = _state["handler"].dropped
+        if dropped:
+            _state["target"].handle(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"{dropped} log records dropped (queue full)"
+            }))
+
+
+def _restart_after_fork():
+    # The listener thread doesn't survive fork (gunicorn --preload, Celery prefork)
+    if _state["handler"] is not None:
+        _state["handler"].dropped = 0
+        _start_listener()
+
+
+def queue_state():
+    """Queued and dropped record counts of the async handler (None when logging is synchronous)"""
+    handler = _state["handler"]
+    if handler is None:
+        return None
+    return {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+
+
+def parse_levels(spec):
+    """"app.valifi=DEBUG,app.flg=WARNING" -> {"app.valifi": "DEBUG", "app.flg": "WARNING"}"""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level=None, levels=None, fmt=None, async_enabled=None, queue_size=None):
+    """
+    Root logging for the web app and workers. Defaults come from LOG_LEVEL, LOG_LEVELS,
+    LOG_FORMAT (text|json), LOG_ASYNC and LOG_QUEUE_SIZE. Safe to call more than once.
+    """
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    levels = parse_levels(os.getenv("LOG_LEVELS", "") if levels is None else levels)
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    if async_enabled is None:
+        async_enabled = os.getenv("LOG_ASYNC", "true").lower() == "true"
+    queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    _stop_listener()
+    target = logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    if async_enabled:
+        handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        first_time = _state["target"] is None
+        _state.update(handler=handler, target=target, queue_size=queue_size)
+        _start_listener()
+        if first_time:
+            atexit.register(_stop_listener)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=_restart_after_fork)
+    else:
+        handler = target
+        _state.update(handler=None, target=target)
+
+    # Sampling runs before the record is queued, so suppressed records cost almost nothing
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+
+    for name, name_level in levels.items():
+        logging.getLogger(name).setLevel(getattr(logging, name_level, logging.INFO))
+    return handler
@@ -0,0 +1,88 @@
+"""
+Rendered page cache for the static-ish HTML pages (index / thankyou)
+Pages are rendered once per distinct context, compressed once, and then served
+as byte copies or 304s for every later hit.
+"""
+import gzip
+import hashlib
+import logging
+import threading
+
+from flask import request, render_template, Response
+
+from static_assets import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class RenderedPage:
+    """One rendered template plus its precompressed variants"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def etag_for(self, encoding):
+        """Strong ETag for the representation actually sent"""
+        return f"{self.etag}-{encoding}" if encoding else self.etag
+
+
+class PageCache:
+    """
+    Cache of rendered pages keyed on template name + the (hashable) context values.
+    The context for the cached pages only comes from Config, so the number of
+    entries is tiny and nothing ever needs evicting.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _get_page(self, template_name, context):
+        key = (template_name, tuple(sorted(context.items())))
+        page = self._pages.get(key)
+        if page is None:
+            with self._lock:
+                page = self._pages.get(key)
+                if page is None:
+                    body = render_template(template_name, **context).encode('utf-8')
+                    page = RenderedPage(body)
+                    self._pages[key] = page
+                    logger.info(f"Page cache: rendered {template_name} ({len(body)} bytes, etag {page.etag})")
+        return page
+
+    def render(self, template_name, **context):
+        """Return a Response for the template, served from cache when enabled"""
+        if not self.enabled:
+            return Response(render_template(template_name, **context), mimetype='text/html')
+
+        page = self._get_page(template_name, context)
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), page.variants)
+        etag = page.etag_for(encoding)
+
+        if request.if_none_match and request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(page.variants[encoding] if encoding else page.body, mimetype='text/html')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Always revalidate - a deploy changes the ETag, repeat visits get a 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def clear(self):
+        """Drop all rendered pages (e.g. after a template change)"""
+        with self._lock:
+            self._pages = {}
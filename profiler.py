@@ -0,0 +1,237 @@
+"""
+Live-process profiling for gevent workers
+profile() samples stacks from a native OS thread - so it keeps sampling while a greenlet pins
+the hub - and attributes each sample to the greenlet that was running, via greenlet.settrace.
+The result is collapsed stacks ("root;...;leaf count" per line), which flamegraph.pl, speedscope
+and inferno read as-is. dump_state() lists every thread and greenlet stack plus the state of the
+registered pools (upstream limiters, DB engine, gevent threadpool, log queue).
+
+Reached through /admin/profile and /admin/greenlets, or - for a worker too busy to answer HTTP -
+by sending it PROFILER_SIGNAL (SIGURG by default; gunicorn resets USR1/USR2 in its workers):
+
+    kill -URG <worker pid>     # writes greenlets-<pid>-<ts>.txt and profile-<pid>-<ts>.folded to PROFILE_DIR
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import greenlet
+from gevent import monkey
+from gevent.util import format_run_info
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "10"))
+PROFILER_SIGNAL = os.getenv("PROFILER_SIGNAL", "SIGURG")
+
+# The sampler must be a real thread sleeping on the real clock, even after monkey.patch_all()
+_start_native_thread = monkey.get_original("_thread", "start_new_thread")
+_native_sleep = monkey.get_original("time", "sleep")
+_native_lock = monkey.get_original("_thread", "allocate_lock")
+# threading.get_ident is per-greenlet once patched; sys._current_frames() is keyed by OS thread
+_native_ident = monkey.get_original("_thread", "get_ident")
+
+_profile_lock = _native_lock()
+_pool_states = {}
+
+
+class ProfileBusy(Exception):
+    """A profile is already running in this process"""
+
+
+# === SECTION SEPARATOR ===
+# Sampling
+# === SECTION SEPARATOR ===
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _greenlet_label(running, hub_greenlet):
+    if running is None:
+        return "greenlet ?"
+    if running is hub_greenlet or type(running).__name__ == "Hub":
+        return "gevent hub"
+    if getattr(running, "parent", True) is None:
+        return "main greenlet"
+    run = getattr(running, "_run", None) or getattr(running, "run", None)
+    name = getattr(run, "__qualname__", None) or type(running).__name__
+    return f"greenlet {name}"
+
+
+class _Sampling:
+    """State shared by the sampler thread and the greenlet trace hook on the main thread"""
+
+    def __init__(self, seconds, hz, all_threads):
+        self.seconds = seconds
+        self.interval = 1.0 / hz
+        self.all_threads = all_threads
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = greenlet.getcurrent()
+        self.active = True
+        self.previous_trace = None
+        self.main_ident = _native_ident()  # created on the main (hub) thread
+        self.done = _native_lock()
+        self.done.acquire()
+
+    def trace(self, event, args):
+        if event in ("switch", "throw"):
+            self.running = args[1]
+        if self.previous_trace is not None:
+            self.previous_trace(event, args)
+        if not self.active:
+            self.uninstall()
+
+    def uninstall(self):
+        # Only from the main thread - greenlet.settrace is per-thread
+        if greenlet.gettrace() == self.trace:
+            greenlet.settrace(self.previous_trace)
+
+    def sample_loop(self):
+        from gevent import get_hub
+        hub_greenlet = get_hub()
+        own_ident = _native_ident()
+        thread_names = {}
+        deadline = time.perf_counter() + self.seconds
+        try:
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == self.main_ident:
+                        root = _greenlet_label(self.running, hub_greenlet)
+                    elif self.all_threads and ident != own_ident:
+                        if ident not in thread_names:
+                            thread_names = {getattr(t, "native_id", t.ident): t.name for t in threading.enumerate()}
+                        root = f"thread {thread_names.get(ident, ident)}"
+                    else:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(root)
+                    self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+                _native_sleep(self.interval)
+        finally:
+            self.active = False
+            self.done.release()
+
+
+def _start(seconds, hz, all_threads, on_done=None):
+    """Install the greenlet hook on this (main) thread and start the native sampler"""
+    if not _profile_lock.acquire(False):
+        raise ProfileBusy("a profile is already running in this process")
+    seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+    hz = max(1.0, min(float(hz), 1000.0))
+    sampling = _Sampling(seconds, hz, all_threads)
+    sampling.previous_trace = greenlet.settrace(sampling.trace)
+
+    def run():
+        try:
+            sampling.sample_loop()
+            if on_done is not None:
+                on_done(sampling)
+        finally:
+            _profile_lock.release()
+
+    _start_native_thread(run, ())
+    return sampling
+
+
+def collapsed(stacks):
+    """Counter of "a;b;c" stacks -> collapsed-stack text, heaviest first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile(seconds=10, hz=100, all_threads=False):
+    """
+    Sample this process for seconds at hz and return (collapsed_text, samples).
+    Blocks only the calling greenlet - other requests keep being served while it runs.
+    """
+    sampling = _start(seconds, hz, all_threads)
+    import gevent
+    while not sampling.done.acquire(False):
+        gevent.sleep(0.05)
+    sampling.uninstall()
+    return collapsed(sampling.stacks), sampling.samples
+
+
+# === SECTION SEPARATOR ===
+# Greenlet and pool dumps
+# === SECTION SEPARATOR ===
+
+def register_pool_state(name, provider):
+    """provider() -> dict/str describing a pool; included in every dump_state()"""
+    _pool_states[name] = provider
+
+
+def _gevent_pool_states():
+    from gevent import get_hub
+    hub = get_hub()
+    states = {"hub": {"loop_pending": getattr(hub.loop, "pendingcnt", None)}}
+    threadpool = getattr(hub, "_threadpool", None)
+    if threadpool is not None:
+        states["threadpool"] = {
+            "size": threadpool.size,
+            "maxsize": threadpool.maxsize,
+            "queued": threadpool.task_queue.qsize() if hasattr(threadpool, "task_queue") else None,
+        }
+    return states
+
+
+def dump_state():
+    """Every thread and greenlet stack, then the registered pool states, as text"""
+    lines = [f"pid {os.getpid()} at {datetime.now().isoformat(timespec='seconds')}", ""]
+    lines.extend(line.rstrip("\n") for line in format_run_info(thread_stacks=True, greenlet_stacks=True))
+    lines.extend(["", "*" * 60, "* Pools", "*" * 60])
+    providers = {"gevent": _gevent_pool_states, **_pool_states}
+    for name, provider in providers.items():
+        try:
+            lines.append(f"{name}: {provider()}")
+        except Exception as e:
+            lines.append(f"{name}: <unavailable: {e}>")
+    return "\n".join(lines) + "\n"
+
+
+# === SECTION SEPARATOR ===
+# Signal trigger
+# === SECTION SEPARATOR ===
+
+def _write(path, text):
+    with open(path, "w") as handle:
+        handle.write(text)
+    # Plain stderr write - the logging queue's locks are not safe to take from a signal handler
+    os.write(2, f"[profiler] wrote {path}\n".encode())
+
+
+def _on_signal(signum, frame):
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    pid = os.getpid()
+
+    def write_profile(sampling):
+        _write(os.path.join(PROFILE_DIR, f"profile-{pid}-{stamp}.folded"), collapsed(sampling.stacks))
+
+    try:
+        _write(os.path.join(PROFILE_DIR, f"greenlets-{pid}-{stamp}.txt"), dump_state())
+        _start(PROFILE_SIGNAL_SECONDS, 100, True, on_done=write_profile)
+    except ProfileBusy:
+        pass
+    except Exception as e:
+        os.write(2, f"[profiler] signal dump failed: {e}\n".encode())
+
+
+def install_signal_handler(signal_name=None):
+    """Dump greenlets and profile for PROFILE_SIGNAL_SECONDS on PROFILER_SIGNAL ("" disables)"""
+    signal_name = PROFILER_SIGNAL if signal_name is None else signal_name
+    signum = getattr(signal, signal_name, None) if signal_name else None
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    # A raw handler, not gevent.signal_handler: it must run even when the hub is pinned
+    signal.signal(signum, _on_signal)
+    return True
@@ -0,0 +1,253 @@
+"""
+Per-request / per-task SQL auditing
+Every statement executed while a unit of work (Flask request, Celery task, background batch
+thread) is active is counted and timed against that unit. When the unit ends, statement shapes
+repeated QUERY_REPEAT_THRESHOLD+ times (N+1 - a query per account / per event), identical
+SELECTs re-run QUERY_DUPLICATE_THRESHOLD+ times and units over QUERY_BUDGET statements are
+logged with the route or task name; single statements slower than SLOW_QUERY_MS are logged
+as they happen.
+
+QUERY_AUDIT_STRICT=true (tests) raises QueryBudgetExceeded at the statement that breaks a
+budget instead of logging, and query_budget() sets a tighter budget around one block:
+
+    with query_budget(max_statements=20, max_repeats=3):
+        client.post("/upload_summary", json=summary)
+"""
+import contextvars
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from log_config import sampled
+
+logger = logging.getLogger(__name__)
+
+QUERY_AUDIT_ENABLED = os.getenv("QUERY_AUDIT_ENABLED", "true").lower() == "true"
+QUERY_AUDIT_STRICT = os.getenv("QUERY_AUDIT_STRICT", "false").lower() == "true"
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+QUERY_DUPLICATE_THRESHOLD = int(os.getenv("QUERY_DUPLICATE_THRESHOLD", "3"))
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "100"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SQL_LOG_CHARS = 300
+
+# Units of work active in this context, outermost first (a query_budget() nests inside a request)
+_active = contextvars.ContextVar("query_audits", default=())
+
+_IN_LIST_RE = re.compile(r"\((?:\s*%\(\w+\)s\s*,?)+\)|\((?:\s*\?\s*,?)+\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A unit of work broke its statement budget in strict mode"""
+
+
+@lru_cache(maxsize=2048)
+def statement_shape(statement):
+    """Statement text with whitespace collapsed and IN (...) lists of any length folded together"""
+    return _IN_LIST_RE.sub("(...)", _WHITESPACE_RE.sub(" ", statement).strip())
+
+
+class QueryAudit:
+    """Statement counts and timings for one unit of work"""
+
+    def __init__(self, unit, max_statements=None, max_repeats=None, strict=False, report=True):
+        self.unit = unit
+        self.max_statements = max_statements
+        self.max_repeats = max_repeats
+        self.strict = strict
+        self.report_on_finish = report
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = {}  # shape -> [count, seconds]
+        self.duplicates = {}  # (shape, parameters) -> count, SELECTs only
+        self.violation = None
+
+    def record(self, shape, parameters_key, seconds):
+        self.statements += 1
+        self.seconds += seconds
+        entry = self.shapes.setdefault(shape, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        if parameters_key is not None:
+            key = (shape, parameters_key)
+            self.duplicates[key] = self.duplicates.get(key, 0) + 1
+        if self.strict and self.violation is None:
+            if self.max_statements is not None and self.statements > self.max_statements:
+                self.violation = QueryBudgetExceeded(
+                    f"{self.unit}: more than {self.max_statements} statements (latest: {shape[:SQL_LOG_CHARS]})"
+                )
+            elif self.max_repeats is not None and entry[0] > self.max_repeats:
+                self.violation = QueryBudgetExceeded(
+                    f"{self.unit}: statement repeated {entry[0]} times (max {self.max_repeats}): {shape[:SQL_LOG_CHARS]}"
+                )
+            if self.violation is not None:
+                raise self.violation
+
+    def repeated(self, threshold=None):
+        """[(shape, count, seconds)] run threshold+ times, most frequent first"""
+        threshold = QUERY_REPEAT_THRESHOLD if threshold is None else threshold
+        return sorted(
+            ((shape, count, seconds) for shape, (count, seconds) in self.shapes.items() if count >= threshold),
+            key=lambda item: -item[1]
+        )
+
+    def report(self):
+        """Log the N+1 shapes, redundant re-reads and budget overrun of this unit"""
+        for shape, count, seconds in self.repeated():
+            logger.warning(
+                "[QUERY] N+1 in %s: %sx (%.0f ms) %s", self.unit, count, seconds * 1000, shape[:SQL_LOG_CHARS],
+                extra=sampled(f"n+1:{self.unit}:{hash(shape)}")
+            )
+        rereads = {}
+        for (shape, _), count in self.duplicates.items():
+            rereads[shape] = max(rereads.get(shape, 0), count)
+        for shape, count in rereads.items():
+            if count >= QUERY_DUPLICATE_THRESHOLD:
+                logger.warning(
+                    "[QUERY] %s re-ran an identical SELECT %sx: %s", self.unit, count, shape[:SQL_LOG_CHARS],
+                    extra=sampled(f"dup:{self.unit}:{hash(shape)}")
+                )
+        if self.statements > QUERY_BUDGET:
+            logger.warning(
+                "[QUERY] %s ran %s statements (%.0f ms) - budget %s", self.unit, self.statements, self.seconds * 1000,
+                QUERY_BUDGET, extra=sampled(f"budget:{self.unit}")
+            )
+        logger.debug("[QUERY] %s: %s statements, %.1f ms", self.unit, self.statements, self.seconds * 1000)
+
+
+def current_audit():
+    """Innermost active QueryAudit, or None"""
+    audits = _active.get()
+    return audits[-1] if audits else None
+
+
+def begin_unit(unit):
+    """Start auditing a unit of work; returns a token for end_unit()"""
+    audit = QueryAudit(
+        unit, max_statements=QUERY_BUDGET, max_repeats=QUERY_REPEAT_THRESHOLD, strict=QUERY_AUDIT_STRICT
+    )
+    return audit, _active.set(_active.get() + (audit,))
+
+
+def end_unit(audit, token):
+    try:
+        _active.reset(token)
+    except ValueError:
+        # Ended from another context (e.g. a teardown after a context copy) - just drop this unit
+        _active.set(tuple(active for active in _active.get() if active is not audit))
+    if audit.report_on_finish:
+        try:
+            audit.report()
+        except Exception as e:
+            logger.warning(f"[QUERY] Report for {audit.unit} failed: {e}")
+
+
+def audited(unit):
+    """Decorator for background entry points (threads) - a unit of its own unless one is already active"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not QUERY_AUDIT_ENABLED or _active.get():
+                return func(*args, **kwargs)
+            audit, token = begin_unit(unit)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_unit(audit, token)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def query_budget(max_statements=None, max_repeats=None, name="query_budget"):
+    """
+    Raise QueryBudgetExceeded as soon as the block breaks either limit (for tests) - and again
+    when the block exits, in case a route's error handling swallowed the first one
+    """
+    audit = QueryAudit(name, max_statements=max_statements, max_repeats=max_repeats, strict=True, report=False)
+    token = _active.set(_active.get() + (audit,))
+    try:
+        yield audit
+    finally:
+        _active.reset(token)
+    if audit.violation is not None:
+        raise audit.violation
+
+
+# === SECTION SEPARATOR ===
+# Hooks
+# === SECTION SEPARATOR ===
+
+def audit_engine(engine):
+    """Count and time every cursor execution against the active units of work"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _active.get():
+            conn.info.setdefault("audit_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("audit_started")
+        if not started:
+            return
+        seconds = time.perf_counter() - started.pop()
+        audits = _active.get()
+        if not audits:
+            return
+        shape = statement_shape(statement)
+        # Parameters only matter for spotting re-reads - and INSERT parameters can be megabytes
+        parameters_key = hash(repr(parameters)) if not executemany and shape[:6].upper() == "SELECT" else None
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            logger.warning("[QUERY] Slow statement in %s: %.0f ms %s", audits[0].unit, seconds * 1000, shape[:SQL_LOG_CHARS])
+        for audit in audits:
+            audit.record(shape, parameters_key, seconds)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        started = context.connection.info.get("audit_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def audit_flask(flask_app):
+    """One unit of work per request, named after its route"""
+    from flask import g, request
+
+    if not QUERY_AUDIT_ENABLED:
+        return
+
+    @flask_app.before_request
+    def _start_request_audit():
+        g.query_audit = begin_unit(f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}")
+
+    @flask_app.teardown_request
+    def _end_request_audit(error=None):
+        started = g.pop("query_audit", None)
+        if started is not None:
+            end_unit(*started)
+
+
+def audit_celery():
+    """One unit of work per task, named after the task"""
+    from celery.signals import task_prerun, task_postrun
+
+    if not QUERY_AUDIT_ENABLED:
+        return
+
+    task_audits = {}
+
+    @task_prerun.connect(weak=False)
+    def _start_task_audit(task_id=None, task=None, **kwargs):
+        _active.set(())  # never count against a unit left over from the previous task
+        task_audits[task_id] = begin_unit(f"task {task.name}")
+
+    @task_postrun.connect(weak=False)
+    def _end_task_audit(task_id=None, **kwargs):
+        started = task_audits.pop(task_id, None)
+        if started is not None:
+            end_unit(*started)
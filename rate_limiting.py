@@ -0,0 +1,162 @@
+"""
+Rate limiting helpers for the Flask app
+Shared-storage limits (Redis moving window) with a cheap in-process pre-check
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import request, jsonify
+from limits import parse as parse_limit
+
+logger = logging.getLogger(__name__)
+
+# Longest session hint we accept into a rate limit key (keeps keys bounded)
+MAX_SESSION_HINT_LENGTH = 64
+
+# Never rate limited: static files, favicons and fingerprinted assets.
+# Flask-Limiter also skips any endpoint named "static".
+EXEMPT_ENDPOINTS = frozenset({
+    'serve_static',
+    'serve_favicon',
+    'serve_fingerprinted_asset',
+})
+
+# Unauthenticated event beacons - fired several times per page view, so they get their
+# own (higher) limit instead of the default
+TRACKING_ENDPOINTS = (
+    'tracking.track_detailed_event',
+    'tracking.track_bulk_events',
+    'tracking.track_form_event',
+)
+
+
+def get_ipaddr():
+    """Get client IP address from request headers"""
+    # Check X-Forwarded-For header first (for proxies/load balancers)
+    if request.headers.get('X-Forwarded-For'):
+        # Take the first IP if multiple are present
+        ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
+    elif request.headers.get('X-Real-IP'):
+        ip = request.headers.get('X-Real-IP')
+    else:
+        ip = request.remote_addr
+    return ip or '0.0.0.0'
+
+
+def get_rate_limit_key():
+    """
+    Rate limit key: client IP plus a session hint.
+    The hint comes from the X-Session-Id header or the visitor_id cookie -
+    the request body is never parsed, so large posts cost nothing extra.
+    """
+    ip = get_ipaddr()
+
+    session_hint = request.headers.get('X-Session-Id') or request.cookies.get('visitor_id') or ''
+    session_hint = session_hint.strip()[:MAX_SESSION_HINT_LENGTH]
+
+    return f"{ip}:{session_hint}" if session_hint else ip
+
+
+def is_rate_limit_exempt():
+    """
+    True for requests no limit applies to. Registered as a Flask-Limiter request filter
+    and used by the local pre-check, so the two always agree.
+    """
+    endpoint = request.endpoint
+    return not endpoint or endpoint.split('.')[-1] == 'static' or endpoint in EXEMPT_ENDPOINTS
+
+
+class LocalRateLimitPrecheck:
+    """
+    In-process sliding window kept in front of the shared limiter storage.
+
+    Each worker only sees a subset of a client's traffic, so its local count can
+    never be higher than the shared count. When the local count alone is already
+    over the limit the request is rejected without a round trip to Redis;
+    everything else falls through to Flask-Limiter for the authoritative check.
+    Only requests that were not rejected are recorded, mirroring the moving window.
+    """
+
+    def __init__(self, limit_string, max_keys=50000):
+        item = parse_limit(limit_string)
+        self.amount = item.amount
+        self.window_seconds = item.get_expiry()
+        self.max_keys = max_keys
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, window, now):
+        cutoff = now - self.window_seconds
+        while window and window[0] <= cutoff:
+            window.popleft()
+
+    def is_over_limit(self, key):
+        """True when this worker alone has already seen a full window for the key"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._hits.get(key)
+            if not window:
+                return False
+            self._prune(window, now)
+            return len(window) >= self.amount
+
+    def record(self, key):
+        """Record an accepted request for the key"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._hits.get(key)
+            if window is None:
+                window = deque(maxlen=self.amount)
+                self._hits[key] = window
+                # Bound memory - drop the least recently seen keys first
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+            self._prune(window, now)
+            window.append(now)
+
+
+def install_local_precheck(app, limit_string, key_func, endpoint_limits=None):
+    """
+    Register the in-process pre-check on the app.
+    Must be called BEFORE the Limiter is attached so it runs ahead of the shared check.
+    Buckets are per client AND endpoint, like Flask-Limiter's default limits, so page
+    loads and API calls don't eat into each other's window. endpoint_limits maps
+    endpoints with their own @limiter.limit to that limit string.
+    """
+    default_precheck = LocalRateLimitPrecheck(limit_string)
+    endpoint_prechecks = {
+        endpoint: LocalRateLimitPrecheck(endpoint_limit)
+        for endpoint, endpoint_limit in (endpoint_limits or {}).items()
+    }
+
+    def precheck_key():
+        return f"{key_func()}|{request.endpoint}"
+
+    @app.before_request
+    def local_rate_limit_precheck():
+        if is_rate_limit_exempt():
+            return None
+        precheck = endpoint_prechecks.get(request.endpoint, default_precheck)
+        key = precheck_key()
+        if precheck.is_over_limit(key):
+            logger.warning(f"Local rate limit pre-check rejected {key}")
+            response = jsonify({"error": "Rate limit exceeded", "limit": (endpoint_limits or {}).get(request.endpoint, limit_string)})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(int(precheck.window_seconds))
+            return response
+        return None
+
+    @app.after_request
+    def local_rate_limit_record(response):
+        if response.status_code != 429 and not is_rate_limit_exempt():
+            try:
+                endpoint_prechecks.get(request.endpoint, default_precheck).record(precheck_key())
+            except Exception as e:
+                logger.debug(f"Local rate limit record skipped: {e}")
+        return response
+
+    return default_precheck
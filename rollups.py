@@ -0,0 +1,302 @@
+"""
+Incrementally maintained counters for /metrics
+Committed visitor sessions, form starts/completions, claims and leads are counted as they
+happen (session flush/commit hooks plus explicit calls from the bulk insert paths),
+buffered per process and added to per-minute, per-day and all-time metric_rollups rows
+every few seconds. /metrics reads a handful of rows instead of COUNTing visitor_sessions.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", "10"))
+MINUTE_RETENTION_HOURS = int(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48"))
+PRUNE_EVERY_FLUSHES = 60
+
+GRANULARITIES = ("minute", "day", "total")
+TOTAL_BUCKET = datetime(1970, 1, 1)
+BACKFILL_MARKER = "_backfilled"
+
+VISITS = "visits"
+FORM_STARTS = "form_starts"
+FORM_COMPLETIONS = "form_completions"
+CLAIMS = "claims"
+
+_PENDING_KEY = "rollup_pending"
+
+
+def lead_metric(lead_type):
+    """leads_dca / leads_irl / ... for a lead_ids_tracking lead_type"""
+    return "leads_" + (re.sub(r"[^a-z0-9]+", "_", (lead_type or "unknown").lower()).strip("_") or "unknown")
+
+
+def bucket_starts(moment):
+    return {
+        "minute": moment.replace(second=0, microsecond=0),
+        "day": moment.replace(hour=0, minute=0, second=0, microsecond=0),
+        "total": TOTAL_BUCKET,
+    }
+
+
+# === SECTION SEPARATOR ===
+# Process-wide buffer
+# === SECTION SEPARATOR ===
+
+class RollupBuffer:
+    """
+    Counter deltas waiting to be written, keyed (granularity, bucket_start, metric).
+    One sorted upsert per flush keeps the hot all-time rows out of request transactions
+    and takes row locks in the same order in every process.
+    """
+
+    def __init__(self):
+        self._deltas = Counter()
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._flushes = 0
+
+    def add(self, counts, moment=None):
+        """counts: {metric: n} that happened at moment (default now, UTC)"""
+        counts = {metric: n for metric, n in counts.items() if n}
+        if not counts:
+            return
+        buckets = bucket_starts(moment or datetime.utcnow())
+        with self._lock:
+            for metric, n in counts.items():
+                for granularity in GRANULARITIES:
+                    self._deltas[(granularity, buckets[granularity], metric)] += n
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+                self._flusher.start()
+                atexit.register(self._flush_at_exit)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[ROLLUP] Flush failed: {e}")
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"[ROLLUP] Final flush failed - counts lost: {e}")
+
+    def flush(self):
+        """Write buffered deltas; on failure they're put back for the next flush"""
+        with self._lock:
+            if not self._deltas:
+                return 0
+            deltas, self._deltas = self._deltas, Counter()
+
+        try:
+            from app import engine
+            with engine.begin() as conn:
+                upsert_rollups(conn, deltas)
+                self._flushes += 1
+                if self._flushes % PRUNE_EVERY_FLUSHES == 0:
+                    prune_minute_rollups(conn)
+        except Exception:
+            with self._lock:
+                self._deltas.update(deltas)
+            raise
+        return len(deltas)
+
+
+rollup_buffer = RollupBuffer()
+
+
+# === SECTION SEPARATOR ===
+# Storage
+# === SECTION SEPARATOR ===
+
+def _dialect_insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def upsert_rollups(conn, deltas):
+    """Add {(granularity, bucket_start, metric): n} onto metric_rollups"""
+    from app import MetricRollup
+
+    table = MetricRollup.__table__
+    now = datetime.utcnow()
+    rows = [
+        {"granularity": granularity, "bucket_start": bucket_start, "metric": metric, "value": n, "updated_at": now}
+        for (granularity, bucket_start, metric), n in sorted(deltas.items())
+    ]
+    statement = _dialect_insert(conn)(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["granularity", "bucket_start", "metric"],
+        set_={"value": table.c.value + statement.excluded.value, "updated_at": statement.excluded.updated_at}
+    )
+    conn.execute(statement, rows)
+
+
+def prune_minute_rollups(conn):
+    from app import MetricRollup
+
+    cutoff = datetime.utcnow() - timedelta(hours=MINUTE_RETENTION_HOURS)
+    conn.execute(
+        MetricRollup.__table__.delete().where(
+            MetricRollup.granularity == "minute",
+            MetricRollup.bucket_start < cutoff
+        )
+    )
+
+
+def read_rollups(session_db, day=None):
+    """{"total": {metric: n}, "today": {metric: n}} from the all-time rows and one day's rows"""
+    from sqlalchemy import or_, and_
+    from app import MetricRollup
+
+    day_start = bucket_starts(datetime.utcnow() if day is None else datetime.combine(day, datetime.min.time()))["day"]
+    rows = session_db.query(MetricRollup.granularity, MetricRollup.metric, MetricRollup.value).filter(
+        or_(
+            MetricRollup.granularity == "total",
+            and_(MetricRollup.granularity == "day", MetricRollup.bucket_start == day_start)
+        )
+    ).all()
+
+    result = {"total": {}, "today": {}}
+    for granularity, metric, value in rows:
+        if metric.startswith("_"):
+            continue
+        result["total" if granularity == "total" else "today"][metric] = value
+    return result
+
+
+# === SECTION SEPARATOR ===
+# Counting hooks
+# === SECTION SEPARATOR ===
+
+def count_pending(session_db, counts):
+    """Count {metric: n} when session_db's transaction commits (for Core / bulk inserts)"""
+    pending = session_db.info.setdefault(_PENDING_KEY, Counter())
+    pending.update(counts)
+
+
+def _became_true(obj, attribute):
+    from sqlalchemy import inspect
+    history = inspect(obj).attrs[attribute].history
+    return list(history.added) == [True] and list(history.deleted) != [True]
+
+
+def _before_flush(session_db, flush_context, instances):
+    from app import ClaimTracking, LeadIDTracking
+    from tracking_models import VisitorSession
+
+    counts = Counter()
+    for obj in session_db.new:
+        if isinstance(obj, VisitorSession):
+            counts[VISITS] += 1
+            counts[FORM_STARTS] += 1 if obj.form_started else 0
+            counts[FORM_COMPLETIONS] += 1 if obj.form_completed else 0
+        elif isinstance(obj, ClaimTracking):
+            counts[CLAIMS] += 1
+        elif isinstance(obj, LeadIDTracking):
+            counts[lead_metric(obj.lead_type)] += 1
+
+    for obj in session_db.dirty:
+        if isinstance(obj, VisitorSession):
+            counts[FORM_STARTS] += 1 if _became_true(obj, "form_started") else 0
+            counts[FORM_COMPLETIONS] += 1 if _became_true(obj, "form_completed") else 0
+
+    if +counts:
+        count_pending(session_db, +counts)
+
+
+def _after_commit(session_db):
+    pending = session_db.info.pop(_PENDING_KEY, None)
+    if pending:
+        rollup_buffer.add(pending)
+
+
+def _after_transaction_end(session_db, transaction):
+    # Runs after _after_commit; anything still pending here was rolled back or abandoned
+    if transaction.parent is None:
+        session_db.info.pop(_PENDING_KEY, None)
+
+
+def install_rollup_hooks(session_factory):
+    """Count committed changes made through sessions from session_factory"""
+    from sqlalchemy import event
+    from tracking_models import VisitorSession
+
+    # Load the old value on set (even after expiry) so re-setting True isn't counted twice
+    for attribute in (VisitorSession.form_started, VisitorSession.form_completed):
+        event.listen(attribute, "set", lambda target, value, oldvalue, initiator: None, active_history=True)
+    event.listen(session_factory, "before_flush", _before_flush)
+    event.listen(session_factory, "after_commit", _after_commit)
+    event.listen(session_factory, "after_transaction_end", _after_transaction_end)
+
+
+# === SECTION SEPARATOR ===
+# Backfill
+# === SECTION SEPARATOR ===
+
+def _day(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d")
+    return datetime(value.year, value.month, value.day)
+
+
+def backfill_rollups(session_db):
+    """
+    One-off: day and all-time rows for everything recorded before the counters existed.
+    Skipped once the marker row exists. Returns the number of rows written.
+    """
+    from sqlalchemy import func
+    from app import MetricRollup, ClaimTracking, LeadIDTracking
+    from tracking_models import VisitorSession
+
+    if session_db.query(MetricRollup.id).filter_by(granularity="total", metric=BACKFILL_MARKER).first():
+        return 0
+
+    cutoff = datetime.utcnow()
+    deltas = Counter()
+
+    def add_grouped(metric, day_column, *filters, group_by=None):
+        columns = [func.date(day_column)] + ([group_by] if group_by is not None else [])
+        query = session_db.query(*columns, func.count()).filter(day_column < cutoff, *filters).group_by(*columns)
+        for row in query:
+            day, count = row[0], row[-1]
+            if day is None:
+                continue
+            name = lead_metric(row[1]) if group_by is not None else metric
+            deltas[("day", _day(day), name)] += count
+            deltas[("total", TOTAL_BUCKET, name)] += count
+
+    add_grouped(VISITS, VisitorSession.first_visit)
+    add_grouped(FORM_STARTS, VisitorSession.first_visit, VisitorSession.form_started == True)
+    add_grouped(
+        FORM_COMPLETIONS,
+        func.coalesce(VisitorSession.conversion_timestamp, VisitorSession.first_visit),
+        VisitorSession.form_completed == True
+    )
+    add_grouped(CLAIMS, ClaimTracking.created_at)
+    add_grouped(None, LeadIDTracking.created_at, group_by=LeadIDTracking.lead_type)
+
+    deltas[("total", TOTAL_BUCKET, BACKFILL_MARKER)] = 1
+    upsert_rollups(session_db.connection(), deltas)
+    session_db.commit()
+    logger.info(f"[ROLLUP] Backfilled {len(deltas)} rollup rows from existing data (before {cutoff.isoformat()})")
+    return len(deltas)
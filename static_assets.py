@@ -0,0 +1,177 @@
+"""
+Fingerprinted / precompressed static asset serving
+Reads the manifest written by build_assets.py and serves the best encoding per request
+"""
+import json
+import logging
+import mimetypes
+import os
+import threading
+
+from flask import request, send_file, send_from_directory, abort
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DIST_DIR = os.path.join(ROOT_DIR, 'static', 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Text formats that are worth shipping gzip/brotli variants for
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.webmanifest', '.html', '.xml', '.txt', '.ico'}
+
+# Cache lifetimes
+IMMUTABLE_MAX_AGE = 31536000  # 1 year - fingerprinted URLs never change
+MUTABLE_MAX_AGE = 3600  # 1 hour - plain URLs revalidate via ETag
+
+# Types the stdlib mimetypes table gets wrong or does not know
+EXTRA_MIME_TYPES = {
+    '.js': 'application/javascript',
+    '.webmanifest': 'application/manifest+json',
+    '.ico': 'image/x-icon',
+    '.svg': 'image/svg+xml',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+}
+
+# Preference order when the client accepts several encodings
+ENCODING_PREFERENCE = ('br', 'gzip')
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def guess_mimetype(filename):
+    """MIME type for a filename (handles the web types stdlib misses)"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in EXTRA_MIME_TYPES:
+        return EXTRA_MIME_TYPES[ext]
+    if os.path.basename(filename) == 'site.webmanifest':
+        return EXTRA_MIME_TYPES['.webmanifest']
+    mimetype, _ = mimetypes.guess_type(filename)
+    return mimetype or 'application/octet-stream'
+
+
+def negotiate_encoding(accept_encoding, available):
+    """
+    Pick the best content-coding the client accepts from those available.
+    Returns 'br', 'gzip' or None (identity).
+    """
+    if not accept_encoding or not available:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > 0:
+            return coding
+    return None
+
+
+class AssetManifest:
+    """Lazy view of static/dist/manifest.json"""
+
+    def __init__(self, path=MANIFEST_PATH, auto_reload=False):
+        self.path = path
+        self.auto_reload = auto_reload
+        self._entries = None
+        self._by_file = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+
+        if self._entries is not None and (not self.auto_reload or mtime == self._mtime):
+            return
+
+        with self._lock:
+            entries = {}
+            if mtime is not None:
+                try:
+                    with open(self.path) as f:
+                        entries = json.load(f)
+                    logger.info(f"Loaded asset manifest: {len(entries)} assets")
+                except Exception as e:
+                    logger.error(f"Failed to load asset manifest {self.path}: {e}")
+            self._entries = entries
+            self._by_file = {entry["file"]: entry for entry in entries.values()}
+            self._mtime = mtime
+
+    def get(self, logical):
+        """Manifest entry for a logical URL path like /js/app.js"""
+        self._load()
+        return self._entries.get(logical)
+
+    def get_by_file(self, fingerprinted):
+        """Manifest entry for a fingerprinted dist path like js/app.1a2b3c4d5e6f.js"""
+        self._load()
+        return self._by_file.get(fingerprinted)
+
+    def url(self, logical):
+        """Template helper - fingerprinted URL when built, original URL otherwise"""
+        entry = self.get(logical)
+        if entry:
+            return f"/assets/{entry['file']}"
+        return logical
+
+
+def send_manifest_entry(entry, immutable):
+    """Send a built asset, choosing the precompressed variant the client accepts"""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), entry.get("encodings", {}))
+    path = os.path.join(DIST_DIR, entry["file"])
+    if encoding:
+        path += ENCODING_SUFFIXES[encoding]
+
+    if not os.path.isfile(path):
+        abort(404)
+
+    # Strong ETag: content hash plus the coding actually sent
+    etag = f"{entry['hash']}-{encoding}" if encoding else entry['hash']
+    response = send_file(
+        path,
+        mimetype=entry.get("content_type") or guess_mimetype(entry["file"]),
+        etag=etag,
+        conditional=True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else MUTABLE_MAX_AGE,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={MUTABLE_MAX_AGE}'
+    return response
+
+
+def serve_static_file(manifest, directory, filename, url_prefix):
+    """
+    Serve a file requested by its plain URL.
+    Uses the built (minified + precompressed) copy when the manifest has one,
+    otherwise falls back to the source file with a correct MIME type.
+    """
+    entry = manifest.get(f"{url_prefix}/{filename}")
+    if entry:
+        return send_manifest_entry(entry, immutable=False)
+
+    response = send_from_directory(directory, filename, mimetype=guess_mimetype(filename), max_age=MUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={MUTABLE_MAX_AGE}'
+    return response
@@ -0,0 +1,456 @@
+"""
+Indexes, partitioning and retention for the two append-heavy tables
+webhook_logs gets a row (full request/response body) per FLG callback and lead_ids_tracking a
+row per lead. This module keeps their indexes on the real access paths, converts webhook_logs
+into monthly range partitions on created_at, and archives/drops old webhook log months.
+
+    python app.py migrate-log-tables     # indexes + one-off partition conversion (safe while live)
+    python app.py maintain-log-tables    # create upcoming partitions, archive and drop expired ones
+
+The migration never holds a long lock: indexes are built CONCURRENTLY, the existing table is
+kept as-is and attached as the partition for everything before the cutover month (a validated
+CHECK constraint lets ATTACH skip its scan), and the only ACCESS EXCLUSIVE locks are brief
+renames and the attach. Every DDL lock is requested under DDL_LOCK_TIMEOUT_MS and retried, so
+behind a long transaction inserts stall for at most that long instead of queueing with it.
+PostgreSQL only - on other databases (local sqlite) every function here is a no-op.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_LOG_RETENTION_DAYS = int(os.getenv("WEBHOOK_LOG_RETENTION_DAYS", "365"))
+# Archive expired webhook logs to S3 (AWS_S3_BUCKET) before dropping them; nothing is dropped if the upload fails
+WEBHOOK_LOG_ARCHIVE = os.getenv("WEBHOOK_LOG_ARCHIVE", "true").lower() == "true"
+WEBHOOK_LOG_ARCHIVE_PREFIX = os.getenv("WEBHOOK_LOG_ARCHIVE_PREFIX", "archive/webhook_logs")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+DDL_LOCK_TIMEOUT_MS = int(os.getenv("DDL_LOCK_TIMEOUT_MS", "1000"))
+DDL_ATTEMPTS = 10
+DELETE_BATCH = 5000
+
+WEBHOOK_LOGS = "webhook_logs"
+STAGING_TABLE = "webhook_logs_partitioned"
+LEGACY_PARTITION = "webhook_logs_legacy"
+DEFAULT_PARTITION = "webhook_logs_default"
+CUTOVER_CONSTRAINT = "webhook_logs_legacy_before_cutover"
+LOCK_NOT_AVAILABLE = "55P03"
+
+# (table, index name, columns) - the same indexes are declared on the models for fresh databases
+INDEXES = (
+    ("lead_ids_tracking", "ix_lead_ids_tracking_claim_id", ("claim_id",)),
+    ("lead_ids_tracking", "ix_lead_ids_tracking_lead_group_status", ("lead_group", "current_status")),
+    (WEBHOOK_LOGS, "ix_webhook_logs_lead_id_created_at", ("lead_id", "created_at")),
+    (WEBHOOK_LOGS, "ix_webhook_logs_lead_group_status", ("lead_group", "status_received", "created_at")),
+)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"webhook_logs_p{month.year:04d}_{month.month:02d}"
+
+
+def _is_postgres(engine):
+    return engine.dialect.name == "postgresql"
+
+
+# === SECTION SEPARATOR ===
+# Lock-safe DDL
+# === SECTION SEPARATOR ===
+
+def _lock_not_available(error):
+    return getattr(getattr(error, "orig", None), "pgcode", None) == LOCK_NOT_AVAILABLE
+
+
+def run_ddl(engine, *statements):
+    """
+    Run statements in one short transaction under lock_timeout. A lock that isn't granted in
+    time (a long transaction holds the table) aborts the attempt instead of queueing every
+    other query behind it; the attempt is retried with backoff.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    for attempt in range(1, DDL_ATTEMPTS + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = {DDL_LOCK_TIMEOUT_MS}"))
+                conn.execute(text("SET LOCAL statement_timeout = 0"))
+                for statement in statements:
+                    conn.execute(text(statement))
+            return
+        except OperationalError as e:
+            if not _lock_not_available(e) or attempt == DDL_ATTEMPTS:
+                raise
+            logger.warning(f"[SCHEMA] Lock not granted (attempt {attempt}/{DDL_ATTEMPTS}), retrying: {statements[0][:120]}")
+            time.sleep(min(30, 2 ** attempt))
+
+
+def _autocommit(engine):
+    """Connection outside a transaction block, as CREATE INDEX CONCURRENTLY needs"""
+    from sqlalchemy import text
+
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    conn.execute(text("SET statement_timeout = 0"))
+    conn.execute(text(f"SET lock_timeout = {DDL_LOCK_TIMEOUT_MS}"))
+    return conn
+
+
+def relkind(conn, table):
+    """'r' plain table, 'p' partitioned table, None when it doesn't exist"""
+    from sqlalchemy import text
+
+    return conn.execute(
+        text("SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(:table)"), {"table": table}
+    ).scalar()
+
+
+def _index_state(conn, name):
+    """True valid, False left invalid by an interrupted CONCURRENTLY build, None missing"""
+    from sqlalchemy import text
+
+    return conn.execute(
+        text("SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+
+
+def create_index_concurrently(engine, table, name, columns):
+    """Build an index without blocking writes; an invalid leftover from an earlier attempt is rebuilt"""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    with _autocommit(engine) as conn:
+        state = _index_state(conn, name)
+        if state:
+            return False
+        for attempt in range(1, DDL_ATTEMPTS + 1):
+            try:
+                if state is False:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                started = time.monotonic()
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+                logger.info(f"[SCHEMA] Built {name} on {table} in {time.monotonic() - started:.1f}s")
+                return True
+            except OperationalError as e:
+                if not _lock_not_available(e) or attempt == DDL_ATTEMPTS:
+                    raise
+                state = _index_state(conn, name)
+                logger.warning(f"[SCHEMA] Lock not granted building {name} (attempt {attempt}/{DDL_ATTEMPTS}), retrying")
+                time.sleep(min(30, 2 ** attempt))
+
+
+def ensure_indexes(engine):
+    """Create missing INDEXES (partitioned webhook_logs already has them from the conversion)"""
+    if not _is_postgres(engine):
+        return []
+    created = []
+    for table, name, columns in INDEXES:
+        with engine.connect() as conn:
+            kind = relkind(conn, table)
+        if kind != "r":
+            continue
+        if create_index_concurrently(engine, table, name, columns):
+            created.append(name)
+    return created
+
+
+# === SECTION SEPARATOR ===
+# webhook_logs partitioning
+# === SECTION SEPARATOR ===
+
+def _cutover(conn):
+    """Cutover month recorded in the legacy CHECK constraint by an earlier, interrupted run"""
+    from sqlalchemy import text
+
+    definition = conn.execute(
+        text("SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conname = :name"), {"name": CUTOVER_CONSTRAINT}
+    ).scalar()
+    match = re.search(r"'(\d{4}-\d{2}-\d{2})", definition or "")
+    return date.fromisoformat(match.group(1)) if match else None
+
+
+def _create_partition(engine, parent, month):
+    upper = add_months(month, 1)
+    run_ddl(
+        engine,
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+    )
+
+
+def partition_webhook_logs(engine, today=None):
+    """
+    Turn webhook_logs into a table partitioned by month of created_at, online. Resumable: every
+    step checks what an earlier run already did. Returns False when there was nothing to do.
+    """
+    from sqlalchemy import text
+
+    if not _is_postgres(engine):
+        return False
+    today = today or datetime.utcnow().date()
+    with engine.connect() as conn:
+        if relkind(conn, WEBHOOK_LOGS) == "p":
+            return False
+        cutover = _cutover(conn)
+
+    if cutover is not None and cutover - today < timedelta(days=7):
+        # An interrupted run left a constraint that will soon reject new rows - start again
+        logger.warning(f"[SCHEMA] Restarting the {WEBHOOK_LOGS} conversion: cutover {cutover} is too close")
+        run_ddl(
+            engine,
+            f"ALTER TABLE {WEBHOOK_LOGS} DROP CONSTRAINT {CUTOVER_CONSTRAINT}",
+            f"DROP TABLE IF EXISTS {STAGING_TABLE}"
+        )
+        cutover = None
+    # Two month boundaries ahead, so rows written while the migration runs stay before it
+    cutover = cutover or add_months(month_start(today), 2)
+    logger.info(f"[SCHEMA] Partitioning {WEBHOOK_LOGS}: existing rows stay in {LEGACY_PARTITION} up to {cutover}")
+
+    # 1. Every existing row provably before the cutover. NOT VALID adds the constraint without a
+    #    scan; VALIDATE scans under SHARE UPDATE EXCLUSIVE, so inserts carry on meanwhile.
+    with engine.connect() as conn:
+        if _cutover(conn) is None:
+            run_ddl(engine, f"UPDATE {WEBHOOK_LOGS} SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+            run_ddl(
+                engine,
+                f"ALTER TABLE {WEBHOOK_LOGS} ADD CONSTRAINT {CUTOVER_CONSTRAINT} "
+                f"CHECK (created_at IS NOT NULL AND created_at < '{cutover.isoformat()}') NOT VALID"
+            )
+    run_ddl(engine, f"ALTER TABLE {WEBHOOK_LOGS} VALIDATE CONSTRAINT {CUTOVER_CONSTRAINT}")
+
+    # 2. The old table's copies of the parent indexes, built online under their legacy names,
+    #    so ATTACH adopts them instead of building them under its lock
+    for _, name, columns in (index for index in INDEXES if index[0] == WEBHOOK_LOGS):
+        legacy_name = name.replace(WEBHOOK_LOGS, LEGACY_PARTITION, 1)
+        with engine.connect() as conn:
+            existing = _index_state(conn, name)
+        if existing:
+            run_ddl(engine, f"ALTER INDEX {name} RENAME TO {legacy_name}")
+            continue
+        if existing is False:
+            with _autocommit(engine) as conn:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        create_index_concurrently(engine, WEBHOOK_LOGS, legacy_name, columns)
+
+    # 3. The new parent (same columns and id sequence), its indexes and partitions - all empty
+    with engine.connect() as conn:
+        staging_exists = relkind(conn, STAGING_TABLE) is not None
+    if not staging_exists:
+        statements = [
+            f"CREATE TABLE {STAGING_TABLE} (LIKE {WEBHOOK_LOGS} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)",
+            f"ALTER TABLE {STAGING_TABLE} ALTER COLUMN created_at SET NOT NULL",
+            f"ALTER TABLE {STAGING_TABLE} ALTER COLUMN created_at SET DEFAULT (now() AT TIME ZONE 'utc')",
+        ]
+        statements += [
+            f"CREATE INDEX {name.replace(WEBHOOK_LOGS, STAGING_TABLE, 1)} ON {STAGING_TABLE} ({', '.join(columns)})"
+            for table, name, columns in INDEXES if table == WEBHOOK_LOGS
+        ]
+        statements.append(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {STAGING_TABLE} DEFAULT")
+        run_ddl(engine, *statements)
+    month = cutover
+    while month <= add_months(month_start(today), PARTITION_MONTHS_AHEAD):
+        _create_partition(engine, STAGING_TABLE, month)
+        month = add_months(month, 1)
+
+    # 4. The swap: brief ACCESS EXCLUSIVE on webhook_logs for renames and a scan-free ATTACH
+    swap = [
+        f"LOCK TABLE {WEBHOOK_LOGS} IN ACCESS EXCLUSIVE MODE",
+        # Scan-free: the validated CHECK constraint already proves it (PostgreSQL 12+)
+        f"ALTER TABLE {WEBHOOK_LOGS} ALTER COLUMN created_at SET NOT NULL",
+        f"ALTER TABLE {WEBHOOK_LOGS} RENAME TO {LEGACY_PARTITION}",
+        f"ALTER TABLE {STAGING_TABLE} RENAME TO {WEBHOOK_LOGS}",
+    ]
+    swap += [
+        f"ALTER INDEX {name.replace(WEBHOOK_LOGS, STAGING_TABLE, 1)} RENAME TO {name}"
+        for table, name, columns in INDEXES if table == WEBHOOK_LOGS
+    ]
+    swap += [
+        # The id sequence must outlive the legacy partition when it's eventually dropped
+        f"ALTER SEQUENCE IF EXISTS {WEBHOOK_LOGS}_id_seq OWNED BY {WEBHOOK_LOGS}.id",
+        f"ALTER TABLE {WEBHOOK_LOGS} ATTACH PARTITION {LEGACY_PARTITION} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{cutover.isoformat()}')",
+    ]
+    run_ddl(engine, *swap)
+    logger.info(f"[SCHEMA] {WEBHOOK_LOGS} is now partitioned by month from {cutover}")
+    with _autocommit(engine) as conn:
+        conn.execute(text(f"ANALYZE {WEBHOOK_LOGS}"))
+    return True
+
+
+def partitions(conn):
+    """[(name, lower, upper)] of webhook_logs' monthly partitions; the legacy one has lower None"""
+    from sqlalchemy import text
+
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:parent)"
+    ), {"parent": WEBHOOK_LOGS}).all()
+    result = []
+    for name, bound in rows:
+        dates = re.findall(r"'(\d{4}-\d{2}-\d{2})", bound or "")
+        if name == DEFAULT_PARTITION or not dates:
+            continue
+        lower = date.fromisoformat(dates[0]) if len(dates) == 2 else None
+        result.append((name, lower, date.fromisoformat(dates[-1])))
+    return sorted(result, key=lambda item: item[2])
+
+
+def ensure_partitions(engine, months_ahead=None):
+    """Create this month's and the next months_ahead months' partitions (once partitioned)"""
+    if not _is_postgres(engine):
+        return []
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with engine.connect() as conn:
+        if relkind(conn, WEBHOOK_LOGS) != "p":
+            return []
+        current = partitions(conn)
+    existing = {name for name, _, _ in current}
+    legacy_upper = max((upper for name, lower, upper in current if lower is None), default=None)
+    created = []
+    this_month = month_start(datetime.utcnow().date())
+    for offset in range(months_ahead + 1):
+        month = add_months(this_month, offset)
+        if (legacy_upper and month < legacy_upper) or partition_name(month) in existing:
+            continue
+        try:
+            _create_partition(engine, WEBHOOK_LOGS, month)
+            created.append(partition_name(month))
+        except Exception as e:
+            # Typically rows for that month already landed in the default partition
+            logger.error(f"[SCHEMA] Could not create partition {partition_name(month)}: {e}")
+    if created:
+        logger.info(f"[SCHEMA] Created {WEBHOOK_LOGS} partitions: {', '.join(created)}")
+    return created
+
+
+# === SECTION SEPARATOR ===
+# Retention and archival
+# === SECTION SEPARATOR ===
+
+def _archive(engine, key, query, params=None):
+    """Stream query's rows as gzipped JSON lines to S3 under key; returns the row count"""
+    from sqlalchemy import text
+    from app import Config, get_s3_client
+
+    s3_client = get_s3_client()
+    if s3_client is None or not Config.AWS_S3_BUCKET:
+        raise RuntimeError("S3 is not configured - set WEBHOOK_LOG_ARCHIVE=false to drop without archiving")
+
+    rows = 0
+    with tempfile.TemporaryFile() as spool:
+        with gzip.GzipFile(fileobj=spool, mode="wb") as archive:
+            with engine.connect() as conn:
+                conn.execute(text("SET statement_timeout = 0"))
+                result = conn.execution_options(stream_results=True).execute(text(query), params or {})
+                for row in result.mappings():
+                    archive.write(json.dumps(dict(row), default=str).encode("utf-8") + b"\n")
+                    rows += 1
+        spool.seek(0)
+        s3_client.upload_fileobj(spool, Config.AWS_S3_BUCKET, f"{WEBHOOK_LOG_ARCHIVE_PREFIX}/{key}.jsonl.gz")
+    logger.info(f"[SCHEMA] Archived {rows} webhook log rows to s3://{Config.AWS_S3_BUCKET}/{WEBHOOK_LOG_ARCHIVE_PREFIX}/{key}.jsonl.gz")
+    return rows
+
+
+def _drop_partition(engine, name):
+    """
+    Detach then drop. DETACH ... CONCURRENTLY isn't allowed alongside a default partition, so
+    this is a plain (instant) detach under lock_timeout
+    """
+    run_ddl(engine, f"ALTER TABLE {WEBHOOK_LOGS} DETACH PARTITION {name}")
+    run_ddl(engine, f"DROP TABLE {name}")
+
+
+def _delete_expired_prefix(engine, table, cutoff, archive):
+    """
+    Delete rows older than cutoff from the oldest end of table in DELETE_BATCH chunks (ids grow
+    with created_at, so expired rows are a prefix of the primary key and no scan is needed)
+    """
+    from sqlalchemy import text
+
+    deleted = 0
+    while True:
+        batch = (
+            f"SELECT id, created_at FROM {table} WHERE id IN "
+            f"(SELECT id FROM {table} ORDER BY id LIMIT {DELETE_BATCH}) AND created_at < :cutoff"
+        )
+        with engine.connect() as conn:
+            bounds = conn.execute(text(f"SELECT min(id), max(id), count(*) FROM ({batch}) expired"), {"cutoff": cutoff}).one()
+        first_id, last_id, count = bounds
+        if not count:
+            return deleted
+        params = {"cutoff": cutoff, "first_id": first_id, "last_id": last_id}
+        if archive:
+            _archive(
+                engine, f"{table}/{first_id}-{last_id}",
+                f"SELECT * FROM {table} WHERE id BETWEEN :first_id AND :last_id AND created_at < :cutoff ORDER BY id",
+                params
+            )
+        with engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {table} WHERE id BETWEEN :first_id AND :last_id AND created_at < :cutoff"), params)
+        deleted += count
+        if count < DELETE_BATCH:
+            return deleted
+
+
+def apply_webhook_log_retention(engine, retention_days=None, archive=None):
+    """
+    Archive (optionally) and remove webhook logs older than retention_days: whole monthly
+    partitions once their last day has expired, batched deletes for the legacy partition or
+    an unpartitioned table. Returns {"dropped": [...], "deleted": n}.
+    """
+    retention_days = WEBHOOK_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    archive = WEBHOOK_LOG_ARCHIVE if archive is None else archive
+    summary = {"dropped": [], "deleted": 0}
+    if not _is_postgres(engine) or retention_days <= 0:
+        return summary
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    with engine.connect() as conn:
+        kind = relkind(conn, WEBHOOK_LOGS)
+        expiring = partitions(conn) if kind == "p" else []
+    if kind == "r":
+        summary["deleted"] = _delete_expired_prefix(engine, WEBHOOK_LOGS, cutoff, archive)
+        return summary
+
+    for name, lower, upper in expiring:
+        if datetime.combine(upper, datetime.min.time()) > cutoff:
+            if lower is None:
+                summary["deleted"] += _delete_expired_prefix(engine, name, cutoff, archive)
+            continue
+        if archive:
+            _archive(engine, name, f"SELECT * FROM {name}")
+        _drop_partition(engine, name)
+        summary["dropped"].append(name)
+        logger.info(f"[SCHEMA] Dropped expired webhook log partition {name}")
+    return summary
+
+
+# === SECTION SEPARATOR ===
+# Entry points
+# === SECTION SEPARATOR ===
+
+def migrate_log_tables(engine):
+    """One-off (idempotent) migration: access-path indexes, then partition webhook_logs"""
+    created = ensure_indexes(engine)
+    partitioned = partition_webhook_logs(engine)
+    return {"indexes_created": created, "partitioned": partitioned, "partitions_created": ensure_partitions(engine)}
+
+
+def maintain_log_tables(engine):
+    """Daily job: upcoming partitions, then retention"""
+    created = ensure_partitions(engine)
+    retention = apply_webhook_log_retention(engine)
+    return {"partitions_created": created, **retention}
@@ -3,15 +3,19 @@ Celery tasks for background FLG lead processing
 Platform-agnostic: Works on Railway Redis AND AWS SQS
 """
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from kombu import Queue, Exchange
 import os
+import sys
 import logging
 from datetime import datetime
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from log_config import configure_logging
+from tracing import trace_celery
+from query_audit import audit_celery
+
+# Setup logging (queued handler, LOG_LEVEL / LOG_LEVELS / LOG_FORMAT)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # ============================================================================
@@ -28,7 +32,12 @@ if REDIS_URL:
     # Railway configuration (current)
     broker_url = REDIS_URL
     backend_url = REDIS_URL
-    broker_transport_options = {}
+    # Redis emulates message priority with one sub-queue per priority step - 0 is served first
+    broker_transport_options = {
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    }
     logger.info("✓ Celery configured for Railway Redis")
 elif AWS_REGION:
     # AWS configuration (future migration)
@@ -45,9 +54,99 @@ else:
     # Local development fallback
     broker_url = 'redis://localhost:6379/0'
     backend_url = 'redis://localhost:6379/0'
-    broker_transport_options = {}
+    broker_transport_options = {
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    }
     logger.info("✓ Celery configured for local Redis (development)")
 
+# ============================================================================
+# QUEUES / LANES
+# live    - website submissions waiting on lead IDs (never behind a batch)
+# batch   - batch imports (skipFLG claims, chunks)
+# webhook - outbound webhook calls (slow third parties stay off the lead lanes)
+# flg_processing is the old single queue - live workers keep draining it
+# ============================================================================
+
+LEGACY_QUEUE = 'flg_processing'
+
+# Redis transport priorities: LOWER is served first (0-9). SQS ignores them.
+LANES = {
+    'live': {'queue': 'live', 'priority': 0},
+    'webhook': {'queue': 'webhook', 'priority': 3},
+    'batch': {'queue': 'batch', 'priority': 6},
+}
+
+# lead_source values (claims_tracking.lead_source / summary "source") that go to the batch lane
+BATCH_LEAD_SOURCES = ('batch_import', 'batch', 'bulk', 'import')
+
+# Worker pool profile per lane: python tasks.py <profile> (see Procfile)
+WORKER_PROFILES = {
+    'live': {
+        'queues': ['live', LEGACY_QUEUE],
+        'concurrency': int(os.getenv('LIVE_WORKER_CONCURRENCY', '8')),
+        'prefetch_multiplier': 1,
+        'max_tasks_per_child': 100,
+    },
+    'batch': {
+        'queues': ['batch'],
+        'concurrency': int(os.getenv('BATCH_WORKER_CONCURRENCY', '4')),
+        'prefetch_multiplier': 1,
+        'max_tasks_per_child': 20,  # chunk tasks are long - recycle by task count sooner
+    },
+    'webhook': {
+        'queues': ['webhook'],
+        'concurrency': int(os.getenv('WEBHOOK_WORKER_CONCURRENCY', '16')),
+        'prefetch_multiplier': 4,  # short I/O-bound tasks
+        'max_tasks_per_child': 1000,
+    },
+    # Single worker for everything (local development / small deployments)
+    'all': {
+        'queues': ['live', LEGACY_QUEUE, 'webhook', 'batch'],
+        'concurrency': 4,
+        'prefetch_multiplier': 1,
+        'max_tasks_per_child': 100,
+    },
+}
+
+
+def select_lane(lead_source=None):
+    """Lane name for a claim's lead_source - anything that is not a batch import is live"""
+    if lead_source and str(lead_source).lower() in BATCH_LEAD_SOURCES:
+        return 'batch'
+    return 'live'
+
+
+def select_queue(lead_source=None, priority=None):
+    """
+    apply_async routing options for a lead_source.
+    Usage: task.apply_async(args=..., **select_queue(summary.get("source")))
+    """
+    lane = LANES[select_lane(lead_source)]
+    return {'queue': lane['queue'], 'priority': lane['priority'] if priority is None else priority}
+
+
+def lane_options(lane, priority=None):
+    """apply_async routing options for a named lane"""
+    options = LANES[lane]
+    return {'queue': options['queue'], 'priority': options['priority'] if priority is None else priority}
+
+
+def worker_argv(profile):
+    """celery worker arguments for a WORKER_PROFILES entry"""
+    options = WORKER_PROFILES[profile]
+    return [
+        'worker',
+        '--loglevel=info',
+        f"--queues={','.join(options['queues'])}",
+        f"--concurrency={options['concurrency']}",
+        f"--prefetch-multiplier={options['prefetch_multiplier']}",
+        f"--max-tasks-per-child={options['max_tasks_per_child']}",
+        f"--hostname={profile}@%h",
+    ]
+
+
 # Initialize Celery
 celery_app = Celery(
     'flg_processor',
@@ -87,16 +186,87 @@ celery_app.conf.update(
     broker_connection_max_retries=10,
     broker_transport_options=broker_transport_options,
     
-    # Task routing
-    task_default_queue='flg_processing',
-    task_default_exchange='flg_processing',
-    task_default_routing_key='flg.process',
+    # Task routing - one direct exchange per lane (see LANES)
+    task_queues=[
+        Queue(name, Exchange(name, type='direct'), routing_key=name)
+        for name in ('live', 'batch', 'webhook', LEGACY_QUEUE)
+    ],
+    task_default_queue='live',
+    task_default_exchange='live',
+    task_default_routing_key='live',
+    task_routes={
+        'tasks.process_flg_leads_async': {'queue': 'live'},
+        'tasks.process_batch_record_async': {'queue': 'batch'},
+        'tasks.process_batch_chunk_async': {'queue': 'batch'},
+        'tasks.process_flg_leads_chunk_async': {'queue': 'batch'},
+        'tasks.send_webhook_async': {'queue': 'webhook'},
+        'tasks.drain_webhook_outbox': {'queue': 'webhook'},
+        'tasks.health_check': {'queue': 'live'},
+    },
+    
+    # Priority (0-9, 0 first on Redis) - used within a queue; lanes are the main isolation
+    task_default_priority=5,
     
     # Worker settings
     worker_max_tasks_per_child=100,  # Restart worker after 100 tasks (memory cleanup)
     worker_disable_rate_limits=True,  # We handle rate limiting in application logic
+    worker_hijack_root_logger=False,  # Keep configure_logging's queued handler and LOG_LEVELS
 )
 
+# traceparent in task headers -> each task's span continues the trace of the request that queued it
+trace_celery()
+
+# Statement counts per task - N+1 patterns and slow statements are logged with the task name
+audit_celery()
+
+# ============================================================================
+# WORKER BOOTSTRAP
+# Each child process imports the app and builds its WorkerResources (HTTP pool,
+# lender index, S3 client) once when it starts, instead of inside its first task.
+# LeadProcessingContext picks the resources up, so every task runs warm.
+# ============================================================================
+
+def _ensure_app_path():
+    """Make app.py importable from the worker (Railway runs tasks.py from another cwd)"""
+    app_path = os.path.dirname(os.path.abspath(__file__))
+    if app_path not in sys.path:
+        sys.path.insert(0, app_path)
+
+
+@worker_process_init.connect
+def bootstrap_worker(**kwargs):
+    """worker_process_init hook - warm this child before it takes a task"""
+    started = datetime.now()
+    try:
+        _ensure_app_path()
+        from app import init_worker_resources
+        init_worker_resources()
+        # Pool children may come up with default signal handlers - re-arm PROFILER_SIGNAL
+        from profiler import install_signal_handler
+        install_signal_handler()
+        # Webhook-lane children poll the outbox from boot, not only after their first drain task
+        if 'webhook' in WORKER_PROFILES.get(os.getenv('WORKER_PROFILE', ''), {}).get('queues', ()):
+            from webhook_dispatcher import dispatcher
+            dispatcher.start()
+        logger.info(f"[CELERY] Worker process {os.getpid()} bootstrapped in {(datetime.now() - started).total_seconds():.2f}s")
+    except Exception as e:
+        # Tasks still import the app lazily, so a failed warm-up only costs the first task
+        logger.error(f"[CELERY] Worker bootstrap failed in process {os.getpid()}: {e}")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker(**kwargs):
+    """worker_process_shutdown hook - close the child's HTTP pool and export its last spans"""
+    try:
+        from app import close_worker_resources
+        close_worker_resources()
+    except Exception:
+        pass
+    # Pool children exit without running atexit handlers
+    from tracing import exporter
+    exporter.flush()
+
+
 # ============================================================================
 # CELERY TASK: FLG Lead Processing
 # ============================================================================
@@ -127,6 +297,8 @@ def process_flg_leads_async(self, claim_id, summary, accounts, found_lenders, ad
     - Updates claim records with lead IDs
     - Sends webhook notifications
     - Automatically retries on failure with exponential backoff
+      (retries only resend leads whose LeadWorkItem is pending/failed - sent
+      leads are skipped and keep their FLG lead ids)
     
     Args:
         claim_id (int): ID of the claim in database
@@ -146,14 +318,8 @@ def process_flg_leads_async(self, claim_id, summary, accounts, found_lenders, ad
         retry_info = f"(attempt {self.request.retries + 1}/{self.max_retries + 1})"
         logger.info(f"[CELERY-{claim_id}] ▶ Starting FLG processing {retry_info}")
         
-        # Import app function here to avoid circular imports
-        # Fix import path for Railway deployment
-        import sys
-        import os
-        app_path = os.path.dirname(os.path.abspath(__file__))
-        if app_path not in sys.path:
-            sys.path.insert(0, app_path)
-        
+        # Import app function here to avoid circular imports (already loaded by bootstrap_worker)
+        _ensure_app_path()
         from app import process_flg_leads_background
 
 
@@ -188,6 +354,157 @@ def process_flg_leads_async(self, claim_id, summary, accounts, found_lenders, ad
         raise
 
 
+# ============================================================================
+# CELERY TASK: Batch import record
+# ============================================================================
+
+@celery_app.task(
+    bind=True,
+    name='tasks.process_batch_record_async',
+    acks_late=True,
+    reject_on_worker_lost=True,
+    time_limit=600,
+    soft_time_limit=540
+)
+def process_batch_record_async(self, record_id):
+    """
+    Celery task for one batch import record (query -> claim -> leads).
+
+    Failures are stored on the BatchRecord rather than retried here - the batch
+    can be retried from the batch page, which re-queues only the failed rows.
+    Finishing a record dispatches the next pending ones for the same batch.
+
+    Args:
+        record_id (int): ID of the BatchRecord
+
+    Returns:
+        str: Final record status (done / failed / skipped) or None if not runnable
+    """
+    _ensure_app_path()
+
+    from batch_processing import process_batch_record
+
+    logger.info(f"[CELERY-BATCH] ▶ Processing batch record {record_id}")
+    status = process_batch_record(record_id)
+    logger.info(f"[CELERY-BATCH] ✓ Batch record {record_id} finished: {status}")
+    return status
+
+
+# ============================================================================
+# CELERY TASKS: Chunked processing (many claims per message)
+# ============================================================================
+
+@celery_app.task(
+    bind=True,
+    name='tasks.process_batch_chunk_async',
+    acks_late=True,
+    reject_on_worker_lost=True,
+    time_limit=3600,
+    soft_time_limit=3540
+)
+def process_batch_chunk_async(self, items):
+    """
+    Celery task for a chunk of batch import records.
+
+    One message carries up to chunk_size records, which share one DB session, lender
+    index and HTTP pool, and whose outcomes are written with bulk updates/inserts.
+
+    Args:
+        items (list): [record_id, not_before_epoch] pairs (rate-limit start times)
+
+    Returns:
+        dict: Record counts per final status
+    """
+    _ensure_app_path()
+
+    from batch_processing import process_batch_chunk
+
+    logger.info(f"[CELERY-BATCH] ▶ Processing chunk of {len(items)} batch records")
+    counts = process_batch_chunk(items)
+    logger.info(f"[CELERY-BATCH] ✓ Chunk finished: {counts}")
+    return counts
+
+
+@celery_app.task(
+    bind=True,
+    name='tasks.process_flg_leads_chunk_async',
+    acks_late=True,
+    reject_on_worker_lost=True,
+    time_limit=3600,
+    soft_time_limit=3540
+)
+def process_flg_leads_chunk_async(self, claims):
+    """
+    Celery task for FLG lead processing of many claims in one message.
+
+    Args:
+        claims (list): dicts with claim_id, summary, accounts, found_lenders, additional_lenders
+            (the same arguments process_flg_leads_async takes)
+
+    Returns:
+        list: Results summary per claim, in input order
+    """
+    _ensure_app_path()
+
+    from app import process_flg_leads_chunk
+
+    logger.info(f"[CELERY-CHUNK] ▶ Processing {len(claims)} claims")
+    results = process_flg_leads_chunk(claims)
+    failed = sum(1 for result in results if result.get('error'))
+    logger.info(f"[CELERY-CHUNK] ✓ Chunk complete: {len(results) - failed} processed, {failed} errored")
+    return results
+
+
+# ============================================================================
+# CELERY TASK: Webhook delivery
+# ============================================================================
+
+@celery_app.task(
+    bind=True,
+    name='tasks.drain_webhook_outbox',
+    acks_late=True,
+    reject_on_worker_lost=True,
+    # The 45s budget is checked between passes, and one pass can run up to the outbox
+    # lease (160s by default) - never kill a pass that is mid-send
+    time_limit=240,
+    soft_time_limit=210
+)
+def drain_webhook_outbox(self):
+    """
+    Celery task delivering due webhook_outbox rows (webhook lane), queued after every
+    send_lead_ids_to_webhook. Retries are picked up by the child's dispatcher poll loop.
+    """
+    _ensure_app_path()
+    from webhook_dispatcher import dispatcher
+
+    dispatcher.drain(budget_seconds=45)
+    dispatcher.start()
+
+
+@celery_app.task(
+    bind=True,
+    name='tasks.send_webhook_async',
+    acks_late=True,
+    reject_on_worker_lost=True,
+    time_limit=60,
+    soft_time_limit=45
+)
+def send_webhook_async(self, webhook_url, payload):
+    """
+    Messages queued before the webhook outbox existed: moved into the outbox and drained.
+    Their URL carries the secret - it is stripped here and re-added by the dispatcher.
+
+    Args:
+        webhook_url (str): Destination URL
+        payload (dict): JSON body
+    """
+    _ensure_app_path()
+    from webhook_dispatcher import enqueue, strip_secret
+
+    enqueue(strip_secret(webhook_url), payload)
+    drain_webhook_outbox.apply_async(**lane_options('webhook'))
+
+
 # ============================================================================
 # HEALTH CHECK TASK (for monitoring)
 # ============================================================================
@@ -211,10 +528,14 @@ def health_check():
 # ============================================================================
 
 if __name__ == '__main__':
-    # Allow running worker directly: python tasks.py
-    celery_app.worker_main([
-        'worker',
-        '--loglevel=info',
-        '--concurrency=4',
-        '--max-tasks-per-child=100'
-    ])
\ No newline at end of file
+    # Allow running worker directly: python tasks.py [live|batch|webhook|all]
+    profile = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if profile not in WORKER_PROFILES:
+        raise SystemExit(f"Unknown worker profile '{profile}' - choose from {', '.join(WORKER_PROFILES)}")
+    os.environ['WORKER_PROFILE'] = profile  # read by bootstrap_worker in the pool children
+    # WORKER_METRICS_PORT=9100 serves this worker's histograms (all pool processes) for Prometheus
+    metrics_port = os.getenv('WORKER_METRICS_PORT')
+    if metrics_port:
+        from instrumentation import start_metrics_server
+        start_metrics_server(int(metrics_port))
+    celery_app.worker_main(worker_argv(profile))
\ No newline at end of file
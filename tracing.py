@@ -0,0 +1,582 @@
+"""
+Lightweight request tracing
+A trace id starts at the Flask request (or is continued from an incoming W3C traceparent
+header), rides along in contextvars, goes out on every requests call and Celery task publish as
+traceparent, and is picked up again in the worker. Spans cover the request, Celery tasks,
+outbound HTTP (Valifi, FLG, webhook), boto3 calls, SQL statements and the lead pipeline stages.
+
+Finished spans are batched and exported as OTLP/JSON (the OpenTelemetry wire format) to
+TRACE_EXPORT - "file:/path/traces.jsonl" or an OTLP/HTTP collector URL such as
+"http://otel-collector:4318/v1/traces". With TRACE_EXPORT unset ids are still propagated
+(and returned as X-Trace-Id) but nothing is recorded.
+
+    python tracing.py traces.jsonl --claim 123    # span tree of the trace(s) for claim 123
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").strip()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "valifi-batch")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "2000"))  # per trace - a batch chunk runs thousands of queries
+TRACE_EXPORT_BATCH = 512
+TRACE_EXPORT_SECONDS = 5.0
+TRACE_QUEUE_SIZE = 20000
+SQL_STATEMENT_CHARS = 300
+
+# OTLP span kinds / status codes
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_suppressed = contextvars.ContextVar("tracing_suppressed", default=False)
+
+
+# === SECTION SEPARATOR ===
+# Spans
+# === SECTION SEPARATOR ===
+
+class _TraceState:
+    """Shared by every span of one trace in this process"""
+    __slots__ = ("sampled", "spans", "dropped")
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.spans = 0
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "trace", "recording", "_token")
+
+    def __init__(self, name, trace_id, parent_id, trace, kind=INTERNAL, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_message = None
+        self.trace = trace
+        self._token = None
+        self.recording = trace.sampled and trace.spans < TRACE_MAX_SPANS
+        if trace.sampled:
+            if self.recording:
+                trace.spans += 1
+            else:
+                trace.dropped += 1
+
+    def set_attribute(self, key, value):
+        if self.recording and value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"[:500] if isinstance(error, BaseException) else str(error)[:500]
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def end(self, end_ns=None):
+        """Finish the span (and restore the previous current span if begin() made this one current)"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                _current_span.set(None)  # ended in a different context (greenlet) than it began
+            self._token = None
+        if self.recording:
+            exporter.submit(self)
+
+
+class _NoSpan:
+    """Returned when there's no active span - set_attribute() etc. are no-ops"""
+    trace_id = None
+    span_id = None
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def current_span():
+    return _current_span.get() or NO_SPAN
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def parse_traceparent(value):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent, or None"""
+    try:
+        version, trace_id, span_id, flags = (value or "").strip().split("-")
+        int(trace_id, 16), int(span_id, 16), int(flags, 16)
+    except ValueError:
+        return None
+    if version != "00" or len(trace_id) != 32 or len(span_id) != 16 or set(trace_id) == {"0"}:
+        return None
+    return trace_id, span_id, int(flags, 16) & 1 == 1
+
+
+def _should_sample():
+    return bool(TRACE_EXPORT) and random.random() < TRACE_SAMPLE_RATE
+
+
+def begin(name, kind=INTERNAL, attributes=None, traceparent=None, start_ns=None):
+    """
+    Start a span as a child of the current one (or of the traceparent given, or a new trace)
+    and make it current until span.end(). Prefer start_span() where a with-block fits.
+    """
+    parent = _current_span.get()
+    remote = parse_traceparent(traceparent) if traceparent and parent is None else None
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, parent.trace, kind, attributes, start_ns)
+    elif remote:
+        trace_id, parent_id, sampled = remote
+        span = Span(name, trace_id, parent_id, _TraceState(sampled and bool(TRACE_EXPORT)), kind, attributes, start_ns)
+    else:
+        span = Span(name, secrets.token_hex(16), None, _TraceState(_should_sample()), kind, attributes, start_ns)
+    span._token = _current_span.set(span)
+    return span
+
+
+@contextmanager
+def start_span(name, kind=INTERNAL, **attributes):
+    span = begin(name, kind, attributes)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        span.end()
+
+
+def traced(name=None, kind=INTERNAL):
+    """Decorator: run the function inside a span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None and not TRACE_EXPORT:
+                return func(*args, **kwargs)
+            with start_span(span_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name, start_ns, end_ns, **attributes):
+    """A finished child span of the current one (for work timed elsewhere, e.g. pipeline laps)"""
+    parent = _current_span.get()
+    if parent is None or not parent.recording:
+        return
+    span = Span(name, parent.trace_id, parent.span_id, parent.trace, INTERNAL, attributes, start_ns)
+    span.end(end_ns)
+
+
+def bind_context(func):
+    """func wrapped to run in a copy of the caller's context (for threads the trace should follow)"""
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+# === SECTION SEPARATOR ===
+# Export (OTLP/JSON)
+# === SECTION SEPARATOR ===
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def span_to_otlp(span):
+    entry = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": span.status},
+    }
+    if span.parent_id:
+        entry["parentSpanId"] = span.parent_id
+    if span.status_message:
+        entry["status"]["message"] = span.status_message
+    return entry
+
+
+def otlp_payload(spans):
+    """ExportTraceServiceRequest body for a batch of finished spans"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [span_to_otlp(span) for span in spans],
+            }],
+        }]
+    }
+
+
+class SpanExporter:
+    """
+    Finished spans go onto a bounded queue (dropped when full - tracing never blocks a request)
+    and a background thread writes them out in batches. The thread is (re)started lazily per
+    process, so forked gunicorn/Celery children get their own.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.dropped = 0
+        self._pid = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                first_time = self._pid is None
+                self._queue = queue.Queue(TRACE_QUEUE_SIZE)
+                threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+                self._pid = os.getpid()
+                if first_time:
+                    atexit.register(self.flush)
+
+    def submit(self, span):
+        if not self.target:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def state(self):
+        """Queued and dropped span counts for this process"""
+        return {"queued": self._queue.qsize() if self._pid == os.getpid() else 0, "dropped": self.dropped}
+
+    def flush(self):
+        """Export whatever is still queued, synchronously (process exit / worker shutdown)"""
+        if self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            token = _suppressed.set(True)
+            try:
+                self.export(batch)
+            except Exception as e:
+                logger.warning(f"[TRACE] Final export of {len(batch)} spans failed: {e}")
+            finally:
+                _suppressed.reset(token)
+
+    def _run(self):
+        _suppressed.set(True)  # the exporter's own HTTP calls aren't traced
+        spans_queue = self._queue
+        while True:
+            batch = [spans_queue.get()]
+            deadline = time.monotonic() + TRACE_EXPORT_SECONDS
+            while len(batch) < TRACE_EXPORT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(spans_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                logger.warning(f"[TRACE] Export of {len(batch)} spans failed: {e}")
+
+    def export(self, spans):
+        body = json.dumps(otlp_payload(spans), separators=(",", ":"))
+        if self.target.startswith("file:"):
+            with open(self.target[len("file:"):], "a", encoding="utf-8") as handle:
+                handle.write(body + "\n")
+        else:
+            import requests
+            requests.post(self.target, data=body, headers={"Content-Type": "application/json"}, timeout=5).raise_for_status()
+
+
+exporter = SpanExporter(TRACE_EXPORT)
+
+
+# === SECTION SEPARATOR ===
+# Integrations
+# === SECTION SEPARATOR ===
+
+def trace_flask(flask_app):
+    """Server span per request, continued from an incoming traceparent; X-Trace-Id on the response"""
+    from flask import g, request
+
+    @flask_app.before_request
+    def _start_request_span():
+        g.trace_span = begin(
+            f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}",
+            SERVER,
+            {"http.method": request.method, "http.target": request.path},
+            traceparent=request.headers.get("traceparent")
+        )
+
+    @flask_app.after_request
+    def _tag_response(response):
+        span = g.get("trace_span")
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+    @flask_app.teardown_request
+    def _end_request_span(error=None):
+        span = g.pop("trace_span", None)
+        if span is not None:
+            if error is not None:
+                span.set_error(error)
+            span.end()
+
+
+def trace_requests():
+    """Client span + traceparent header on every requests call made inside a trace"""
+    import requests
+
+    if getattr(requests.Session.send, "_traced", False):
+        return
+    original_send = requests.Session.send
+
+    @wraps(original_send)
+    def send(self, prepared, **kwargs):
+        if _current_span.get() is None or _suppressed.get():
+            return original_send(self, prepared, **kwargs)
+        url = prepared.url.split("?", 1)[0]
+        span = begin(f"HTTP {prepared.method}", CLIENT, {"http.method": prepared.method, "http.url": url})
+        try:
+            prepared.headers["traceparent"] = span.traceparent
+            response = original_send(self, prepared, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+            return response
+        except BaseException as e:
+            # Connection errors quote the URL - keep query strings (webhook secret, keys) out of spans
+            message = f"{type(e).__name__}: {e}"
+            for quoted in (prepared.url, prepared.path_url):
+                message = message.replace(quoted, quoted.split("?", 1)[0])
+            span.set_error(message)
+            raise
+        finally:
+            span.end()
+
+    send._traced = True
+    requests.Session.send = send
+
+
+def trace_engine(engine):
+    """Span per SQL statement executed inside a sampled trace (statement text only, never parameters)"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is not None and parent.recording:
+            conn.info.setdefault("trace_started", []).append(time.time_ns())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("trace_started")
+        if started:
+            record_span(
+                "db " + (statement.split(None, 1)[0].upper() if statement.strip() else "SQL"),
+                started.pop(), time.time_ns(),
+                **{"db.system": conn.dialect.name, "db.statement": statement[:SQL_STATEMENT_CHARS],
+                   "db.executemany": executemany}
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        started = context.connection.info.get("trace_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def trace_boto_client(client):
+    """Client span per boto3 call (S3 puts, SNS publishes) made inside a sampled trace"""
+    if client is None:
+        return client
+    service = client.meta.service_model.service_name
+
+    def before_call(model=None, context=None, **kwargs):
+        parent = _current_span.get()
+        if context is not None and parent is not None and parent.recording:
+            context["trace_started"] = time.time_ns()
+
+    def after_call(http_response=None, model=None, context=None, **kwargs):
+        started = (context or {}).pop("trace_started", None)
+        if started is not None:
+            record_span(f"aws {service}.{model.name if model else 'call'}", started, time.time_ns(),
+                        **{"rpc.system": "aws-api", "http.status_code": getattr(http_response, "status_code", None)})
+
+    client.meta.events.register("before-call.*.*", before_call)
+    client.meta.events.register("after-call.*.*", after_call)
+    return client
+
+
+def trace_celery():
+    """traceparent into published task headers; a consumer span around each task in the worker"""
+    from celery.signals import before_task_publish, task_prerun, task_postrun, task_failure
+
+    task_spans = {}
+
+    @before_task_publish.connect(weak=False)
+    def _inject(headers=None, **kwargs):
+        span = _current_span.get()
+        if span is not None and headers is not None:
+            headers["traceparent"] = span.traceparent
+
+    @task_prerun.connect(weak=False)
+    def _start_task_span(task_id=None, task=None, **kwargs):
+        traceparent = getattr(task.request, "traceparent", None)
+        if traceparent is None and not TRACE_EXPORT:
+            return
+        # A task runs in the worker's own context - never nest under a leftover span
+        _current_span.set(None)
+        task_spans[task_id] = begin(
+            f"celery {task.name}", CONSUMER,
+            {"celery.task_id": task_id, "celery.queue": (task.request.delivery_info or {}).get("routing_key")},
+            traceparent=traceparent
+        )
+
+    @task_failure.connect(weak=False)
+    def _mark_failed(task_id=None, exception=None, **kwargs):
+        span = task_spans.get(task_id)
+        if span is not None:
+            span.set_error(exception)
+
+    @task_postrun.connect(weak=False)
+    def _end_task_span(task_id=None, state=None, **kwargs):
+        span = task_spans.pop(task_id, None)
+        if span is not None:
+            span.set_attribute("celery.state", state)
+            span.end()
+            _current_span.set(None)
+
+
+# === SECTION SEPARATOR ===
+# Reading a trace file
+# === SECTION SEPARATOR ===
+
+def load_spans(path):
+    spans = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    spans.extend(scope.get("spans", []))
+    return spans
+
+
+def _attributes(span):
+    return {item["key"]: next(iter(item["value"].values())) for item in span.get("attributes", [])}
+
+
+def format_trace(spans, trace_id):
+    """Indented span tree with durations for one trace"""
+    spans = sorted((s for s in spans if s["traceId"] == trace_id), key=lambda s: int(s["startTimeUnixNano"]))
+    children = {}
+    for span in spans:
+        children.setdefault(span.get("parentSpanId"), []).append(span)
+    known = {span["spanId"] for span in spans}
+    lines = [f"trace {trace_id}"]
+
+    def walk(span, depth):
+        ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+        error = " ERROR " + span["status"].get("message", "") if span["status"].get("code") == STATUS_ERROR else ""
+        lines.append(f"{'  ' * depth}{ms:10.1f} ms  {span['name']}{error}")
+        for child in children.get(span["spanId"], []):
+            walk(child, depth + 1)
+
+    for span in spans:
+        if span.get("parentSpanId") not in known:
+            walk(span, 1)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show traces from a TRACE_EXPORT=file: trace file")
+    parser.add_argument("path")
+    parser.add_argument("--claim", help="claim id (lead pipeline / upload_summary spans carry claim_id)")
+    parser.add_argument("--trace", help="trace id")
+    parser.add_argument("--slowest", type=int, default=0, help="show the N slowest traces")
+    args = parser.parse_args()
+
+    all_spans = load_spans(args.path)
+    if args.trace:
+        trace_ids = [args.trace]
+    elif args.claim:
+        trace_ids = sorted({s["traceId"] for s in all_spans if str(_attributes(s).get("claim_id")) == args.claim})
+    else:
+        roots = [s for s in all_spans if "parentSpanId" not in s]
+        roots.sort(key=lambda s: int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"]), reverse=True)
+        trace_ids = [s["traceId"] for s in roots[:args.slowest or 10]]
+    for trace_id in trace_ids:
+        print(format_trace(all_spans, trace_id))
+        print()
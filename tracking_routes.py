@@ -11,6 +11,7 @@ import re
 import secrets
 
 from tracking_models import VisitorSession, OfflineCampaign, TrafficSpike
+from log_config import sampled
 
 logger = logging.getLogger(__name__)
 
@@ -411,7 +412,7 @@ def track_visitor():
             visitor_session.browser = browser
             visitor_session.ip_address = ip_address
             
-            logger.info(f"Updated existing visitor session: {session_id}")
+            logger.info("Updated existing visitor session: %s", session_id, extra=sampled("visitor_session_updated"))
             
         else:
             # CREATE new session only if it doesn't exist
@@ -453,7 +454,7 @@ def track_visitor():
                 ip_address=ip_address
             )
             session.add(visitor_session)
-            logger.info(f"Created new visitor session: {session_id}")
+            logger.info("Created new visitor session: %s", session_id, extra=sampled("visitor_session_created"))
         
         session.commit()
         
@@ -524,7 +525,7 @@ def track_form_event():
             visitor_session.last_activity = datetime.utcnow()
             session.commit()  # REMOVED session.close()
             
-            logger.info(f"Tracked form event: {event_type} at {form_stage}")
+            logger.info("Tracked form event: %s at %s", event_type, form_stage, extra=sampled("form_event"))
         
         return jsonify({"tracked": True}), 200
         
@@ -617,7 +618,7 @@ def update_visitor_data():
                 last_activity=datetime.utcnow()
             )
             session.add(visitor_session)
-            logger.info(f"Created new session in update-visitor-data: {session_id}")
+            logger.info("Created new session in update-visitor-data: %s", session_id, extra=sampled("visitor_session_created"))
         else:
             # Update last activity for existing session
             visitor_session.last_activity = datetime.utcnow()
@@ -0,0 +1,238 @@
+"""
+Upstream protection for Valifi and FLG calls
+Each upstream gets an AIMD concurrency limit driven by observed latency and errors, and a
+circuit breaker with half-open probing. Calls beyond the limit wait briefly and are then
+shed; calls to an open circuit fail fast - either way with UpstreamUnavailable, which
+retry_with_backoff never retries.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Call rejected locally - circuit open or concurrency limit full"""
+
+    def __init__(self, upstream, reason):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+# === SECTION SEPARATOR ===
+# Concurrency limit
+# === SECTION SEPARATOR ===
+
+class AdaptiveLimiter:
+    """
+    Additive increase / multiplicative decrease concurrency limit.
+    A fast success adds 1/limit (about +1 per limit's worth of calls); an error, timeout or
+    a call slower than slow_call_seconds multiplies the limit by backoff_ratio, at most once
+    per decrease_cooldown so one burst of in-flight failures doesn't collapse it to the floor.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=2, max_limit=200, slow_call_seconds=10.0,
+                 backoff_ratio=0.7, decrease_cooldown=1.0, max_wait_seconds=10.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slow_call_seconds = slow_call_seconds
+        self.backoff_ratio = backoff_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting up to max_wait_seconds. Returns False when shed."""
+        deadline = time.monotonic() + self.max_wait_seconds
+        with self._condition:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency, failed):
+        with self._condition:
+            self.in_flight -= 1
+            if failed or latency > self.slow_call_seconds:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._last_decrease = now
+            elif self.in_flight + 1 >= int(self.limit):
+                # Only grow when the limit is actually what's holding calls back
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+# === SECTION SEPARATOR ===
+# Circuit breaker
+# === SECTION SEPARATOR ===
+
+class CircuitBreaker:
+    """
+    closed -> open when at least failure_threshold of the last window_size calls failed
+    (after min_calls). open -> half_open after open_seconds, which lets half_open_probes
+    calls through: success closes the circuit, failure reopens it for twice as long
+    (capped at max_open_seconds).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=0.5, window_size=20, min_calls=10,
+                 open_seconds=15.0, max_open_seconds=120.0, half_open_probes=1):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    return False
+                self._probes += 1
+            return True
+
+    def cancel_probe(self):
+        """A call that allow() let through never reached the upstream"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, failed):
+        """Returns the new state when this outcome changed it, else None"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed:
+                    self.open_seconds = min(self.max_open_seconds, self.open_seconds * 2)
+                    return self._open()
+                self.state = self.CLOSED
+                self.open_seconds = self.base_open_seconds
+                self._outcomes.clear()
+                return self.CLOSED
+
+            if self.state == self.OPEN:
+                return None
+
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls:
+                failure_rate = sum(self._outcomes) / len(self._outcomes)
+                if failure_rate >= self.failure_threshold:
+                    return self._open()
+            return None
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        return self.OPEN
+
+
+# === SECTION SEPARATOR ===
+# Guard
+# === SECTION SEPARATOR ===
+
+def is_upstream_failure(result=None, error=None):
+    """
+    Whether an outcome counts against the upstream's health.
+    Timeouts, connection errors, 5xx and 429 do; other 4xx are the caller's fault and don't.
+    """
+    if error is not None:
+        response = getattr(error, "response", None)
+        if response is not None:
+            return response.status_code >= 500 or response.status_code == 429
+        return isinstance(error, (requests.exceptions.RequestException, OSError))
+
+    status = getattr(result, "status_code", None)
+    if status is None and isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
+        status = result[1]  # (json, status_code) helpers
+    return status is not None and (status >= 500 or status == 429)
+
+
+class UpstreamGuard:
+    """Concurrency limit + circuit breaker for one upstream"""
+
+    def __init__(self, name, limiter=None, breaker=None, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {"calls": 0, "failures": 0, "shed": 0, "rejected_open": 0}
+
+    def call(self, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        if not self.breaker.allow():
+            self.stats["rejected_open"] += 1
+            raise UpstreamUnavailable(self.name, "circuit open")
+        if not self.limiter.acquire():
+            self.stats["shed"] += 1
+            self.breaker.cancel_probe()
+            raise UpstreamUnavailable(self.name, f"concurrency limit {int(self.limiter.limit)} reached")
+
+        self.stats["calls"] += 1
+        started = time.monotonic()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = is_upstream_failure(result=result)
+            return result
+        except Exception as e:
+            failed = is_upstream_failure(error=e)
+            raise
+        finally:
+            latency = time.monotonic() - started
+            self.limiter.release(latency, failed)
+            if failed:
+                self.stats["failures"] += 1
+            changed = self.breaker.record(failed)
+            if changed == CircuitBreaker.OPEN:
+                logger.error(f"[UPSTREAM] {self.name} circuit OPEN for {self.breaker.open_seconds:.0f}s (limit {self.limiter.limit:.1f})")
+            elif changed == CircuitBreaker.CLOSED:
+                logger.info(f"[UPSTREAM] {self.name} circuit closed again")
+
+    def __call__(self, func):
+        """Decorator form: @guard"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return wrapper
+
+    def snapshot(self):
+        return {
+            "state": self.breaker.state,
+            "limit": round(self.limiter.limit, 1),
+            "in_flight": self.limiter.in_flight,
+            "waiting": self.limiter.waiting,
+            **self.stats
+        }
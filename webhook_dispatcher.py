@@ -0,0 +1,467 @@
+"""
+Outbound lead-id webhook delivery
+send_lead_ids_to_webhook() only writes a webhook_outbox row; delivery happens here. drain()
+claims due rows with FOR UPDATE SKIP LOCKED - so every web process and webhook-lane worker can
+drain the same outbox without double sends - and posts them through a bounded pool of
+WEBHOOK_CONCURRENCY senders sharing one HTTP session per process. A burst of claims waits in
+the table instead of opening a socket per claim.
+
+Each process that delivers runs one dispatcher thread (a greenlet under gevent) polling every
+WEBHOOK_POLL_SECONDS for retries and rows other processes left behind. Webhook-lane Celery
+children start it when they boot; without Celery each web worker starts it with its first
+request (gunicorn forks after --preload, so never at import).
+
+A claimed row is leased for LEASE_SECONDS - long enough for a whole pass of CLAIM_LIMIT rows
+through the sender pool at WEBHOOK_TIMEOUT_SECONDS each - and results are only written to rows
+still held by that lease, so a pass that overran can't overwrite another process's attempt.
+
+WEBHOOK_BATCH_SIZE > 1 - only for a receiver that accepts several claims' lead ids in one
+{"leads": [...]} body - sends up to that many due rows for the same URL as one POST. Failures
+are retried with exponential backoff and jitter until WEBHOOK_MAX_ATTEMPTS, then left 'failed';
+4xx responses other than 408/429 are not retried.
+
+Rows store the receiver URL without its secret; signed_url() adds WEBHOOK_SECRET at send time
+and delivery errors are redacted, so the secret never lands in the table or the logs.
+"""
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from instrumentation import WEBHOOK_DELIVERIES, WEBHOOK_DELIVERY_DELAY_SECONDS, timed_upstream
+from log_config import truncate
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "1"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "900"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "15"))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_OUTBOX_RETENTION_DAYS", "7"))
+CLAIM_LIMIT = 50
+# A row still 'sending' this long after it was claimed belongs to a process that died mid-send:
+# every round of the pass timing out, plus a margin for claiming and recording
+LEASE_SECONDS = math.ceil(CLAIM_LIMIT / WEBHOOK_CONCURRENCY) * WEBHOOK_TIMEOUT_SECONDS + 30
+PRUNE_EVERY_PASSES = 200
+RETRYABLE_4XX = (408, 429)
+
+OutboxItem = namedtuple("OutboxItem", "id url payload attempts created_at")
+
+
+def retry_delay(attempts):
+    """Seconds before retry number attempts: exponential, capped, with the upper half jittered"""
+    ceiling = min(WEBHOOK_RETRY_MAX_SECONDS, WEBHOOK_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def group_deliveries(items, batch_size=None):
+    """
+    Outbox items -> [(url, payload, items)] POSTs. Items for the same URL are merged into one
+    {"leads": [...]} body, batch_size at a time; anything else goes on its own.
+    """
+    batch_size = max(1, WEBHOOK_BATCH_SIZE if batch_size is None else batch_size)
+    deliveries = []
+    mergeable = {}
+    for item in items:
+        if batch_size > 1 and set(item.payload) == {"leads"}:
+            mergeable.setdefault(item.url, []).append(item)
+        else:
+            deliveries.append((item.url, item.payload, [item]))
+    for url, url_items in mergeable.items():
+        for start in range(0, len(url_items), batch_size):
+            group = url_items[start:start + batch_size]
+            leads = [lead for item in group for lead in item.payload["leads"]]
+            deliveries.append((url, {"leads": leads}, group))
+    return deliveries
+
+
+def strip_secret(url):
+    """url without a secret= query parameter - what the outbox stores"""
+    parts = urlsplit(url or "")
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if not any(key == "secret" for key, _ in query):
+        return url
+    return urlunsplit(parts._replace(query=urlencode([(key, value) for key, value in query if key != "secret"])))
+
+
+def signed_url(url):
+    """url with WEBHOOK_SECRET appended, as Config.WEBHOOK_URL builds it - only at send time"""
+    from app import Config
+
+    url = strip_secret(url)
+    if url and Config.WEBHOOK_SECRET:
+        separator = "&" if "?" in url else "?"
+        return f"{url}{separator}secret={Config.WEBHOOK_SECRET}"
+    return url
+
+
+def redact(text):
+    """text with WEBHOOK_SECRET (raw or URL-encoded) masked - request errors quote the URL"""
+    from app import Config
+
+    secret = Config.WEBHOOK_SECRET
+    if not secret or not text:
+        return text
+    return text.replace(secret, "***").replace(quote(secret, safe=""), "***")
+
+
+@timed_upstream("webhook", "lead_ids")
+def post_webhook(http, url, payload):
+    return http.post(
+        url,
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        timeout=WEBHOOK_TIMEOUT_SECONDS
+    )
+
+
+# === SECTION SEPARATOR ===
+# Outbox storage
+# === SECTION SEPARATOR ===
+
+def enqueue(webhook_url, payload, claim_id=None, session_db=None):
+    """Write an outbox row (committed) and return its id - any secret= in the URL is dropped"""
+    from app import SessionLocal, WebhookOutbox
+
+    own_session = session_db is None
+    session_db = SessionLocal() if own_session else session_db
+    try:
+        row = WebhookOutbox(
+            claim_id=claim_id,
+            webhook_url=strip_secret(webhook_url),
+            payload=json.dumps(payload),
+            status='pending',
+            attempts=0,
+            next_attempt_at=datetime.utcnow()
+        )
+        session_db.add(row)
+        session_db.commit()
+        return row.id
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        if own_session:
+            session_db.close()
+
+
+def claim_due(limit=CLAIM_LIMIT):
+    """Lease up to limit due rows (pending, or sending past their lease) to this process"""
+    from app import SessionLocal, WebhookOutbox
+
+    now = datetime.utcnow()
+    session_db = SessionLocal()
+    try:
+        rows = session_db.query(WebhookOutbox).filter(
+            WebhookOutbox.status.in_(('pending', 'sending')),
+            WebhookOutbox.next_attempt_at <= now
+        ).order_by(WebhookOutbox.next_attempt_at, WebhookOutbox.id).limit(limit).with_for_update(skip_locked=True).all()
+
+        items = []
+        for row in rows:
+            row.status = 'sending'
+            row.attempts = (row.attempts or 0) + 1
+            row.next_attempt_at = now + timedelta(seconds=LEASE_SECONDS)
+            try:
+                payload = json.loads(row.payload)
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                row.status = 'failed'
+                row.last_error = "Outbox payload is not a JSON object"
+                continue
+            items.append(OutboxItem(row.id, row.webhook_url, payload, row.attempts, row.created_at))
+        session_db.commit()
+        return items
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+
+def _update_leased(session_db, ids, attempts, values):
+    """Apply values to the rows still held by this lease ('sending', same attempt); returns their ids"""
+    from app import WebhookOutbox
+    from sqlalchemy import update
+
+    statement = update(WebhookOutbox).where(
+        WebhookOutbox.id.in_(ids),
+        WebhookOutbox.status == 'sending',
+        WebhookOutbox.attempts == attempts
+    ).values(**values).returning(WebhookOutbox.id)
+    return {row[0] for row in session_db.execute(statement)}
+
+
+def record_results(results):
+    """
+    results: [(items, error, retryable)] - error None when the POST was accepted.
+    Rows whose lease expired meanwhile (re-claimed elsewhere) are left to their new owner.
+    """
+    from app import SessionLocal
+
+    now = datetime.utcnow()
+    sent_by_attempts = {}
+    for items, error, _ in results:
+        if error is None:
+            for item in items:
+                sent_by_attempts.setdefault(item.attempts, []).append(item.id)
+
+    session_db = SessionLocal()
+    sent_ids = set()
+    outcomes = {"retry": 0, "failed": 0}
+    lost = 0
+    try:
+        for attempts, ids in sent_by_attempts.items():
+            updated = _update_leased(session_db, ids, attempts, {"status": 'sent', "sent_at": now, "last_error": None})
+            sent_ids |= updated
+            lost += len(ids) - len(updated)
+        for items, error, retryable in results:
+            if error is None:
+                continue
+            for item in items:
+                values = {"last_error": error[:2000]}
+                if retryable and item.attempts < WEBHOOK_MAX_ATTEMPTS:
+                    outcome = "retry"
+                    values.update(status='pending', next_attempt_at=now + timedelta(seconds=retry_delay(item.attempts)))
+                else:
+                    outcome = "failed"
+                    values.update(status='failed')
+                if _update_leased(session_db, [item.id], item.attempts, values):
+                    outcomes[outcome] += 1
+                else:
+                    lost += 1
+        session_db.commit()
+    except Exception:
+        session_db.rollback()
+        raise
+    finally:
+        session_db.close()
+
+    if lost:
+        logger.warning(f"[WEBHOOK] {lost} outbox row(s) outlived their {LEASE_SECONDS:.0f}s lease - result left to the process that re-claimed them")
+    if sent_ids:
+        WEBHOOK_DELIVERIES.labels("sent").inc(len(sent_ids))
+        for items, error, _ in results:
+            if error is None:
+                for item in items:
+                    if item.id in sent_ids and item.created_at:
+                        WEBHOOK_DELIVERY_DELAY_SECONDS.observe(max(0.0, (now - item.created_at).total_seconds()))
+    for outcome, count in outcomes.items():
+        if count:
+            WEBHOOK_DELIVERIES.labels(outcome).inc(count)
+    return len(sent_ids), outcomes["retry"], outcomes["failed"]
+
+
+def seconds_until_next_due():
+    """Seconds until the earliest pending/sending row is due, or None when the outbox is idle"""
+    from app import SessionLocal, WebhookOutbox
+    from sqlalchemy import func
+
+    session_db = SessionLocal()
+    try:
+        earliest = session_db.query(func.min(WebhookOutbox.next_attempt_at)).filter(
+            WebhookOutbox.status.in_(('pending', 'sending'))
+        ).scalar()
+    finally:
+        session_db.close()
+    if earliest is None:
+        return None
+    return max(0.0, (earliest - datetime.utcnow()).total_seconds())
+
+
+def prune_sent(session_db):
+    """Delete delivered rows older than WEBHOOK_OUTBOX_RETENTION_DAYS"""
+    from app import WebhookOutbox
+
+    cutoff = datetime.utcnow() - timedelta(days=WEBHOOK_RETENTION_DAYS)
+    deleted = session_db.query(WebhookOutbox).filter(
+        WebhookOutbox.status == 'sent',
+        WebhookOutbox.sent_at < cutoff
+    ).delete(synchronize_session=False)
+    session_db.commit()
+    return deleted
+
+
+def outbox_backlog(session_db):
+    """Undelivered row counts by status and the age of the oldest one, for /metrics"""
+    from app import WebhookOutbox
+    from sqlalchemy import func
+
+    rows = session_db.query(
+        WebhookOutbox.status, func.count(WebhookOutbox.id), func.min(WebhookOutbox.created_at)
+    ).filter(WebhookOutbox.status.in_(('pending', 'sending', 'failed'))).group_by(WebhookOutbox.status).all()
+
+    backlog = {"pending": 0, "sending": 0, "failed": 0, "oldest_undelivered_seconds": None}
+    oldest = None
+    for status, count, created_at in rows:
+        backlog[status] = count
+        if status != 'failed' and created_at is not None:
+            oldest = created_at if oldest is None else min(oldest, created_at)
+    if oldest is not None:
+        backlog["oldest_undelivered_seconds"] = round((datetime.utcnow() - oldest).total_seconds(), 1)
+    return backlog
+
+
+# === SECTION SEPARATOR ===
+# Dispatcher
+# === SECTION SEPARATOR ===
+
+class WebhookDispatcher:
+    """
+    Bounded sender pool plus a background drain loop, both created lazily per process, so
+    forked gunicorn workers and Celery children get their own.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.last_error = None
+        self._pid = None
+        self._thread_pid = None
+        self._executor = None
+        self._http = None
+        self._wake = None
+        self._passes = 0
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+    def _ensure_pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=WEBHOOK_CONCURRENCY, thread_name_prefix="webhook-sender")
+                    self._http = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=WEBHOOK_CONCURRENCY)
+                    self._http.mount("http://", adapter)
+                    self._http.mount("https://", adapter)
+                    self._wake = threading.Event()
+                    self._pid = os.getpid()
+        return self._executor, self._http
+
+    def start(self):
+        """Start this process's drain loop if it isn't running"""
+        self._ensure_pool()
+        if self._thread_pid != os.getpid():
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True).start()
+                    self._thread_pid = os.getpid()
+
+    def wake(self):
+        """Have this process's drain loop drain now"""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                next_due = self.drain()
+            except Exception as e:
+                next_due = None
+                logger.error(f"[WEBHOOK] Outbox drain failed: {e}")
+            self._wake.wait(WEBHOOK_POLL_SECONDS if next_due is None else min(next_due, WEBHOOK_POLL_SECONDS))
+
+    def _deliver(self, http, delivery):
+        """POST one delivery; returns (items, error, retryable)"""
+        url, payload, items = delivery
+        with self._count_lock:
+            self.in_flight += 1
+        try:
+            response = post_webhook(http, signed_url(url), payload)
+        except requests.exceptions.RequestException as e:
+            return items, redact(f"{type(e).__name__}: {e}"), True
+        finally:
+            with self._count_lock:
+                self.in_flight -= 1
+        if 200 <= response.status_code < 300:
+            logger.debug("[WEBHOOK] Delivered %s lead ids from %s claim(s)", len(payload.get("leads", ())), len(items))
+            return items, None, False
+        retryable = response.status_code >= 500 or response.status_code in RETRYABLE_4XX
+        return items, redact(f"HTTP {response.status_code}: {truncate(response.content, 500)}"), retryable
+
+    def drain(self, budget_seconds=None):
+        """
+        Deliver due outbox rows until none are left (or budget_seconds has passed).
+        Returns seconds until the next row is due - 0 when due rows remain - or None when idle.
+        """
+        executor, http = self._ensure_pool()
+        deadline = time.monotonic() + budget_seconds if budget_seconds else None
+        while True:
+            items = claim_due()
+            if not items:
+                break
+            results = list(executor.map(lambda delivery: self._deliver(http, delivery), group_deliveries(items)))
+            sent, retried, failed = record_results(results)
+            self.sent += sent
+            self.retried += retried
+            self.failed += failed
+            for delivered, error, retryable in results:
+                if error is not None:
+                    self.last_error = error[:200]
+                    log = logger.warning if retryable else logger.error
+                    log(f"[WEBHOOK] Delivery of {len(delivered)} outbox row(s) failed: {truncate(error, 300)}")
+            if len(items) < CLAIM_LIMIT:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                return 0.0
+
+        self._passes += 1
+        if self._passes % PRUNE_EVERY_PASSES == 0:
+            self._prune()
+        return seconds_until_next_due()
+
+    def _prune(self):
+        from app import SessionLocal
+
+        session_db = SessionLocal()
+        try:
+            deleted = prune_sent(session_db)
+            if deleted:
+                logger.info(f"[WEBHOOK] Pruned {deleted} delivered outbox rows")
+        except Exception as e:
+            session_db.rollback()
+            logger.warning(f"[WEBHOOK] Outbox prune failed: {e}")
+        finally:
+            session_db.close()
+
+    def send_now(self, webhook_url, payload):
+        """Best-effort single POST on the sender pool, for when the outbox can't be written (secret added at send)"""
+        executor, http = self._ensure_pool()
+
+        def send():
+            _, error, _ = self._deliver(http, (webhook_url, payload, []))
+            if error:
+                logger.error(f"[WEBHOOK] Direct send failed (not retried): {truncate(error, 300)}")
+
+        executor.submit(send)
+
+    def state(self):
+        """This process's sender pool and delivery counts"""
+        return {
+            "concurrency": WEBHOOK_CONCURRENCY,
+            "batch_size": WEBHOOK_BATCH_SIZE,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+
+dispatcher = WebhookDispatcher()